@@ -1,12 +1,55 @@
 import streamlit as st
-from streamlit_local_storage import LocalStorage
+import concurrent.futures
+import contextlib
 import os
 import random
 import json
-import genailib
+import uuid
+import envfile  # ✅ Loads .env before the config modules below read os.getenv
 import chatmessage
-
-localS = LocalStorage()
+from citations import CitationCollector
+from conversation import ConversationWindow
+from streambuffer import StreamBuffer, render_stream
+
+# ⚡ History Display Configuration (older messages are only rendered on request)
+HISTORY_PAGE_MESSAGES = int(os.getenv("HISTORY_PAGE_MESSAGES", "20"))
+
+def _load_backend():
+    import genailib
+
+    genailib.warm_up()
+    return genailib
+
+# ✅ genailib (boto3, AWS clients, local index) is imported once per process on a background thread,
+# so a new replica renders the page straight away and the warm-up overlaps the user typing
+@st.cache_resource(show_spinner=False)
+def start_backend():
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="warm-up")
+    future = executor.submit(_load_backend)
+    executor.shutdown(wait=False)
+    return future
+
+def get_backend():
+    """The warmed-up genailib module (waits for the warm-up if it is still running)."""
+    try:
+        return start_backend().result()
+    except Exception:
+        start_backend.clear()  # ✅ Retry on the next run instead of caching the failure
+        raise
+
+start_backend()
+
+def get_local_storage():
+    """A LocalStorage helper holding this run's copy of the browser's items."""
+    from streamlit_local_storage import LocalStorage
+
+    mounted = "storage_init" in st.session_state
+    local_storage = LocalStorage(key="storage_init")
+    if mounted:
+        local_storage.refreshItems()  # ✅ Re-read the component value instead of the first-run snapshot
+    return local_storage
+
+localS = get_local_storage()
 
 st.markdown(
     """
@@ -36,22 +79,55 @@ st.markdown(
     unsafe_allow_html=True
 )
 
+# ✅ On the first run the LocalStorage component has not reported back yet and getAll() is its default {};
+# rerun once so the stored session id is read instead of being overwritten with a new one
+if "sessionId" not in st.session_state and not localS.getAll() and not st.session_state.get("local_storage_waited"):
+    st.session_state.local_storage_waited = True
+    st.rerun()
+
+# ✅ Session ID (kept in LocalStorage) names this browser's append-only chat log
+if "sessionId" not in st.session_state:
+    st.session_state.sessionId = localS.getItem("sessionId") or str(uuid.uuid4())
+    localS.setItem("sessionId", st.session_state.sessionId, key="set-session")
+
+if "chat_log" not in st.session_state:
+    st.session_state.chat_log = chatmessage.ChatLog(st.session_state.sessionId)
+
 col1, col2 = st.columns(2, gap="large")
 clearbutton = col2.button("Clear History", key="clear-history-btn")
 
 if clearbutton:
+    st.session_state.chat_log.clear()
     localS.deleteAll()
-    localS.setItem("sessionId", None, key='set-session')
+    st.session_state.sessionId = str(uuid.uuid4())
+    localS.setItem("sessionId", st.session_state.sessionId, key='set-session')
+    st.session_state.chat_log = chatmessage.ChatLog(st.session_state.sessionId)
     st.session_state.messages = []
-    localS.setItem("chat-history", "[]", key="set-chat-history")
+    st.session_state.chat_window = ConversationWindow()
+    st.session_state.history_visible = HISTORY_PAGE_MESSAGES
+    st.session_state.history_exhausted = True
 
 st.title('Herdbot')
 st.markdown("<h2 style='color: black;'>Your Farm, Smarter with AI</h2>", unsafe_allow_html=True)
 st.markdown('<div class="rainbow-divider"></div>', unsafe_allow_html=True)
 
-# ✅ Load previous messages (Ensure they are in order)
+# ✅ Load only the most recent messages from the chat log (Ensure they are in order)
 if "messages" not in st.session_state:
-    st.session_state.messages = chatmessage.deserialize_messages(localS.getItem("chat-history")) or []
+    chat_log = st.session_state.chat_log
+    if not chat_log.exists():
+        # ✅ One-time migration of the old full-history LocalStorage blob
+        legacy_messages = chatmessage.deserialize_messages(localS.getItem("chat-history"))
+        if legacy_messages:
+            chat_log.append(legacy_messages)
+    st.session_state.messages = chat_log.load_recent()
+
+if "history_visible" not in st.session_state:
+    st.session_state.history_visible = HISTORY_PAGE_MESSAGES
+    st.session_state.history_exhausted = len(st.session_state.messages) < chatmessage.RECENT_MESSAGES_ON_LOAD
+
+# ✅ Token-budgeted history window, updated incrementally by genailib on every turn
+if "chat_window" not in st.session_state:
+    st.session_state.chat_window = ConversationWindow.from_messages(st.session_state.messages)
 
 @st.cache_data
 def get_welcome_message() -> str:
@@ -63,64 +139,87 @@ def get_welcome_message() -> str:
         ]
     )
 
-# ✅ Display existing chat messages **before** new input
-for message in st.session_state.messages:
+def render_message(message):
     with st.chat_message(message.role):
         st.markdown(message.text)
-        if hasattr(message, "citations") and message.citations:
+        if message.citations:
             for cit in message.citations:
                 for link in cit.get("links", []):
                     st.write(f"[{link['text']}]({link['url']})")
 
-# ✅ User Input Box
-input_text = st.chat_input("Chat with your bot here")
-
-if input_text:
-    # ✅ Display user's question immediately **before streaming starts**
-    with st.chat_message("user"):
-        st.markdown(input_text)
+def load_older_messages():
+    """Shows one more page of history, reading further back in the chat log once memory runs out."""
+    messages = st.session_state.messages
+    st.session_state.history_visible += HISTORY_PAGE_MESSAGES
+    if st.session_state.history_visible > len(messages) and not st.session_state.history_exhausted:
+        wanted = len(messages) + HISTORY_PAGE_MESSAGES
+        older = st.session_state.chat_log.load_recent(wanted)
+        st.session_state.history_exhausted = len(older) < wanted
+        # ✅ Keep the in-memory objects for the recent tail, only prepend what is new
+        messages[:0] = older[: len(older) - len(messages)]
+
+# ✅ Chat panel is a fragment: sending a question or loading older messages reruns only this part
+@st.fragment
+def chat_panel():
+    messages = st.session_state.messages
+    history = st.container()
+
+    # ✅ Virtualized history: only the last `history_visible` messages are rendered
+    hidden = max(0, len(messages) - st.session_state.history_visible)
+    with history:
+        if hidden or not st.session_state.history_exhausted:
+            st.button("Load older messages", key="load-older-btn", on_click=load_older_messages)
+        for message in messages[hidden:]:
+            render_message(message)
+
+    # ✅ User Input Box
+    input_text = st.chat_input("Chat with your bot here")
+
+    # ✅ Display Welcome Message (Only if no messages exist)
+    if not messages and not input_text:
+        with history, st.chat_message('assistant'):
+            st.markdown(get_welcome_message())
+        return
+
+    if not input_text:
+        return
+
+    with history:
+        # ✅ Display user's question immediately **before streaming starts**
+        with st.chat_message("user"):
+            st.markdown(input_text)
+
+        # ✅ Stream response into placeholder message (batched renders, one shared buffer)
+        with st.chat_message("assistant"):
+            message_placeholder = st.empty()
+            response_buffer = StreamBuffer()
+            response_citations = CitationCollector()
+
+            # ✅ closing(): a rerun (new message, Clear History) or a closed tab stops the script mid-stream,
+            # which closes the generator and cancels the Bedrock streams behind it straight away
+            genailib = get_backend()
+            with contextlib.closing(genailib.chat_with_model(
+                message_history=list(messages),  # ✅ History **excluding** the new question
+                new_text=input_text,
+                session_id=st.session_state.sessionId,
+                window=st.session_state.chat_window,
+                buffer=response_buffer,
+                citations=response_citations
+            )) as response_chunks:
+                streamed_response = render_stream(response_chunks, response_buffer, message_placeholder.markdown)
+            for cit in response_citations.citations:
+                for link in cit.get("links", []):
+                    st.write(f"[{link['text']}]({link['url']})")
 
-    # ✅ Append user message to chat history before streaming
+    # ✅ The new turn is already on screen, so no st.rerun(); the next fragment run shows it from history
     user_message = chatmessage.ChatMessage("user", input_text)
-    st.session_state.messages.append(user_message)
-
-    # ✅ Placeholder assistant message (prevents ordering issues)
-    assistant_message = chatmessage.ChatMessage("assistant", "")
-    st.session_state.messages.append(assistant_message)
-
-    # ✅ Save session ID **before** streaming starts
-    if "sessionId" not in st.session_state:
-        st.session_state.sessionId = localS.getItem("sessionId")
-
-    # ✅ Stream response into placeholder message
-    with st.chat_message("assistant"):
-        message_placeholder = st.empty()
-        streamed_response = ""
-
-        for response_chunk in genailib.chat_with_model(
-            message_history=st.session_state.messages[:-1],  # ✅ Send history **excluding** placeholder
-            new_text=input_text,
-            session_id=st.session_state.sessionId
-        ):
-            streamed_response += response_chunk
-            message_placeholder.markdown(streamed_response)
-
-        # ✅ Update the **last assistant message** in session state
-        st.session_state.messages[-1].text = streamed_response  
-
-    # ✅ Save chat history after streaming (Fixed key, single call)
-    if "sessionId" in st.session_state:
-        localS.setItem("sessionId", st.session_state.sessionId, key="set-session")
-    localS.setItem("chat-history", chatmessage.serialize_messages(st.session_state.messages), key="set-chat-history")
-
-    # ✅ Force Streamlit to **re-render messages in correct order**
-    st.rerun()
+    assistant_message = chatmessage.ChatMessage("assistant", streamed_response, response_citations.citations or None)
+    messages.extend([user_message, assistant_message])
+
+    # ✅ Save chat history after streaming (append only the new turn)
+    st.session_state.chat_log.append([user_message, assistant_message])
 
-# ✅ Display Welcome Message (Only if no messages exist)
-if len(st.session_state.messages) == 0:
-    welcome_message = get_welcome_message()
-    with st.chat_message('assistant'):
-        st.markdown(welcome_message)
+chat_panel()
 
 # ✅ Debug Mode (Optional)
 if DEBUG := os.getenv("DEBUG", False):
@@ -0,0 +1,294 @@
+import asyncio
+import contextlib
+import logging
+import os
+import time
+from collections import OrderedDict
+
+import genailib
+import metrics
+from cancellation import CANCEL_CONSUMER_CLOSED, CANCEL_DONE, REQUEST_DEADLINE_SECONDS, CancelToken, is_cancelled
+from chatmessage import ChatMessage
+from citations import CitationChunk, CitationCollector, citation_from_passages
+from conversation import ConversationWindow
+from streambuffer import StreamBuffer
+
+# ⚡ Asyncio Chat Engine Configuration
+ASYNC_MAX_CONCURRENT_CHATS = int(os.getenv("ASYNC_MAX_CONCURRENT_CHATS", "200"))
+ASYNC_MAX_SESSIONS = int(os.getenv("ASYNC_MAX_SESSIONS", "10000"))
+ASYNC_SESSION_IDLE_SECONDS = float(os.getenv("ASYNC_SESSION_IDLE_SECONDS", str(2 * 60 * 60)))
+
+logger = logging.getLogger("asyncchat")
+
+_DONE = object()
+
+async def in_thread(fn, *args, name="async-work"):
+    """
+    Awaits `fn(*args)` run on its own thread (asyncio.to_thread's default executor is capped at
+    a few dozen workers, so retrieval and routing would queue behind each other under load).
+    """
+    return await asyncio.wrap_future(genailib.start_thread(name, fn, *args))
+
+async def aiter_in_thread(stream_factory, cancel_event):
+    """
+    Runs a blocking generator on its own thread (boto3 streams are blocking) and yields its
+    items on the event loop, where everything else (HTTP, orchestration, hedging) runs.
+    When the consumer stops early, `cancel_event` (a CancelToken) is cancelled so the worker's
+    stream is closed at once.
+    """
+    loop = asyncio.get_running_loop()
+    items = asyncio.Queue()
+
+    def worker():
+        try:
+            for item in stream_factory(cancel_event):
+                loop.call_soon_threadsafe(items.put_nowait, (item, None))
+        except BaseException as e:
+            loop.call_soon_threadsafe(items.put_nowait, (_DONE, e))
+        else:
+            loop.call_soon_threadsafe(items.put_nowait, (_DONE, None))
+
+    genailib.start_thread("async-stream", worker)  # ✅ One thread per live stream, no pool to queue behind
+    try:
+        while True:
+            item, error = await items.get()
+            if item is _DONE:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        cancel_event.cancel(CANCEL_DONE)
+
+# 🚀 Async Knowledge Base Query (falls back to Claude)
+async def aquery_knowledge_base_stream(prompt, window, session_id=None, trace=metrics.NULL_TRACE, cancel_event=None):
+    """Async counterpart of genailib.query_knowledge_base_stream."""
+    has_answer = False
+    try:
+        async for text_chunk in aiter_in_thread(
+            lambda source_cancel: genailib.stream_knowledge_base(prompt, window, source_cancel, trace=trace),
+            CancelToken(parent=cancel_event),
+        ):
+            has_answer = has_answer or bool(text_chunk.strip())
+            yield text_chunk
+        if has_answer:
+            trace.set("route", "kb")
+            return
+    except Exception as e:
+        logger.warning("⚠️ AWS Knowledge Base query failed: %s", e)
+        trace.set("fallback_reason", "kb_error")
+        if has_answer:
+            trace.set("route", "kb")
+            return
+
+    if is_cancelled(cancel_event):
+        return
+    trace.set("route", "model")
+    trace.set("fallback", True)
+    async for text_chunk in arun_query_with_ai_model(prompt, window, session_id, trace=trace, cancel_event=cancel_event):
+        yield text_chunk
+
+# 🚀 Async Claude Query
+async def arun_query_with_ai_model(prompt, window, session_id=None, passages=None, trace=metrics.NULL_TRACE, model=None,
+                                   cancel_event=None):
+    """Async counterpart of genailib.run_query_with_ai_model."""
+    answer = []
+    try:
+        async for text_chunk in aiter_in_thread(
+            lambda source_cancel: genailib.stream_ai_model(prompt, window, source_cancel, passages=passages, trace=trace,
+                                                            model=model),
+            CancelToken(parent=cancel_event),
+        ):
+            answer.append(text_chunk)
+            yield text_chunk
+        citation = citation_from_passages(passages, "".join(answer)) if passages else None
+        if citation is not None:
+            yield CitationChunk([citation])
+    except Exception as e:
+        if is_cancelled(cancel_event):
+            return
+        logger.error("❌ Error calling Bedrock AI Model: %s", e)
+        trace.set("error", type(e).__name__)
+        yield genailib.ERROR_MESSAGE
+
+# 🚀 Async Two-stage Query
+async def asplit_query_stream(prompt, window, session_id=None, trace=metrics.NULL_TRACE, cancel_event=None):
+    """Async counterpart of genailib.split_query_stream (retrieval runs on a worker thread)."""
+    history = window.snapshot()
+    passages = await in_thread(genailib.retrieve_stage, prompt, history, trace, name="async-retrieve")
+    if is_cancelled(cancel_event):
+        return
+    async for text_chunk in arun_query_with_ai_model(prompt, history, session_id, passages, trace, cancel_event=cancel_event):
+        yield text_chunk
+
+# 🚀 Async Hedged Query
+async def ahedged_query_stream(prompt, window, session_id=None, hedge_delay=None, trace=metrics.NULL_TRACE, cancel_event=None):
+    """Async counterpart of genailib.hedged_query_stream (same genailib.HedgeRace rules, streams pumped as tasks)."""
+    hedge_delay = genailib.HEDGE_DELAY_SECONDS if hedge_delay is None else hedge_delay
+    stream_factories = genailib.hedge_stream_factories(prompt, window.snapshot(), trace)
+    race = genailib.HedgeRace(hedge_delay, trace, cancel_event)
+    chunks = asyncio.Queue()
+    tasks = []
+
+    async def pump(source, source_cancel):
+        try:
+            async for text_chunk in aiter_in_thread(stream_factories[source], source_cancel):
+                chunks.put_nowait((source, text_chunk))
+        except Exception as e:
+            logger.warning("⚠️ %s stream failed: %s", source, e)
+        finally:
+            chunks.put_nowait((source, None))
+
+    def start(source):
+        tasks.append(asyncio.create_task(pump(source, race.start(source))))
+
+    start("kb")
+    try:
+        while not race.done:
+            timeout = race.wait_timeout()
+            if timeout is not None and timeout <= 0:
+                start("model")
+                continue
+
+            try:
+                source, text_chunk = await asyncio.wait_for(chunks.get(), timeout)
+            except asyncio.TimeoutError:
+                continue
+
+            text_chunk, next_source = race.on_chunk(source, text_chunk)
+            if next_source is not None:
+                start(next_source)
+            if text_chunk is not None:
+                yield text_chunk
+    finally:
+        race.close()
+        for task in tasks:
+            task.cancel()
+
+# 🚀 Async Bedrock Agent Query
+async def arun_query_with_agent(prompt, session_id=None, trace=metrics.NULL_TRACE, cancel_event=None):
+    """Async counterpart of genailib.run_query_with_agent."""
+    try:
+        async for text_chunk in aiter_in_thread(
+            lambda source_cancel: genailib.stream_agent(prompt, session_id, source_cancel, trace=trace),
+            CancelToken(parent=cancel_event),
+        ):
+            yield text_chunk
+    except Exception as e:
+        if is_cancelled(cancel_event):
+            return
+        logger.error("❌ Error calling Bedrock Agent: %s", e)
+        trace.set("error", type(e).__name__)
+        yield genailib.ERROR_MESSAGE
+
+# ✅ The asyncio streams behind every route; chat engines compose them exactly like genailib.ROUTE_STREAMS
+ASYNC_ROUTE_STREAMS = genailib.RouteStreams(
+    model=arun_query_with_ai_model,
+    split=asplit_query_stream,
+    hedged=ahedged_query_stream,
+    kb=aquery_knowledge_base_stream,
+    agent=arun_query_with_agent,
+)
+
+class ChatSession:
+    """Per-session conversation state for the asyncio engine."""
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.window = ConversationWindow()
+        self.lock = asyncio.Lock()  # ✅ One answer at a time per session keeps the window ordered
+        self.last_used = time.monotonic()
+
+class AsyncChatEngine:
+    """
+    Asyncio chat orchestration with per-session state and a bounded number of chats
+    streaming at once; callers beyond the limit wait for a free slot.
+    """
+
+    def __init__(self, max_concurrent_chats=ASYNC_MAX_CONCURRENT_CHATS, max_sessions=ASYNC_MAX_SESSIONS,
+                 session_idle_seconds=ASYNC_SESSION_IDLE_SECONDS):
+        self.max_concurrent_chats = max_concurrent_chats
+        self.max_sessions = max_sessions
+        self.session_idle_seconds = session_idle_seconds
+        self._slots = asyncio.Semaphore(max_concurrent_chats)
+        self._sessions = OrderedDict()
+        self.active_chats = 0
+
+    def session(self, session_id):
+        """Returns (creating if needed) the session, evicting idle / least recently used ones."""
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._sessions[session_id] = ChatSession(session_id)
+        self._sessions.move_to_end(session_id)
+        session.last_used = time.monotonic()
+
+        idle_before = session.last_used - self.session_idle_seconds
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if oldest is session or (len(self._sessions) <= self.max_sessions and oldest.last_used >= idle_before):
+                break
+            del self._sessions[oldest.session_id]
+        return session
+
+    def reset(self, session_id):
+        self._sessions.pop(session_id, None)
+
+    async def chat(self, session_id, new_text, citations=None, deadline_seconds=None):
+        """
+        Async counterpart of genailib.chat_with_model: yields answer chunks for one turn.
+        Pass a CitationCollector as `citations` to receive the answer's source links.
+        Closing the generator (client disconnect) or passing `deadline_seconds` (default
+        REQUEST_DEADLINE_SECONDS, counted from the call) cancels the upstream streams.
+        """
+        if citations is None:
+            citations = CitationCollector()
+        token = CancelToken.with_timeout(REQUEST_DEADLINE_SECONDS if deadline_seconds is None else deadline_seconds)
+        session = self.session(session_id)
+        try:
+            async with session.lock, self._slots:
+                self.active_chats += 1
+                try:
+                    async with contextlib.aclosing(self._chat_turn(session, new_text, citations, token)) as chunks:
+                        async for text_chunk in chunks:
+                            yield text_chunk
+                finally:
+                    self.active_chats -= 1
+        except GeneratorExit:
+            token.cancel(CANCEL_CONSUMER_CLOSED)
+            raise
+        finally:
+            token.cancel(CANCEL_DONE)
+
+    async def _chat_turn(self, session, new_text, citations, token):
+        buffer = StreamBuffer()
+        trace = metrics.start_trace("chat", session_id=session.session_id, engine="asyncio")
+        turn = genailib.ChatTurn(new_text, session.window, session.session_id, trace)
+        assistant_message = ChatMessage("assistant", "")
+
+        # ✅ Routing and local index search are CPU work, keep them off the event loop
+        await in_thread(turn.plan_route, name="async-route")
+        response_stream = turn.astream(token, ASYNC_ROUTE_STREAMS)
+
+        try:
+            async for text_chunk in response_stream:
+                if isinstance(text_chunk, CitationChunk):
+                    citations.add(text_chunk.citations)
+                    continue
+                if text_chunk.strip():
+                    trace.mark("ttft")
+                buffer.append(text_chunk)
+                yield text_chunk
+        except GeneratorExit:
+            token.cancel(CANCEL_CONSUMER_CLOSED)  # ✅ Client went away, close the upstream EventStreams now
+            raise
+        finally:
+            await response_stream.aclose()
+            if token.is_set():
+                logger.info("🛑 Chat turn cancelled (%s) after %d chars.", token.reason, len(buffer))
+                trace.set("cancel_reason", token.reason)
+            trace.set("output_chars", len(buffer))
+            metrics.finish_trace(trace)
+
+        assistant_message.text = buffer.text()
+        assistant_message.citations = citations.citations or None
+        turn.finish(assistant_message, complete=not token.is_set())
\ No newline at end of file
@@ -0,0 +1,71 @@
+import os
+import threading
+
+# ⚡ AWS Client Configuration (shared by every Streamlit session and rerun in this process)
+AWS_REGION = os.getenv("AWS_REGION", "eu-west-1")
+MAX_POOL_CONNECTIONS = int(os.getenv("BEDROCK_MAX_POOL_CONNECTIONS", "50"))  # ✅ botocore default is 10
+CONNECT_TIMEOUT_SECONDS = float(os.getenv("BEDROCK_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT_SECONDS = float(os.getenv("BEDROCK_READ_TIMEOUT", "60"))  # ✅ Max gap between stream events
+MAX_RETRY_ATTEMPTS = int(os.getenv("BEDROCK_MAX_ATTEMPTS", "4"))
+RETRY_MODE = os.getenv("BEDROCK_RETRY_MODE", "adaptive")
+SCHEDULER_RETRIES = {"mode": "standard", "total_max_attempts": 1}  # ✅ No botocore retry for services BedrockScheduler retries
+# ✅ boto3 / botocore are imported on the first client, not at import time (they are most of a cold start)
+
+_clients = {}
+_session = None
+_lock = threading.Lock()
+_scheduler_retried = set()  # ✅ Service names whose clients make a single attempt
+
+def retry_in_scheduler(*service_names):
+    """Clients created from now on for `service_names` make one attempt; the caller's scheduler does the retrying."""
+    with _lock:
+        _scheduler_retried.update(service_names)
+
+def client_config(service_name=None):
+    """botocore Config tuned for long-lived, concurrent Bedrock streams."""
+    from botocore.config import Config
+
+    if service_name in _scheduler_retried:
+        retries = SCHEDULER_RETRIES
+    else:
+        retries = {"mode": RETRY_MODE, "max_attempts": MAX_RETRY_ATTEMPTS}
+    return Config(
+        max_pool_connections=MAX_POOL_CONNECTIONS,
+        tcp_keepalive=True,
+        connect_timeout=CONNECT_TIMEOUT_SECONDS,
+        read_timeout=READ_TIMEOUT_SECONDS,
+        retries=dict(retries),
+    )
+
+def get_client(service_name, region_name=AWS_REGION):
+    """
+    Returns the process-wide client for `service_name` in `region_name`, creating it on
+    first use. boto3 clients are thread-safe, so one client (and its connection pool)
+    is reused by every caller.
+    """
+    key = (service_name, region_name)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                global _session
+                if _session is None:
+                    import boto3
+
+                    _session = boto3.session.Session()  # ✅ Sessions are not thread-safe, only touched under the lock
+                client = _session.client(service_name, region_name=region_name, config=client_config(service_name))
+                _clients[key] = client
+    return client
+
+def set_client(service_name, client, region_name=AWS_REGION):
+    """Installs a client (e.g. a local stand-in) for `service_name` in `region_name`."""
+    with _lock:
+        _clients[(service_name, region_name)] = client
+
+def reset_clients():
+    """Drops every cached client, e.g. after rotating credentials."""
+    global _session
+    with _lock:
+        _clients.clear()
+        _session = None
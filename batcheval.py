@@ -0,0 +1,347 @@
+import argparse
+import concurrent.futures
+import contextlib
+import hashlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+import envfile  # ✅ Loads .env before the config modules below read os.getenv
+import awsclients
+import fakebedrock
+import genailib
+import metrics
+from benchmark import percentile
+from citations import CitationCollector, citation_from_passages
+from conversation import ConversationWindow
+from responsecache import normalize_prompt
+from scheduler import PRIORITY_BATCH, BedrockScheduler, priority
+
+# ⚡ Batch Evaluation Configuration (question file -> JSONL results, resumable)
+# python batcheval.py run "AI Questions.txt" --output results.jsonl --concurrency 16 [--fake]
+# python batcheval.py prepare questions.jsonl --records records.jsonl [--submit s3://bucket/eval/ --role-arn ...]
+# python batcheval.py collect records.jsonl.out --manifest records.manifest.jsonl --output results.jsonl
+BATCH_EVAL_CONCURRENCY = int(os.getenv("BATCH_EVAL_CONCURRENCY", "8"))
+BATCH_EVAL_DEADLINE_SECONDS = float(os.getenv("BATCH_EVAL_DEADLINE_SECONDS", "120"))
+BATCH_ROLE_ARN = os.getenv("BATCH_ROLE_ARN", "")  # ✅ Service role Bedrock batch inference runs as
+BATCH_MIN_RECORDS = 100  # ✅ Bedrock rejects batch inference jobs with fewer records
+PROGRESS_EVERY = 25
+
+def question_id(question):
+    """Stable id of a question, so a resumed run recognizes answered questions even if the file was reordered."""
+    return hashlib.sha1(normalize_prompt(question).encode("utf-8")).hexdigest()[:12]
+
+def load_questions(path):
+    """
+    (id, question) pairs from a .txt file (one question per non-empty line) or a .jsonl file
+    ({"question": "...", "id": "..."}; "prompt" is accepted too, the id is optional).
+    Repeated questions are kept once.
+    """
+    questions, seen = [], set()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                record = json.loads(line)
+                question = str(record.get("question") or record.get("prompt") or "").strip()
+                qid = str(record.get("id") or question_id(question))
+            else:
+                question, qid = line, question_id(line)
+            if question and qid not in seen:
+                seen.add(qid)
+                questions.append((qid, question))
+    return questions
+
+def load_finished(path, retry_errors=False):
+    """Ids already in a results file. A line cut off by an interruption is ignored (and re-run)."""
+    finished = set()
+    if not os.path.exists(path):
+        return finished
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue
+            if not (retry_errors and row.get("error")):
+                finished.add(row["id"])
+    return finished
+
+class TraceCollector:
+    """Metrics sink that keeps each evaluated question's trace values, keyed by session id."""
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, trace):
+        session_id = trace.attributes.get("session_id")
+        if session_id:
+            with self._lock:
+                self._values[session_id] = dict(trace.values)
+
+    def pop(self, session_id):
+        with self._lock:
+            return self._values.pop(session_id, {})
+
+def _links(citations):
+    return [link["url"] for citation in citations for link in citation["links"]]
+
+def result_row(qid, question, answer, values, citations=(), error=None):
+    """One results line: the answer, the route it took, stage timings and token counts."""
+    error = error or values.get("error") or values.get("cancel_reason")
+    if not error and answer == genailib.ERROR_MESSAGE:
+        error = "error_message"
+    return {
+        "id": qid,
+        "question": question,
+        "answer": answer,
+        "route": values.get("route"),
+        "route_reason": values.get("route_reason"),
+        "fallback": bool(values.get("fallback")),
+        "fallback_reason": values.get("fallback_reason"),
+        "timings": {stage: values[stage] for stage in metrics.STAGE_TIMINGS if stage in values},
+        "input_tokens": values.get("input_tokens"),
+        "output_tokens": values.get("output_tokens"),
+        "citations": _links(citations),
+        "error": error,
+    }
+
+def evaluate_one(qid, question, traces, deadline_seconds=BATCH_EVAL_DEADLINE_SECONDS):
+    """Answers one question through chat_with_model (fresh conversation, batch priority)."""
+    session_id = f"eval-{qid}"
+    citations = CitationCollector()
+    chunks = []
+    error = None
+    try:
+        with priority(PRIORITY_BATCH):  # ✅ Interactive chats sharing the quota are served first
+            for chunk in genailib.chat_with_model([], question, session_id=session_id, window=ConversationWindow(),
+                                                  citations=citations, deadline_seconds=deadline_seconds):
+                chunks.append(chunk)
+    except Exception as e:
+        error = type(e).__name__
+    return result_row(qid, question, "".join(chunks), traces.pop(session_id), citations.citations, error)
+
+def summarize(rows):
+    routes = {}
+    for row in rows:
+        routes[row["route"] or "none"] = routes.get(row["route"] or "none", 0) + 1
+    ttft = [row["timings"]["ttft"] for row in rows if "ttft" in row["timings"]]
+    total = [row["timings"]["total"] for row in rows if "total" in row["timings"]]
+    return {
+        "questions": len(rows),
+        "errors": sum(bool(row["error"]) for row in rows),
+        "routes": routes,
+        "ttft_p50": percentile(ttft, 50),
+        "ttft_p95": percentile(ttft, 95),
+        "total_p50": percentile(total, 50),
+        "total_p95": percentile(total, 95),
+        "output_tokens": sum(row["output_tokens"] or 0 for row in rows),
+    }
+
+def run(questions, output_path, concurrency=BATCH_EVAL_CONCURRENCY, deadline_seconds=BATCH_EVAL_DEADLINE_SECONDS,
+        retry_errors=False, log=sys.stderr):
+    """
+    Answers every question not already in `output_path` with `concurrency` workers and
+    appends one JSON line per answer as soon as it finishes, so an interrupted run resumes
+    where it stopped. Returns the rows written by this run.
+    """
+    finished = load_finished(output_path, retry_errors)
+    pending = [(qid, question) for qid, question in questions if qid not in finished]
+    print(f"🔍 {len(pending)} of {len(questions)} questions to answer ({len(questions) - len(pending)} already done)", file=log)
+
+    traces = metrics.add_sink(TraceCollector())
+    rows = []
+    started = time.perf_counter()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch-eval")
+    try:
+        with open(output_path, "a", encoding="utf-8") as output:
+            futures = [executor.submit(evaluate_one, qid, question, traces, deadline_seconds) for qid, question in pending]
+            for future in concurrent.futures.as_completed(futures):
+                row = future.result()
+                output.write(json.dumps(row, ensure_ascii=False) + "\n")
+                output.flush()  # ✅ Every finished answer survives an interruption
+                rows.append(row)
+                if len(rows) % PROGRESS_EVERY == 0:
+                    rate = len(rows) / (time.perf_counter() - started)
+                    print(f"⚡ {len(rows)}/{len(pending)} answered ({rate:.1f}/s)", file=log)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)  # ✅ Ctrl-C drops queued questions, running ones finish
+        metrics.remove_sink(traces)
+    return rows
+
+# 🚀 Bedrock batch inference: retrieval runs here, generation runs as an asynchronous Bedrock job
+def prepare_records(questions, records_path, manifest_path, concurrency=BATCH_EVAL_CONCURRENCY):
+    """
+    Retrieves KB passages for every question and writes one batch inference record per
+    question ({"recordId", "modelInput"}), plus a manifest with the route and passages
+    that `collect` merges back into the results.
+    """
+    def prepare(item):
+        qid, question = item
+        trace = metrics.RequestTrace("batch_prepare")
+        passages = genailib.retrieve_stage(question, [], trace)
+        record = {"recordId": qid, "modelInput": genailib.model_request(question, [], passages)}
+        # ✅ Citations are picked in collect(), once the answer shows which passages it used
+        manifest = {"id": qid, "question": question, "route": trace.values.get("route"),
+                    "fallback_reason": trace.values.get("fallback_reason"),
+                    "passages": [{"source": passage["source"], "url": passage["url"]} for passage in passages]}
+        return record, manifest
+
+    with priority(PRIORITY_BATCH), concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor, \
+            open(records_path, "w", encoding="utf-8") as records, open(manifest_path, "w", encoding="utf-8") as manifest:
+        for record, entry in executor.map(prepare, questions):
+            records.write(json.dumps(record, ensure_ascii=False) + "\n")
+            manifest.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    return len(questions)
+
+def submit_job(records_path, s3_prefix, role_arn=BATCH_ROLE_ARN, model=None):
+    """Uploads the records to `s3_prefix` and starts a Bedrock batch inference job. Returns the job ARN."""
+    parsed = urlparse(s3_prefix)
+    prefix = parsed.path.lstrip("/")
+    if prefix and not prefix.endswith("/"):
+        prefix += "/"
+    job_name = f"herdbot-eval-{time.strftime('%Y%m%d-%H%M%S')}"
+    input_key = f"{prefix}{job_name}/{os.path.basename(records_path)}"
+    awsclients.get_client("s3").upload_file(records_path, parsed.netloc, input_key)
+    response = awsclients.get_client("bedrock").create_model_invocation_job(
+        jobName=job_name,
+        roleArn=role_arn,
+        modelId=model or genailib.model_id,
+        inputDataConfig={"s3InputDataConfig": {"s3Uri": f"s3://{parsed.netloc}/{input_key}"}},
+        outputDataConfig={"s3OutputDataConfig": {"s3Uri": f"s3://{parsed.netloc}/{prefix}{job_name}/output/"}},
+    )
+    return response["jobArn"]
+
+def _read_lines(path):
+    """Lines of a local file or an s3:// object."""
+    if path.startswith("s3://"):
+        parsed = urlparse(path)
+        body = awsclients.get_client("s3").get_object(Bucket=parsed.netloc, Key=parsed.path.lstrip("/"))["Body"]
+        return body.read().decode("utf-8").splitlines()
+    with open(path, encoding="utf-8") as f:
+        return f.read().splitlines()
+
+def collect(batch_output_path, manifest_path, output_path):
+    """Turns a batch inference output file (.jsonl.out) into result rows. Returns the rows."""
+    manifest = {}
+    for line in _read_lines(manifest_path):
+        if line.strip():
+            entry = json.loads(line)
+            manifest[entry["id"]] = entry
+    rows = []
+    with open(output_path, "a", encoding="utf-8") as output:
+        for line in _read_lines(batch_output_path):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            entry = manifest.get(record["recordId"], {"question": "", "citations": []})
+            model_output = record.get("modelOutput") or {}
+            usage = model_output.get("usage", {})
+            values = {
+                "route": entry.get("route"),
+                "fallback": entry.get("route") == "model",
+                "fallback_reason": entry.get("fallback_reason"),
+                "input_tokens": usage.get("input_tokens"),
+                "output_tokens": usage.get("output_tokens"),
+            }
+            answer = "".join(block.get("text", "") for block in model_output.get("content", []))
+            error = (record.get("error") or {}).get("errorMessage") if record.get("error") else None
+            row = result_row(record["recordId"], entry["question"], answer, values, error=error)
+            if "passages" in entry:
+                citation = citation_from_passages(entry["passages"], answer) if entry["passages"] else None
+                row["citations"] = _links([citation] if citation else [])
+            else:
+                row["citations"] = entry.get("citations", [])  # ✅ Manifests written before passages were kept
+            output.write(json.dumps(row, ensure_ascii=False) + "\n")
+            rows.append(row)
+    return rows
+
+def install_fake(args):
+    """Points genailib at the local Bedrock stand-in (no AWS calls, no cost, no account quota)."""
+    genailib.bedrock_scheduler = BedrockScheduler(1e6, 1e12)
+    fakebedrock.install(
+        fakebedrock.FakeBedrockRuntime(args.model_tps, args.model_ttft, args.answer_tokens, seed=args.seed),
+        fakebedrock.FakeAgentRuntime(args.model_tps, args.model_ttft * 2, args.answer_tokens, seed=args.seed),
+    )
+
+def print_summary(summary):
+    print(f"✅ {summary['questions']} answered, {summary['errors']} errors, routes {summary['routes']}")
+    print(f"   ttft p50 {summary['ttft_p50']:.3f}s p95 {summary['ttft_p95']:.3f}s | "
+          f"total p50 {summary['total_p50']:.3f}s p95 {summary['total_p95']:.3f}s | {summary['output_tokens']} output tokens")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch evaluation of question sets through the chat pipeline.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Answer every question with chat_with_model and append JSONL results")
+    run_parser.add_argument("questions", help="Question file (.txt, one per line, or .jsonl)")
+    run_parser.add_argument("--output", required=True, help="Results JSONL (appended to; answered questions are skipped)")
+    run_parser.add_argument("--concurrency", type=int, default=BATCH_EVAL_CONCURRENCY)
+    run_parser.add_argument("--deadline", type=float, default=BATCH_EVAL_DEADLINE_SECONDS, help="Seconds per answer")
+    run_parser.add_argument("--retry-errors", action="store_true", help="Answer questions whose earlier result failed again")
+    run_parser.add_argument("--use-cache", action="store_true", help="Allow answers from the response cache")
+    run_parser.add_argument("--limit", type=int, help="Only the first N questions")
+
+    prepare_parser = commands.add_parser("prepare", help="Retrieve passages and write Bedrock batch inference records")
+    prepare_parser.add_argument("questions")
+    prepare_parser.add_argument("--records", required=True, help="Batch inference input JSONL to write")
+    prepare_parser.add_argument("--manifest", help="Default: <records>.manifest.jsonl")
+    prepare_parser.add_argument("--concurrency", type=int, default=BATCH_EVAL_CONCURRENCY)
+    prepare_parser.add_argument("--submit", metavar="S3_PREFIX", help="Upload the records and start the batch job")
+    prepare_parser.add_argument("--role-arn", default=BATCH_ROLE_ARN)
+    prepare_parser.add_argument("--limit", type=int)
+
+    collect_parser = commands.add_parser("collect", help="Merge a batch inference output file into JSONL results")
+    collect_parser.add_argument("batch_output", help="The job's .jsonl.out file (local path or s3:// URI)")
+    collect_parser.add_argument("--manifest", required=True)
+    collect_parser.add_argument("--output", required=True)
+
+    for command_parser in (run_parser, prepare_parser):
+        command_parser.add_argument("--fake", action="store_true", help="Use the local Bedrock stand-in (fakebedrock.py)")
+        command_parser.add_argument("--model-tps", type=float, default=200.0, help="Stand-in tokens per second")
+        command_parser.add_argument("--model-ttft", type=float, default=0.3, help="Stand-in first-token delay (s)")
+        command_parser.add_argument("--answer-tokens", type=int, default=120)
+        command_parser.add_argument("--seed", type=int, default=7)
+        command_parser.add_argument("--verbose", action="store_true", help="Keep genailib's console output")
+    args = parser.parse_args(argv)
+
+    if args.command == "collect":
+        print_summary(summarize(collect(args.batch_output, args.manifest, args.output)))
+        return 0
+
+    if args.fake:
+        install_fake(args)
+    questions = load_questions(args.questions)[:args.limit]
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+
+    if args.command == "prepare":
+        manifest_path = args.manifest or os.path.splitext(args.records)[0] + ".manifest.jsonl"
+        with output:
+            count = prepare_records(questions, args.records, manifest_path, args.concurrency)
+        print(f"✅ {count} records written to {args.records} (manifest: {manifest_path})")
+        if args.submit:
+            if count < BATCH_MIN_RECORDS:
+                print(f"❌ Bedrock batch inference needs at least {BATCH_MIN_RECORDS} records, use `run` instead")
+                return 1
+            print(f"🟢 Batch job started: {submit_job(args.records, args.submit, args.role_arn)}")
+        return 0
+
+    genailib.RESPONSE_CACHE_ENABLED = args.use_cache  # ✅ Evaluate fresh answers unless asked otherwise
+    try:
+        with output:
+            rows = run(questions, args.output, args.concurrency, args.deadline, args.retry_errors)
+    except KeyboardInterrupt:
+        print(f"🛑 Interrupted, finished answers are in {args.output}; run again to resume.")
+        return 130
+    print_summary(summarize(rows))
+    return 1 if any(row["error"] for row in rows) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,245 @@
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+import uuid
+
+import envfile  # ✅ Loads .env before the config modules below read os.getenv
+import fakebedrock
+import genailib
+from endpoints import Endpoint, EndpointPool
+from scheduler import BedrockScheduler
+from conversation import ConversationWindow, estimate_tokens
+
+# ⚡ Offline benchmark for chat_with_model against the local Bedrock stand-in
+DEFAULT_CONCURRENCY = "1,4,16"
+DEFAULT_REQUESTS = 32
+
+# ⚡ Cold-start budget for `--import-profile` (fresh interpreter, `python -X importtime`)
+IMPORT_PROFILE_MODULES = "genailib,asyncchat"
+IMPORT_BUDGET_SECONDS = 0.15
+DEFERRED_IMPORTS = ("boto3", "botocore", "numpy", "pandas", "langchain", "pypdf")  # ✅ Must not load at import time
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (0 for an empty list)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+def run_one(question):
+    """Streams one answer and returns its timings."""
+    start = time.perf_counter()
+    first_token = None
+    text = []
+    for chunk in genailib.chat_with_model([], question, session_id=uuid.uuid4().hex, window=ConversationWindow()):
+        if first_token is None and chunk.strip():
+            first_token = time.perf_counter()
+        text.append(chunk)
+    end = time.perf_counter()
+    first_token = first_token or end
+    tokens = estimate_tokens("".join(text))
+    generation_time = end - first_token
+    return {
+        "ttft": first_token - start,
+        "total": end - start,
+        "tokens": tokens,
+        "tokens_per_second": tokens / generation_time if generation_time > 0 else 0.0,
+        "error": "".join(text) == genailib.ERROR_MESSAGE,
+    }
+
+def run_level(concurrency, requests):
+    """Runs `requests` chats with `concurrency` workers and summarizes them."""
+    questions = [f"Benchmark question {i}: what do I need to claim the scheme payment?" for i in range(requests)]
+    tracemalloc.start()
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(run_one, questions))
+    wall_time = time.perf_counter() - started
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    succeeded = [r for r in results if not r["error"]]
+    ttft = [r["ttft"] for r in results]
+    total = [r["total"] for r in results]
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": sum(r["error"] for r in results),
+        "ttft_p50": percentile(ttft, 50),
+        "ttft_p95": percentile(ttft, 95),
+        "ttft_p99": percentile(ttft, 99),
+        "latency_p50": percentile(total, 50),
+        "latency_p95": percentile(total, 95),
+        "latency_p99": percentile(total, 99),
+        "tokens_per_second": sum(r["tokens_per_second"] for r in succeeded) / max(1, len(succeeded)),
+        "throughput_rps": requests / wall_time,
+        "peak_memory_mb": peak_memory / (1024 * 1024),
+    }
+
+def profile_import(module, runs=3, top=8):
+    """
+    Imports `module` in fresh interpreters under -X importtime and keeps the fastest run.
+    Returns its total seconds, its slowest direct imports and any DEFERRED_IMPORTS it loaded.
+    """
+    best = None
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        if result.returncode != 0:
+            raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+        entries = []  # ✅ (name, depth, cumulative microseconds)
+        for line in result.stderr.splitlines():
+            fields = line.partition("import time:")[2].split("|")
+            if len(fields) != 3 or not fields[1].strip().isdigit():
+                continue
+            name = fields[2].rstrip()
+            depth = (len(name) - len(name.lstrip()) - 1) // 2
+            entries.append((name.strip(), depth, int(fields[1])))
+        # ✅ Output is post-order: the module's own imports are the indented lines right above it
+        end = max(i for i, (name, depth, _) in enumerate(entries) if name == module and depth == 0)
+        start = end
+        while start > 0 and entries[start - 1][1] > 0:
+            start -= 1
+        if best is None or entries[end][2] < best[0]:
+            best = (entries[end][2], entries[start:end])
+
+    total, imported = best
+    slowest = sorted((e for e in imported if e[1] == 1), key=lambda e: e[2], reverse=True)[:top]
+    loaded = {name.split(".")[0] for name, _, _ in imported}
+    return {
+        "module": module,
+        "seconds": total / 1e6,
+        "slowest": [{"module": name, "seconds": cumulative / 1e6} for name, _, cumulative in slowest],
+        "deferred_imports_loaded": sorted(loaded.intersection(DEFERRED_IMPORTS)),
+    }
+
+def print_import_report(profiles, budget):
+    print(f"{'module':>12} {'import ms':>10} {'budget ms':>10}  slowest direct imports (ms)")
+    for profile in profiles:
+        slowest = ", ".join(f"{item['module']} {item['seconds'] * 1000:.1f}" for item in profile["slowest"])
+        print(f"{profile['module']:>12} {profile['seconds'] * 1000:>10.1f} {budget * 1000:>10.0f}  {slowest}")
+        if profile["deferred_imports_loaded"]:
+            print(f"{'':>12} ⚠️ loaded at import time: {', '.join(profile['deferred_imports_loaded'])}")
+
+def run_import_profile(args):
+    """Cold-start check: every module within the import budget and none of DEFERRED_IMPORTS loaded."""
+    profiles = [profile_import(module.strip(), args.import_runs) for module in args.import_modules.split(",") if module.strip()]
+    print_import_report(profiles, args.import_budget)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"budget_seconds": args.import_budget, "imports": profiles}, f, indent=2)
+    if any(p["seconds"] > args.import_budget or p["deferred_imports_loaded"] for p in profiles):
+        print(f"❌ Import-time budget of {args.import_budget:.3f}s exceeded or heavy modules loaded eagerly")
+        return 1
+    return 0
+
+def install_endpoints(spec, args):
+    """Installs fake regions from "region:ttft:error_rate,..." and points the default model's pool at them."""
+    runtimes, endpoints = {}, []
+    for item in spec.split(","):
+        region, ttft, error_rate = (item.strip().split(":") + ["", ""])[:3]
+        runtimes[region] = fakebedrock.FakeBedrockRuntime(
+            args.model_tps, float(ttft or args.model_ttft), args.answer_tokens, args.throttle_rate, args.seed,
+            error_rate=float(error_rate or 0.0), frame_bytes=args.frame_bytes,
+        )
+        endpoints.append(Endpoint(region, genailib.model_id))
+    fakebedrock.install_regions(runtimes)
+    genailib.endpoint_pools[genailib.model_id] = EndpointPool(endpoints)
+
+def print_report(levels):
+    print(f"{'conc':>5} {'ttft p50':>9} {'ttft p95':>9} {'e2e p50':>8} {'e2e p95':>8} {'e2e p99':>8} "
+          f"{'tok/s':>7} {'req/s':>7} {'errors':>6} {'peak MB':>8}")
+    for level in levels:
+        print(f"{level['concurrency']:>5} {level['ttft_p50']:>9.3f} {level['ttft_p95']:>9.3f} "
+              f"{level['latency_p50']:>8.3f} {level['latency_p95']:>8.3f} {level['latency_p99']:>8.3f} "
+              f"{level['tokens_per_second']:>7.1f} {level['throughput_rps']:>7.2f} {level['errors']:>6} "
+              f"{level['peak_memory_mb']:>8.2f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline latency benchmark for genailib.chat_with_model.")
+    parser.add_argument("--concurrency", default=DEFAULT_CONCURRENCY, help="Comma separated worker counts")
+    parser.add_argument("--requests", type=int, default=DEFAULT_REQUESTS, help="Chats per concurrency level")
+    parser.add_argument("--model-tps", type=float, default=60.0, help="Claude tokens per second")
+    parser.add_argument("--model-ttft", type=float, default=0.6, help="Claude first-token delay (s)")
+    parser.add_argument("--kb-tps", type=float, default=60.0, help="KB tokens per second")
+    parser.add_argument("--kb-ttft", type=float, default=1.2, help="KB first-token delay (s)")
+    parser.add_argument("--answer-tokens", type=int, default=200)
+    parser.add_argument("--kb-miss-rate", type=float, default=0.3)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--rpm", type=float, default=100000.0, help="Scheduler requests-per-minute quota")
+    parser.add_argument("--tpm", type=float, default=1e9, help="Scheduler tokens-per-minute quota")
+    parser.add_argument("--hedge-delay", type=float, default=None, help="Override HEDGE_DELAY_SECONDS")
+    parser.add_argument("--no-hedge", action="store_true", help="Run the serial KB -> Claude path")
+    kb_path = parser.add_mutually_exclusive_group()
+    kb_path.add_argument("--split-retrieval", dest="split_retrieval", action="store_const", const=True,
+                         help="Use retrieve + Claude instead of the hedged RetrieveAndGenerate path")
+    kb_path.add_argument("--combined-kb", dest="split_retrieval", action="store_const", const=False,
+                         help="Use RetrieveAndGenerate (the default unless SPLIT_RETRIEVAL_ENABLED=1)")
+    parser.add_argument("--engine", choices=sorted(genailib.CHAT_ENGINES), default="kb", help="Chat engine to measure")
+    parser.add_argument("--retrieve-delay", type=float, default=0.15, help="KB Retrieve latency (s)")
+    parser.add_argument("--endpoints", help="Fake Claude regions as region:ttft:error_rate,... (e.g. eu-west-1:0.6:0,eu-central-1:0.3:0.2)")
+    parser.add_argument("--frame-bytes", type=int, default=0, help="Re-cut stream chunks to this size (0 = one JSON payload per chunk)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    parser.add_argument("--max-ttft-p95", type=float, help="Exit non-zero if any level's p95 TTFT exceeds this")
+    parser.add_argument("--verbose", action="store_true", help="Keep genailib's console output")
+    parser.add_argument("--import-profile", action="store_true", help="Profile cold imports instead of running chats")
+    parser.add_argument("--import-modules", default=IMPORT_PROFILE_MODULES, help="Comma separated modules to profile")
+    parser.add_argument("--import-budget", type=float, default=IMPORT_BUDGET_SECONDS, help="Max cold import time (s)")
+    parser.add_argument("--import-runs", type=int, default=3, help="Fresh interpreters per module (fastest run is kept)")
+    args = parser.parse_args(argv)
+
+    if args.import_profile:
+        return run_import_profile(args)
+
+    fakebedrock.install(
+        fakebedrock.FakeBedrockRuntime(args.model_tps, args.model_ttft, args.answer_tokens, args.throttle_rate, args.seed,
+                                       frame_bytes=args.frame_bytes),
+        fakebedrock.FakeAgentRuntime(args.kb_tps, args.kb_ttft, args.answer_tokens, args.kb_miss_rate,
+                                     throttle_rate=args.throttle_rate, seed=args.seed,
+                                     retrieve_delay=args.retrieve_delay, frame_bytes=args.frame_bytes),
+    )
+    if args.endpoints:
+        install_endpoints(args.endpoints, args)
+    # ✅ Measure the upstream path, not the local shortcuts
+    genailib.RESPONSE_CACHE_ENABLED = False
+    genailib.RETRIEVAL_CACHE_ENABLED = False  # ✅ Every level asks the same questions; keep retrieval cold
+    genailib.LOCAL_INDEX_ENABLED = False
+    genailib.HEDGE_ENABLED = not args.no_hedge
+    if args.split_retrieval is not None:
+        genailib.SPLIT_RETRIEVAL_ENABLED = args.split_retrieval
+    genailib.chat_engine = genailib.CHAT_ENGINES[args.engine]
+    genailib.bedrock_scheduler = BedrockScheduler(args.rpm, args.tpm)
+    if args.hedge_delay is not None:
+        genailib.HEDGE_DELAY_SECONDS = args.hedge_delay
+
+    levels = []
+    for concurrency in [int(c) for c in args.concurrency.split(",") if c.strip()]:
+        output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        with output:
+            levels.append(run_level(concurrency, args.requests))
+
+    print_report(levels)
+    if args.endpoints:
+        for endpoint in genailib.endpoint_pools[genailib.model_id].stats():
+            print(f"{endpoint['endpoint']:>60}  ttft~{endpoint['ttft_ewma'] or 0:.3f}s  errors~{endpoint['error_ewma']:.2f}  "
+                  f"ok={endpoint['successes']} failed={endpoint['failures']} healthy={endpoint['healthy']}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"settings": vars(args), "levels": levels}, f, indent=2)
+
+    if args.max_ttft_p95 is not None and any(level["ttft_p95"] > args.max_ttft_p95 for level in levels):
+        print(f"❌ p95 time-to-first-token above {args.max_ttft_p95:.3f}s")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+import weakref
+
+# ⚡ Cancellation & Deadlines (one token per chat turn, shared by every stage of the chain)
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "120"))  # ✅ 0 = no deadline
+
+CANCEL_CONSUMER_CLOSED = "consumer_closed"
+CANCEL_DEADLINE = "deadline"
+CANCEL_DONE = "done"
+
+logger = logging.getLogger("cancellation")
+
+class CancelToken:
+    """
+    Cancellation flag with a reason, an optional deadline and on-cancel callbacks.
+    Works wherever a threading.Event is expected (is_set / set / wait). Child tokens are
+    cancelled with their parent, so cancelling a turn stops every stream it started.
+    """
+
+    def __init__(self, deadline=None, parent=None):
+        self.reason = None
+        self.deadline = deadline  # ✅ time.monotonic() value, or None
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = {}
+        self._callback_ids = itertools.count()
+        if parent is not None:
+            if parent.deadline is not None and (self.deadline is None or parent.deadline < self.deadline):
+                self.deadline = parent.deadline
+            parent.on_cancel(self.cancel)
+        if self.deadline is not None and not self.is_set():
+            _watchdog.schedule(self)
+
+    @classmethod
+    def with_timeout(cls, seconds=REQUEST_DEADLINE_SECONDS, parent=None):
+        """Token that cancels itself with reason "deadline" after `seconds` (None / 0 = never)."""
+        return cls(time.monotonic() + seconds if seconds else None, parent)
+
+    def child(self):
+        return CancelToken(parent=self)
+
+    def cancel(self, reason="cancelled"):
+        """Cancels the token and runs its callbacks once. Returns False if it was already cancelled."""
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = list(self._callbacks.values()), {}
+        for callback in callbacks:
+            try:
+                callback(reason)
+            except Exception as e:
+                logger.warning("⚠️ Cancel callback failed: %s", e)
+        return True
+
+    def on_cancel(self, callback):
+        """Calls `callback(reason)` on cancellation (now, if already cancelled). Returns an id for remove_callback()."""
+        with self._lock:
+            if not self._event.is_set():
+                callback_id = next(self._callback_ids)
+                self._callbacks[callback_id] = callback
+                return callback_id
+        callback(self.reason)
+        return None
+
+    def remove_callback(self, callback_id):
+        if callback_id is not None:
+            with self._lock:
+                self._callbacks.pop(callback_id, None)
+
+    def remaining(self):
+        """Seconds until the deadline (None without one)."""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    # ✅ threading.Event compatibility
+    def set(self):
+        self.cancel()
+
+    def is_set(self):
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        return self._event.wait(timeout)
+
+    def __repr__(self):
+        return f"CancelToken(reason={self.reason!r})"
+
+def is_cancelled(cancel_event):
+    return cancel_event is not None and cancel_event.is_set()
+
+def abort_stream(stream):
+    """
+    Closes a Bedrock EventStream from any thread. The socket is shut down first, so a reader
+    blocked on it wakes up at once instead of at the read timeout (urllib3 >= 2.3).
+    """
+    raw = getattr(stream, "_raw_stream", None)
+    shutdown = getattr(raw, "shutdown", None)
+    if shutdown is not None:
+        try:
+            shutdown()
+        except Exception as e:
+            logger.debug("Stream shutdown failed: %s", e)
+    stream.close()
+
+def close_on_cancel(cancel_event, stream):
+    """Aborts `stream` as soon as `cancel_event` is cancelled. Returns an id for remove_callback()."""
+    if not isinstance(cancel_event, CancelToken):
+        return None
+    return cancel_event.on_cancel(lambda reason: abort_stream(stream))
+
+class _Watchdog:
+    """One daemon thread that cancels tokens whose deadline has passed."""
+
+    def __init__(self):
+        self._heap = []  # ✅ (deadline, sequence, weakref to token)
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def schedule(self, token):
+        with self._cond:
+            heapq.heappush(self._heap, (token.deadline, next(self._sequence), weakref.ref(token)))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name="cancel-watchdog")
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                deadline, _, token_ref = self._heap[0]
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+            token = token_ref()
+            if token is not None and token.cancel(CANCEL_DEADLINE):
+                logger.info("⏱️ Request deadline reached, cancelling.")
+
+_watchdog = _Watchdog()
@@ -1,6 +1,16 @@
 import json
+import os
+import re
+import threading
+
+# ⚡ Chat Log Configuration
+CHAT_LOG_DIR = os.getenv("CHAT_LOG_DIR", "chat_logs")
+RECENT_MESSAGES_ON_LOAD = int(os.getenv("RECENT_MESSAGES_ON_LOAD", "50"))
+_READ_BLOCK_BYTES = 64 * 1024
 
 class ChatMessage:
+    __slots__ = ("role", "text", "citations")
+
     def __init__(self, role, text, citations=None):
         self.role = role
         self.text = text
@@ -21,6 +31,79 @@ class ChatMessage:
             citations=data.get('citations')
         )
 
+    def to_json(self):
+        """Compact one-line JSON record (citations omitted when empty)."""
+        data = {'role': self.role, 'text': self.text}
+        if self.citations:
+            data['citations'] = self.citations
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+class ChatLog:
+    """
+    Append-only JSONL log of one chat session.
+    Saving writes only the new messages; loading reads just the tail of the file.
+    """
+
+    def __init__(self, session_id, log_dir=CHAT_LOG_DIR):
+        safe_id = re.sub(r"[^A-Za-z0-9_-]", "_", str(session_id))
+        self.path = os.path.join(log_dir, f"{safe_id}.jsonl")
+        self._lock = threading.Lock()
+        os.makedirs(log_dir, exist_ok=True)
+
+    def append(self, messages):
+        """Appends one or more ChatMessage objects to the end of the log."""
+        if isinstance(messages, ChatMessage):
+            messages = [messages]
+        records = "".join(message.to_json() + "\n" for message in messages)
+        if not records:
+            return
+        with self._lock, open(self.path, "a+b") as f:
+            # ✅ A crash mid-write can leave a cut-off last line; start on a fresh line instead of gluing onto it
+            if f.seek(0, os.SEEK_END) > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    records = "\n" + records
+            f.write(records.encode("utf-8"))
+
+    def load_recent(self, limit=RECENT_MESSAGES_ON_LOAD):
+        """Returns the last `limit` readable messages, reading backwards from the end of the file."""
+        if limit <= 0:
+            return []
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return []
+        with f:
+            f.seek(0, os.SEEK_END)
+            position = f.tell()
+            data = b""
+            # ✅ One extra newline guarantees the first kept line is complete
+            while position > 0 and data.count(b"\n") <= limit:
+                step = min(_READ_BLOCK_BYTES, position)
+                position -= step
+                f.seek(position)
+                data = f.read(step) + data
+        messages = []
+        for line in data.splitlines():
+            if not line.strip():
+                continue
+            try:
+                messages.append(ChatMessage.from_dict(json.loads(line)))
+            except (ValueError, KeyError, TypeError):
+                continue  # ✅ A line cut off by a crash mid-write is skipped, not fatal to the whole session
+        return messages[-limit:]
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def clear(self):
+        """Deletes the session's log."""
+        with self._lock:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
 # Функції для серіалізації масиву об'єктів у JSON і навпаки
 def serialize_messages(messages):
     """Перетворює масив об'єктів ChatMessage на JSON."""
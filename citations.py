@@ -0,0 +1,141 @@
+import os
+import re
+from urllib.parse import urlparse
+
+from sources import sources
+
+# ⚡ Citation Links (sources.py filename -> public URL, resolved with one dict lookup)
+
+def _title(filename):
+    """Readable link text for a source document, e.g. "scep_terms.pdf" -> "Scep terms"."""
+    stem = os.path.splitext(filename)[0]
+    return stem.replace("_", " ").replace("-", " ").strip().capitalize()
+
+def _build_link_index(source_map):
+    """Maps every lookup form of a source (filename, stem and public URL, lower-cased) to (title, url)."""
+    index = {}
+    for filename, url in source_map.items():
+        link = (_title(filename), url)
+        index[filename.lower()] = link
+        index[url.lower()] = link
+        index[os.path.splitext(filename)[0].lower()] = link
+    return index
+
+_link_index = _build_link_index(sources)
+MIN_NAME_CHARS = 4  # ✅ Shorter document names / titles are too ambiguous to count as a mention
+_excerpt_ref_re = re.compile(r"\[(\d+(?:\s*[,-]\s*\d+)*)\]")  # ✅ [2], [1, 3], [2-4]
+
+def resolve_link(uri):
+    """
+    (title, public URL) for an S3 URI, web URL or bare filename from a KB citation.
+    Documents listed in sources.py resolve to their public page; other web URLs are kept as-is.
+    Returns None for S3 objects that have no public page.
+    """
+    if not uri:
+        return None
+    parsed = urlparse(uri)
+    filename = parsed.path.rstrip("/").rsplit("/", 1)[-1] or parsed.netloc
+    link = (_link_index.get(uri.lower()) or _link_index.get(filename.lower())
+            or _link_index.get(os.path.splitext(filename)[0].lower()))  # ✅ Chunk objects written by ingest.py
+    if link is not None:
+        return link
+    if parsed.scheme in ("http", "https"):
+        return (filename or parsed.netloc, uri)
+    return None
+
+def reference_uri(reference):
+    """The S3 URI or web URL of one retrieved reference / retrieval result."""
+    location = reference.get("location", {})
+    return location.get("s3Location", {}).get("uri") or location.get("webLocation", {}).get("url") or ""
+
+def _links(uris):
+    links, seen = [], set()
+    for uri in uris:
+        link = resolve_link(uri)
+        if link is not None and link[1] not in seen:
+            seen.add(link[1])
+            links.append({"text": link[0], "url": link[1]})
+    return links
+
+def parse_citation(payload):
+    """
+    Builds a ChatMessage citation ({"text", "links"}) from a RetrieveAndGenerate citation
+    event payload. Returns None when none of its references resolve to a link.
+    """
+    citation = payload.get("citation", payload)
+    links = _links(reference_uri(reference) for reference in citation.get("retrievedReferences", []))
+    if not links:
+        return None
+    text = citation.get("generatedResponsePart", {}).get("textResponsePart", {}).get("text", "")
+    return {"text": text, "links": links}
+
+def _excerpt_numbers(answer):
+    """The excerpt numbers an answer refers to, e.g. {1, 3} for "... [1] ... [3]"."""
+    numbers = set()
+    for match in _excerpt_ref_re.finditer(answer):
+        for part in re.split(r"\s*,\s*", match.group(1)):
+            first, _, last = part.partition("-")
+            numbers.update(range(int(first), int(last or first) + 1))
+    return numbers
+
+def used_passages(passages, answer):
+    """
+    The passages (numbered from 1 in the prompt) that `answer` draws on: referred to by
+    number, by link or by document name / title.
+    """
+    text = answer.lower()
+    numbers = _excerpt_numbers(text)
+    used = []
+    for number, passage in enumerate(passages, start=1):
+        link = resolve_link(passage["url"]) or resolve_link(passage["source"])
+        names = {passage["url"], passage["source"], os.path.splitext(passage["source"])[0]}
+        if link is not None:
+            names.update(link)
+        if number in numbers or any(_mentions(text, name) for name in names):
+            used.append(passage)
+    return used
+
+def _mentions(text, name):
+    """True if lower-cased `text` names `name` as a whole word (very short names never match)."""
+    if not name or len(name) < MIN_NAME_CHARS:
+        return False
+    return re.search(rf"(?<!\w){re.escape(name.lower())}(?!\w)", text) is not None
+
+def citation_from_passages(passages, answer=None):
+    """
+    One citation linking the passages an answer used (None if none resolve). Without
+    `answer`, every passage is linked.
+    """
+    if answer is not None:
+        passages = used_passages(passages, answer)
+    links = _links(passage["url"] for passage in passages)
+    return {"text": "", "links": links} if links else None
+
+class CitationChunk(str):
+    """
+    Empty text chunk that carries citations in-band, so they travel through hedging,
+    single-flight and the async bridge together with the text they belong to.
+    """
+
+    def __new__(cls, citations):
+        chunk = super().__new__(cls, "")
+        chunk.citations = citations
+        return chunk
+
+class CitationCollector:
+    """Accumulates the citations of one answer, dropping links that were already cited."""
+    __slots__ = ("citations", "_urls")
+
+    def __init__(self):
+        self.citations = []
+        self._urls = set()
+
+    def add(self, citations):
+        for citation in citations:
+            links = [link for link in citation["links"] if link["url"] not in self._urls]
+            if links:
+                self._urls.update(link["url"] for link in links)
+                self.citations.append(dict(citation, links=links))
+
+    def __bool__(self):
+        return bool(self.citations)
@@ -0,0 +1,120 @@
+import os
+import re
+from collections import deque
+
+# ⚡ Conversation Window Configuration
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "3000"))  # ✅ Approx. tokens of history sent upstream
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", "400"))
+SUMMARY_LINE_CHARS = 200
+APPROX_CHARS_PER_TOKEN = 4
+
+_sentence_end_re = re.compile(r"(?<=[.!?])\s")
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token for English text)."""
+    return len(text) // APPROX_CHARS_PER_TOKEN + 1
+
+class ConversationWindow:
+    """
+    Keeps the most recent turns of a conversation under a token budget.
+    Token counts and rendered lines are tracked per message as they are appended, so
+    building the KB query or the Claude `messages` payload never rescans the full history.
+    Turns pushed out of the window are optionally folded into a rolling summary.
+    """
+
+    def __init__(self, token_budget=HISTORY_TOKEN_BUDGET, summarize=True,
+                 summary_token_budget=SUMMARY_TOKEN_BUDGET):
+        self.token_budget = token_budget
+        self.summarize = summarize
+        self.summary_token_budget = summary_token_budget
+        self.token_count = 0
+        self._turns = deque()  # ✅ (message, tokens, "role: text" line)
+        self._summary_lines = deque()  # ✅ (line, tokens)
+        self._summary_tokens = 0
+        self._summary_text = None  # ✅ Cached join of _summary_lines
+
+    @classmethod
+    def from_messages(cls, messages, **kwargs):
+        window = cls(**kwargs)
+        for message in messages:
+            window.append(message)
+        return window
+
+    def append(self, message):
+        """Adds a finished message and evicts the oldest turns that no longer fit."""
+        if not message.text or not message.text.strip():
+            return
+        tokens = estimate_tokens(message.text)
+        self._turns.append((message, tokens, f"{message.role}: {message.text}"))
+        self.token_count += tokens
+        self._evict()
+
+    def _evict(self):
+        # ✅ Always keep the newest turn, and never start the window on an assistant turn
+        while len(self._turns) > 1 and (
+            self.token_count > self.token_budget or self._turns[0][0].role != "user"
+        ):
+            message, tokens, _ = self._turns.popleft()
+            self.token_count -= tokens
+            if self.summarize:
+                self._fold(message)
+
+    def _fold(self, message):
+        """Adds the first sentence of an evicted message to the rolling summary."""
+        first_sentence = _sentence_end_re.split(message.text.strip(), maxsplit=1)[0]
+        line = f"{message.role}: {first_sentence[:SUMMARY_LINE_CHARS]}"
+        tokens = estimate_tokens(line)
+        self._summary_lines.append((line, tokens))
+        self._summary_tokens += tokens
+        while len(self._summary_lines) > 1 and self._summary_tokens > self.summary_token_budget:
+            _, dropped_tokens = self._summary_lines.popleft()
+            self._summary_tokens -= dropped_tokens
+        self._summary_text = None
+
+    @property
+    def summary(self):
+        """Rolling summary of turns that fell out of the window ("" if none)."""
+        if self._summary_text is None:
+            self._summary_text = "\n".join(line for line, _ in self._summary_lines)
+        return self._summary_text
+
+    def messages(self):
+        """ChatMessage objects currently inside the window, oldest first."""
+        return [message for message, _, _ in self._turns]
+
+    def recent(self, count):
+        """The last `count` messages in the window."""
+        if count <= 0:
+            return []
+        return [message for message, _, _ in list(self._turns)[-count:]]
+
+    def claude_messages(self):
+        """The window in Claude's `messages` format."""
+        return [{"role": message.role, "content": message.text} for message, _, _ in self._turns]
+
+    def kb_history_text(self):
+        """The window (plus summary) as plain text for the Knowledge Base query."""
+        lines = "\n".join(line for _, _, line in self._turns)
+        if self.summary:
+            return f"Summary of earlier conversation:\n{self.summary}\n{lines}"
+        return lines
+
+    def snapshot(self):
+        """Shallow copy that worker threads can read while this window keeps changing."""
+        copy = ConversationWindow(self.token_budget, self.summarize, self.summary_token_budget)
+        copy.token_count = self.token_count
+        copy._turns = deque(self._turns)
+        copy._summary_lines = deque(self._summary_lines)
+        copy._summary_tokens = self._summary_tokens
+        copy._summary_text = self._summary_text
+        return copy
+
+    def clear(self):
+        self.token_count = 0
+        self._turns.clear()
+        self._summary_lines.clear()
+        self._summary_tokens = 0
+        self._summary_text = None
+
+    def __len__(self):
+        return len(self._turns)
@@ -0,0 +1,127 @@
+import logging
+import os
+import random
+import threading
+import time
+
+import awsclients
+
+# ⚡ Endpoint Pool Configuration (regions / inference profiles Claude can be called through)
+# BEDROCK_ENDPOINTS="eu-west-1=eu.anthropic.claude-3-5-sonnet-20240620-v1:0,eu-central-1=eu.anthropic.claude-..."
+BEDROCK_ENDPOINTS = os.getenv("BEDROCK_ENDPOINTS", "")
+EWMA_ALPHA = float(os.getenv("ENDPOINT_EWMA_ALPHA", "0.3"))  # ✅ Weight of the newest sample
+ERROR_PENALTY = float(os.getenv("ENDPOINT_ERROR_PENALTY", "4"))  # ✅ Score multiplier per unit of error rate
+FAILURES_TO_OPEN = int(os.getenv("ENDPOINT_FAILURES_TO_OPEN", "3"))  # ✅ Consecutive failures before cooling down
+COOLDOWN_SECONDS = float(os.getenv("ENDPOINT_COOLDOWN_SECONDS", "30"))
+EXPLORE_RATE = float(os.getenv("ENDPOINT_EXPLORE_RATE", "0.05"))  # ✅ Share of streams sent to a non-best endpoint to refresh its stats
+
+logger = logging.getLogger("endpoints")
+
+class Endpoint:
+    """One region + model / inference profile, with EWMA time-to-first-token and error rate."""
+
+    def __init__(self, region, model_id):
+        self.region = region
+        self.model_id = model_id
+        self.ttft_ewma = None  # ✅ None until the first successful stream
+        self.error_ewma = 0.0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.successes = 0
+        self.failures = 0
+
+    @property
+    def name(self):
+        return f"{self.region}/{self.model_id}"
+
+    def healthy(self, now=None):
+        return (now or time.monotonic()) >= self.cooldown_until
+
+    def score(self):
+        """Lower is better. Unmeasured endpoints score 0 so they get tried and measured."""
+        if self.ttft_ewma is None:
+            return 0.0
+        return self.ttft_ewma * (1.0 + ERROR_PENALTY * self.error_ewma)
+
+    def client(self):
+        return awsclients.get_client("bedrock-runtime", self.region)
+
+    def to_dict(self):
+        return {
+            "endpoint": self.name,
+            "ttft_ewma": self.ttft_ewma,
+            "error_ewma": self.error_ewma,
+            "healthy": self.healthy(),
+            "successes": self.successes,
+            "failures": self.failures,
+        }
+
+def parse_endpoints(spec, default_model_id):
+    """Parses "region=model_id,region" (a bare region uses `default_model_id`) into Endpoints."""
+    endpoints = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        region, _, profile = item.partition("=")
+        endpoints.append(Endpoint(region.strip(), profile.strip() or default_model_id))
+    return endpoints
+
+class EndpointPool:
+    """
+    Ranks endpoints by their EWMA time-to-first-token, inflated by their recent error rate.
+    Endpoints that fail FAILURES_TO_OPEN times in a row cool down for COOLDOWN_SECONDS.
+    """
+
+    def __init__(self, endpoints, alpha=EWMA_ALPHA, failures_to_open=FAILURES_TO_OPEN, cooldown_seconds=COOLDOWN_SECONDS,
+                 explore_rate=EXPLORE_RATE, seed=None):
+        if not endpoints:
+            raise ValueError("an endpoint pool needs at least one endpoint")
+        self.endpoints = list(endpoints)
+        self.alpha = alpha
+        self.failures_to_open = failures_to_open
+        self.cooldown_seconds = cooldown_seconds
+        self.explore_rate = explore_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_model(cls, model_id, spec=BEDROCK_ENDPOINTS, region=awsclients.AWS_REGION):
+        """Pool from BEDROCK_ENDPOINTS, or just `model_id` in the default region when unset."""
+        return cls(parse_endpoints(spec, model_id) or [Endpoint(region, model_id)])
+
+    def candidates(self):
+        """
+        Endpoints in the order to try them: healthy ones fastest first, then cooling ones
+        (soonest first). Now and then a slower healthy endpoint goes first so its stats stay current.
+        """
+        now = time.monotonic()
+        with self._lock:
+            healthy = sorted((e for e in self.endpoints if e.healthy(now)), key=Endpoint.score)
+            cooling = sorted((e for e in self.endpoints if not e.healthy(now)), key=lambda e: e.cooldown_until)
+            if len(healthy) > 1 and self._random.random() < self.explore_rate:
+                healthy.insert(0, healthy.pop(self._random.randrange(1, len(healthy))))
+        return healthy + cooling
+
+    def record_success(self, endpoint, ttft):
+        with self._lock:
+            endpoint.ttft_ewma = ttft if endpoint.ttft_ewma is None else (
+                self.alpha * ttft + (1 - self.alpha) * endpoint.ttft_ewma
+            )
+            endpoint.error_ewma *= 1 - self.alpha
+            endpoint.consecutive_failures = 0
+            endpoint.successes += 1
+
+    def record_failure(self, endpoint, error=None):
+        with self._lock:
+            endpoint.error_ewma = self.alpha + (1 - self.alpha) * endpoint.error_ewma
+            endpoint.consecutive_failures += 1
+            endpoint.failures += 1
+            if endpoint.consecutive_failures >= self.failures_to_open:
+                endpoint.cooldown_until = time.monotonic() + self.cooldown_seconds
+                logger.warning("⚠️ Endpoint %s cooling down for %.0fs after %d failures (%s)", endpoint.name,
+                               self.cooldown_seconds, endpoint.consecutive_failures, error)
+
+    def stats(self):
+        with self._lock:
+            return [endpoint.to_dict() for endpoint in self.endpoints]
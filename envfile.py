@@ -0,0 +1,25 @@
+import os
+
+def find_dotenv():
+    """Same lookup as python-dotenv's find_dotenv(): this file's folder, then its parents."""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    while True:
+        path = os.path.join(directory, ".env")
+        if os.path.isfile(path):
+            return path
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+def load_env():
+    """Loads .env into os.environ (python-dotenv is only imported when there is a .env file)."""
+    if dotenv_path := find_dotenv():
+        from dotenv import load_dotenv
+
+        load_dotenv(dotenv_path)
+    return dotenv_path
+
+# ✅ Runs on import: the config modules read os.getenv at import time, so genailib and the
+# entry points import this module before any of them
+load_env()
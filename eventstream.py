@@ -0,0 +1,144 @@
+import codecs
+import json
+import logging
+import os
+import re
+
+# ⚡ Event-Stream Decoding (shared by the KB and Claude streams)
+# orjson is optional; without it the standard library json module is used.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+MAX_PENDING_CHARS = int(os.getenv("EVENTSTREAM_MAX_PENDING_CHARS", str(1024 * 1024)))  # ✅ Drop a frame that never completes
+
+logger = logging.getLogger("eventstream")
+
+loads = orjson.loads if orjson is not None else json.loads
+_DecodeErrors = (ValueError, orjson.JSONDecodeError) if orjson is not None else (ValueError,)
+
+_structural_re = re.compile(r'["{}\[\]]')
+_string_special_re = re.compile(r'["\\]')
+
+class JSONStreamDecoder:
+    """
+    Incremental decoder for chunk payloads. The common case (one complete JSON object per
+    chunk) is a single loads() call. Otherwise text is buffered and split into complete
+    top-level objects, so payloads split across chunks or packed into one chunk are not lost.
+    """
+
+    def __init__(self, max_pending_chars=MAX_PENDING_CHARS):
+        self.max_pending_chars = max_pending_chars
+        self.dropped = 0  # ✅ Frames that could not be decoded
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._text = ""
+        self._reset_scan()
+
+    def _reset_scan(self):
+        self._pos = 0  # ✅ Scan position in _text
+        self._depth = 0
+        self._in_string = False
+
+    def feed(self, data):
+        """Returns the list of objects completed by `data` (bytes)."""
+        if not self._text and not self._utf8.getstate()[0]:
+            try:
+                obj = loads(data)  # ✅ Fast path, no buffering
+                if isinstance(obj, dict):
+                    return [obj]
+            except _DecodeErrors:
+                pass
+        self._text += self._utf8.decode(data)
+        return self._drain()
+
+    def _drain(self):
+        objects = []
+        text = self._text
+        pos, depth, in_string = self._pos, self._depth, self._in_string
+        frame_start = 0
+        while True:
+            if in_string:
+                match = _string_special_re.search(text, pos)
+                if match is None:
+                    pos = len(text)
+                    break
+                pos = match.end()
+                if match.group() == "\\":
+                    if pos >= len(text):
+                        pos -= 1  # ✅ Escape split across chunks, rescan it next time
+                        break
+                    pos += 1
+                else:
+                    in_string = False
+                continue
+
+            match = _structural_re.search(text, pos)
+            if match is None:
+                pos = len(text)
+                break
+            if depth == 0 and text[pos:match.start()].strip():
+                self._drop(text[pos:match.start()])
+            pos = match.end()
+            char = match.group()
+            if char == '"':
+                if depth > 0:
+                    in_string = True
+                else:
+                    self._drop(char)
+            elif char in "{[":
+                if depth == 0:
+                    frame_start = match.start()
+                depth += 1
+            elif depth > 0:
+                depth -= 1
+                if depth == 0:
+                    objects.append(self._parse(text[frame_start:pos]))
+                    frame_start = pos
+            else:
+                self._drop(char)
+
+        if depth == 0:
+            self._text = ""
+            self._reset_scan()
+        else:
+            self._text = text[frame_start:]
+            self._pos, self._depth, self._in_string = pos - frame_start, depth, in_string
+            if len(self._text) > self.max_pending_chars:
+                self._drop(self._text)
+                self._text = ""
+                self._reset_scan()
+        return [obj for obj in objects if isinstance(obj, dict)]
+
+    def _parse(self, frame):
+        try:
+            return loads(frame)
+        except _DecodeErrors as e:
+            self._drop(frame, e)
+            return None
+
+    def _drop(self, text, error=None):
+        self.dropped += 1
+        logger.warning("⚠️ Dropped undecodable stream data (%d chars): %s", len(text), error or text[:80])
+
+    def close(self):
+        """Reports a trailing incomplete frame, if any."""
+        if self._text.strip():
+            self._drop(self._text, "stream ended mid-frame")
+        self._text = ""
+        self._reset_scan()
+
+def iter_payloads(stream, decoder=None):
+    """
+    Yields every JSON payload of a Bedrock event stream, decoding `chunk.bytes` incrementally.
+    Events that are already structured (e.g. {"citation": {...}}) are yielded as they are.
+    """
+    decoder = decoder or JSONStreamDecoder()
+    for event in stream:
+        chunk = event.get("chunk")
+        if chunk is not None:
+            if "bytes" in chunk:
+                yield from decoder.feed(chunk["bytes"])
+        elif event:
+            yield event
+    decoder.close()
@@ -0,0 +1,255 @@
+import json
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+import awsclients
+from sources import sources
+
+# ⚡ Local Bedrock stand-in: emits the same chunk formats genailib parses, fully offline
+DEFAULT_ANSWER = (
+    "Check the scheme terms and conditions for eligibility, keep your herd register up to date "
+    "and record every animal movement in the Herdwatch app so your payment is not delayed. "
+)
+KB_REFUSAL = "Sorry, I am unable to assist you with this request."
+
+def _chunk(payload):
+    return {"chunk": {"bytes": json.dumps(payload).encode("utf-8")}}
+
+def _throttling_error(operation_name):
+    return ClientError(
+        {"Error": {"Code": "ThrottlingException", "Message": "Too many requests, please wait before trying again."}},
+        operation_name,
+    )
+
+def rechunk(events, frame_bytes):
+    """Re-cuts the chunk bytes into `frame_bytes`-sized pieces, splitting and packing JSON payloads like a real network stream."""
+    if not frame_bytes:
+        return events
+    data = b"".join(event["chunk"]["bytes"] for event in events)
+    return [{"chunk": {"bytes": data[i:i + frame_bytes]}} for i in range(0, len(data), frame_bytes)]
+
+def _unavailable_error(operation_name):
+    return ClientError(
+        {"Error": {"Code": "ServiceUnavailableException", "Message": "Bedrock is unable to process your request."}},
+        operation_name,
+    )
+
+def _answer_tokens(count, answer=DEFAULT_ANSWER):
+    words = answer.split(" ")
+    return [words[i % len(words)] + " " for i in range(count)]
+
+class FakeEventStream:
+    """
+    Iterable of stream events with a first-event delay and a fixed token rate. close() from
+    another thread interrupts a read in progress, which then fails like an aborted socket.
+    """
+
+    def __init__(self, events, first_token_delay=0.0, tokens_per_second=0.0):
+        self.events = events
+        self.first_token_delay = first_token_delay
+        self.tokens_per_second = tokens_per_second
+        self._closed = threading.Event()
+
+    @property
+    def closed(self):
+        return self._closed.is_set()
+
+    def _wait(self, seconds):
+        if self._closed.wait(seconds):
+            raise ConnectionError("connection closed while reading the event stream")
+
+    def __iter__(self):
+        if self.first_token_delay:
+            self._wait(self.first_token_delay)
+        gap = 1.0 / self.tokens_per_second if self.tokens_per_second else 0.0
+        for i, event in enumerate(self.events):
+            if self.closed:
+                return
+            if i and gap:
+                self._wait(gap)
+            yield event
+
+    def close(self):
+        self._closed.set()
+
+class FakeBedrockRuntime:
+    """Stand-in for the `bedrock-runtime` client (invoke_model_with_response_stream)."""
+
+    def __init__(self, tokens_per_second=60.0, first_token_delay=0.6, answer_tokens=200,
+                 throttle_rate=0.0, seed=None, error_rate=0.0, frame_bytes=0):
+        self.tokens_per_second = tokens_per_second
+        self.first_token_delay = first_token_delay
+        self.answer_tokens = answer_tokens
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate  # ✅ Share of calls failing with ServiceUnavailableException
+        self.frame_bytes = frame_bytes  # ✅ 0 = one JSON payload per chunk
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._cached_prefixes = set()
+
+    def _prompt_cache_usage(self, request):
+        """(read, write) token counts: the longest previously cached prefix is read, the rest up to the last breakpoint written."""
+        system = request.get("system")
+        parts = [(block.get("text", ""), "cache_control" in block) for block in system] if isinstance(system, list) else [(system or "", False)]
+        for message in request.get("messages", []):
+            content = message.get("content", "")
+            if isinstance(content, list):
+                parts.append((message["role"] + "".join(b.get("text", "") for b in content), any("cache_control" in b for b in content)))
+            else:
+                parts.append((message["role"] + content, False))
+        breakpoints = [i + 1 for i, (_, cacheable) in enumerate(parts) if cacheable]
+        if not breakpoints:
+            return 0, 0
+        prefix_chars = [len("".join(text for text, _ in parts[:end])) for end in range(len(parts) + 1)]
+        prefixes = ["\x00".join(text for text, _ in parts[:end]) for end in range(breakpoints[-1] + 1)]
+        with self._lock:
+            # ✅ Like Bedrock, a breakpoint also hits entries written at earlier block boundaries
+            read_end = max((end for end, prefix in enumerate(prefixes) if end and prefix in self._cached_prefixes), default=0)
+            self._cached_prefixes.update(prefixes[end] for end in breakpoints)
+        read = prefix_chars[read_end] // 4
+        return read, prefix_chars[breakpoints[-1]] // 4 - read
+
+    def invoke_model_with_response_stream(self, modelId, body, **kwargs):
+        with self._lock:
+            self.calls += 1
+            throttled = self._random.random() < self.throttle_rate
+            failed = self._random.random() < self.error_rate
+        if throttled:
+            raise _throttling_error("InvokeModelWithResponseStream")
+        if failed:
+            raise _unavailable_error("InvokeModelWithResponseStream")
+
+        request = json.loads(body)
+        input_tokens = sum(len(str(m.get("content", ""))) for m in request.get("messages", [])) // 4
+        cache_read, cache_write = self._prompt_cache_usage(request)
+        tokens = _answer_tokens(self.answer_tokens)
+        events = [_chunk({"type": "message_start", "message": {"usage": {
+            "input_tokens": input_tokens, "output_tokens": 1,
+            "cache_read_input_tokens": cache_read, "cache_creation_input_tokens": cache_write,
+        }}})]
+        events.append(_chunk({"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}}))
+        events.extend(
+            _chunk({"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": token}})
+            for token in tokens
+        )
+        events.append(_chunk({"type": "content_block_stop", "index": 0}))
+        events.append(_chunk({"type": "message_delta", "delta": {"stop_reason": "end_turn"}, "usage": {"output_tokens": len(tokens)}}))
+        events.append(_chunk({
+            "type": "message_stop",
+            "amazon-bedrock-invocationMetrics": {
+                "inputTokenCount": input_tokens, "outputTokenCount": len(tokens),
+                "cacheReadInputTokenCount": cache_read, "cacheWriteInputTokenCount": cache_write,
+            },
+        }))
+        events = rechunk(events, self.frame_bytes)
+        return {"body": FakeEventStream(events, self.first_token_delay, self.tokens_per_second), "contentType": "application/json"}
+
+class FakeAgentRuntime:
+    """Stand-in for the `bedrock-agent-runtime` client (retrieve_and_generate_stream, retrieve and invoke_agent)."""
+
+    def __init__(self, tokens_per_second=60.0, first_token_delay=1.2, answer_tokens=200,
+                 miss_rate=0.3, refusal_rate=0.5, throttle_rate=0.0, seed=None, retrieve_delay=0.15, frame_bytes=0):
+        self.tokens_per_second = tokens_per_second
+        self.first_token_delay = first_token_delay
+        self.answer_tokens = answer_tokens
+        self.miss_rate = miss_rate
+        self.refusal_rate = refusal_rate  # ✅ Share of misses answered with a refusal instead of nothing
+        self.throttle_rate = throttle_rate
+        self.retrieve_delay = retrieve_delay
+        self.frame_bytes = frame_bytes
+        self.calls = 0
+        self.retrieve_calls = 0
+        self.agent_sessions = {}  # ✅ sessionId -> turns seen, like the agent's server-side memory
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def retrieve(self, knowledgeBaseId, retrievalQuery, retrievalConfiguration=None, **kwargs):
+        with self._lock:
+            self.retrieve_calls += 1
+            throttled = self._random.random() < self.throttle_rate
+            missed = self._random.random() < self.miss_rate
+        if throttled:
+            raise _throttling_error("Retrieve")
+
+        time.sleep(self.retrieve_delay)
+        if missed:
+            return {"retrievalResults": []}
+        top_k = (retrievalConfiguration or {}).get("vectorSearchConfiguration", {}).get("numberOfResults", 5)
+        results = [
+            {
+                "content": {"text": DEFAULT_ANSWER},
+                "location": {"type": "S3", "s3Location": {"uri": f"s3://herdwatch-kb/{filename}"}},
+                "score": 0.9 - 0.05 * i,
+            }
+            for i, filename in enumerate(list(sources)[:top_k])
+        ]
+        return {"retrievalResults": results}
+
+    def retrieve_and_generate_stream(self, **kwargs):
+        with self._lock:
+            self.calls += 1
+            throttled = self._random.random() < self.throttle_rate
+            missed = self._random.random() < self.miss_rate
+            refused = self._random.random() < self.refusal_rate
+        if throttled:
+            raise _throttling_error("RetrieveAndGenerateStream")
+
+        if missed:
+            tokens = [word + " " for word in KB_REFUSAL.split(" ")] if refused else []
+        else:
+            tokens = _answer_tokens(self.answer_tokens)
+        events = [_chunk({"outputText": token}) for token in tokens]
+        if not missed:
+            events.append(_chunk({"citation": {
+                "generatedResponsePart": {"textResponsePart": {"text": "".join(tokens)}},
+                "retrievedReferences": [
+                    {"content": {"text": DEFAULT_ANSWER}, "location": {"type": "S3", "s3Location": {"uri": f"s3://herdwatch-kb/{filename}"}}}
+                    for filename in list(sources)[:2]
+                ],
+            }}))
+        events = rechunk(events, self.frame_bytes)
+        return {"body": FakeEventStream(events, self.first_token_delay, self.tokens_per_second)}
+
+    def invoke_agent(self, agentId, agentAliasId, sessionId, inputText, **kwargs):
+        """Streams the final response as raw text chunks (streamFinalResponse), with one attribution at the end."""
+        with self._lock:
+            self.calls += 1
+            self.agent_sessions[sessionId] = self.agent_sessions.get(sessionId, 0) + 1
+            throttled = self._random.random() < self.throttle_rate
+        if throttled:
+            raise _throttling_error("InvokeAgent")
+
+        streaming = kwargs.get("streamingConfigurations", {}).get("streamFinalResponse", False)
+        tokens = _answer_tokens(self.answer_tokens)
+        if not streaming:
+            tokens = ["".join(tokens)]  # ✅ Without streamFinalResponse the whole answer arrives in one chunk
+        events = [{"chunk": {"bytes": token.encode("utf-8")}} for token in tokens]
+        events[-1]["chunk"]["attribution"] = {"citations": [{
+            "generatedResponsePart": {"textResponsePart": {"text": "".join(tokens)}},
+            "retrievedReferences": [
+                {"content": {"text": DEFAULT_ANSWER}, "location": {"type": "S3", "s3Location": {"uri": f"s3://herdwatch-kb/{filename}"}}}
+                for filename in list(sources)[:2]
+            ],
+        }]}
+        first_delay = self.first_token_delay + self.retrieve_delay  # ✅ Agent orchestration adds a retrieval step
+        if not streaming and self.tokens_per_second:
+            first_delay += self.answer_tokens / self.tokens_per_second  # ✅ Buffered until generation has finished
+        return {"completion": FakeEventStream(events, first_delay, self.tokens_per_second), "sessionId": sessionId}
+
+def install(runtime=None, agent_runtime=None, region_name=awsclients.AWS_REGION):
+    """Routes genailib's Bedrock clients to local stand-ins. Returns (runtime, agent_runtime)."""
+    runtime = runtime or FakeBedrockRuntime()
+    agent_runtime = agent_runtime or FakeAgentRuntime()
+    awsclients.set_client("bedrock-runtime", runtime, region_name)
+    awsclients.set_client("bedrock-agent-runtime", agent_runtime, region_name)
+    return runtime, agent_runtime
+
+def install_regions(runtimes):
+    """Installs one `bedrock-runtime` stand-in per region, e.g. {"eu-west-1": FakeBedrockRuntime(...)}."""
+    for region_name, runtime in runtimes.items():
+        awsclients.set_client("bedrock-runtime", runtime, region_name)
+    return runtimes
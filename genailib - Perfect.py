@@ -1,7 +1,7 @@
-import boto3
+import awsclients
 import dotenv
 import json
-import sys
+import logging
 import re
 from datetime import datetime
 from chatmessage import ChatMessage
@@ -10,6 +10,8 @@ from botocore.eventstream import EventStream
 
 dotenv.load_dotenv()
 
+logger = logging.getLogger("genailib-perfect")
+
 # Bedrock Agent Configuration
 agent_id = "CVH9H4JPAX"
 agent_alias_id = "WTQJJVHLVI"  # ✅ Stored Correctly
@@ -24,8 +26,9 @@ temperature = 0.7
 topP = 0.9
 MAX_MESSAGES = 30
 
-# Initialize Bedrock Runtime Client
-agent = boto3.client(service_name="bedrock-agent-runtime", region_name="eu-west-1")
+# Bedrock Agent Runtime Client (shared, lazily created - see awsclients.py)
+def agent_client():
+    return awsclients.get_client("bedrock-agent-runtime")
 
 def process_event_stream(event_stream):
     """
@@ -37,13 +40,9 @@ def process_event_stream(event_stream):
         for event in event_stream:
             if "chunk" in event and "bytes" in event["chunk"]:
                 chunk_text = event["chunk"]["bytes"].decode("utf-8")
-                sys.stdout.write(chunk_text)
-                sys.stdout.flush()
                 full_response += chunk_text  # ✅ Collect response text
-
-        print("\n")
     except Exception as e:
-        print(f"❌ Error processing EventStream: {str(e)}")
+        logger.error("❌ Error processing EventStream: %s", e)
 
     return full_response.strip()
 
@@ -72,10 +71,10 @@ def run_query_with_knowledge_base(prompt, session_id=None):
     - First, tries to retrieve an answer from the knowledge base.
     - If no answer is found, it falls back to using the AI model.
     """
-    print("\n🔍 **Calling Bedrock Agent - Step 1: Searching Knowledge Base...**\n")
+    logger.info("🔍 Calling Bedrock Agent - Step 1: Searching Knowledge Base...")
 
     try:
-        response = agent.retrieve_and_generate(
+        response = agent_client().retrieve_and_generate(
             input={"text": prompt},
             retrieveAndGenerateConfiguration={
                 "knowledgeBaseConfiguration": {
@@ -100,7 +99,8 @@ def run_query_with_knowledge_base(prompt, session_id=None):
             }
         )
 
-        print("\n🔍 **Raw API Response (Knowledge Base):**\n", json.dumps(response, indent=4))
+        if logger.isEnabledFor(logging.DEBUG):  # ✅ Pretty-printing the raw response is debug-only work
+            logger.debug("🔍 Raw API Response (Knowledge Base): %s", json.dumps(response, indent=4, default=str))
 
         # ✅ Extract response text
         output = response.get("output", {}).get("text", "").strip()
@@ -112,13 +112,13 @@ def run_query_with_knowledge_base(prompt, session_id=None):
             "I could not find" in output or 
             "The search results do not contain" in output
         ):
-            print("\n🔍 **No Answer Found in KB - Step 2: Using AI Model**\n")
+            logger.info("🔍 No Answer Found in KB - Step 2: Using AI Model")
             return run_query_with_ai_model(prompt, session_id)
 
         return ChatMessage("assistant", output), response.get("sessionId", "UnknownSession")
 
     except Exception as e:
-        print(f"⚠️ Error retrieving from Knowledge Base: {str(e)}")
+        logger.warning("⚠️ Error retrieving from Knowledge Base: %s", e)
         return run_query_with_ai_model(prompt, session_id)
 
 def run_query_with_ai_model(prompt, session_id=None):
@@ -126,14 +126,12 @@ def run_query_with_ai_model(prompt, session_id=None):
     Fallback method: Uses AI Model if no KB results are found.
     Ensures fact-based questions are correctly answered.
     """
-    print("\n🔍 **Calling Bedrock Agent - AI Model Response...**\n")
+    logger.info("🔍 Calling Bedrock Agent - AI Model Response...")
 
     session_id = session_id or "default-session"
 
     try:
-        bedrock_agent_runtime_client = boto3.client("bedrock-agent-runtime", region_name="eu-west-1")
-
-        response = bedrock_agent_runtime_client.invoke_agent(
+        response = agent_client().invoke_agent(
             agentId=agent_id,
             agentAliasId=agent_alias_id,
             sessionId=session_id,
@@ -142,13 +140,13 @@ def run_query_with_ai_model(prompt, session_id=None):
             endSession=False
         )
 
-        print("\n🔍 **Raw API Response (AI Model) [without EventStream]:**")
-        response_copy = {key: str(value) if isinstance(value, EventStream) else value 
-                         for key, value in response.items()}
-        print(json.dumps(response_copy, indent=4))
+        if logger.isEnabledFor(logging.DEBUG):
+            response_copy = {key: str(value) if isinstance(value, EventStream) else value
+                             for key, value in response.items()}
+            logger.debug("🔍 Raw API Response (AI Model) [without EventStream]: %s", json.dumps(response_copy, indent=4, default=str))
 
         if "completion" in response and isinstance(response["completion"], EventStream):
-            print("\n🔍 **Processing EventStream Response...**")
+            logger.debug("🔍 Processing EventStream Response...")
             full_response = process_event_stream(response["completion"])
         else:
             full_response = response.get("completion", {}).get("outputText", "No response text available")
@@ -159,7 +157,7 @@ def run_query_with_ai_model(prompt, session_id=None):
         return ChatMessage("assistant", full_response), response.get("sessionId", session_id)
 
     except Exception as e:
-        print(f"❌ Error calling Bedrock AI Model: {str(e)}")
+        logger.error("❌ Error calling Bedrock AI Model: %s", e)
         return ChatMessage("assistant", "An error occurred while processing your request."), session_id
 
 def chat_with_model(message_history, new_text, session_id=None):
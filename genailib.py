@@ -1,14 +1,39 @@
-import boto3
+import codecs
+import hashlib
 import json
+import logging
+import os
+import re
 import sys
+import queue
+import threading
+import time
+import uuid
 import concurrent.futures
+import contextvars
+from collections import namedtuple
 from datetime import datetime
-from dotenv import load_dotenv
+import envfile  # ✅ Loads .env before the config modules below read os.getenv
+import awsclients
+import localindex
+import metrics
+from cancellation import CANCEL_CONSUMER_CLOSED, CANCEL_DONE, REQUEST_DEADLINE_SECONDS, CancelToken, close_on_cancel, is_cancelled
 from chatmessage import ChatMessage
+from citations import CitationChunk, CitationCollector, citation_from_passages, parse_citation
+from conversation import ConversationWindow, estimate_tokens
+from endpoints import Endpoint, EndpointPool
+from eventstream import iter_payloads
+from responsecache import ResponseCache, cache_key, normalize_prompt, replay_stream
+from router import ROUTE_DIRECT, ROUTE_FAQ, ROUTER_ENABLED, QueryRouter
+from retrieval import RETRIEVAL_TOP_K, RetrievalCache, condense_query, is_follow_up, merge_passages, passages_from_results
+from scheduler import BedrockScheduler, QueueTimeout
+from singleflight import SingleFlight
+from streambuffer import StreamBuffer
 from sources import sources
 
-# Load environment variables
-load_dotenv()
+# ⚡ Logging & Metrics (sinks from METRICS_PORT / METRICS_SPANS_FILE, see metrics.py)
+logger = logging.getLogger("genailib")
+prometheus_sink = metrics.configure_from_env()
 
 # ⚡ Bedrock Model Configuration
 model_id = "eu.anthropic.claude-3-5-sonnet-20240620-v1:0"
@@ -18,109 +43,1042 @@ knowledge_base_id = "BKWDTDREEZ"  # ✅ AWS Knowledge Base ID
 max_tokens_to_sample = 2000
 temperature = 0.7
 top_p = 0.7
-MAX_MESSAGES = 20  # ✅ Keeps chat history manageable
+MAX_MESSAGES = 20  # ✅ Keeps the caller's chat history list manageable (payloads use ConversationWindow)
 
-# ⚡ Initialize AWS Clients
-bedrock_client = boto3.client(service_name="bedrock-runtime", region_name="eu-west-1")
-kb_client = boto3.client(service_name="bedrock-agent-runtime", region_name="eu-west-1")
+# ⚡ Hedged Execution (start Claude speculatively alongside the Knowledge Base)
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "1") != "0"
+HEDGE_DELAY_SECONDS = float(os.getenv("HEDGE_DELAY_SECONDS", "1.5"))  # ✅ 0 = start Claude immediately
 
-# 🚀 Streaming Query to AWS Knowledge Base (Primary Source)
-def query_knowledge_base_stream(prompt, message_history, session_id=None):
-    """Queries AWS Knowledge Base using streaming response before calling Claude."""
-    print("\n🔍 **Checking AWS Knowledge Base First...**\n")
-    session_id = session_id or "default-session"
+# ⚡ Early "unhelpful KB answer" detection (only the first chars of the KB stream are checked)
+KB_CLASSIFY_CHARS = int(os.getenv("KB_CLASSIFY_CHARS", "120"))
+UNHELPFUL_KB_PATTERNS = [
+    r"Sorry, I am unable to assist",
+    r"I cannot provide that information",
+    r"I'm unable to help with that request",
+    r"I apologize that I couldn't find this specific information",
+    r"I couldn't find this in the knowledge base",
+    r"I could not find",
+    r"The search results do not contain",
+]
+_unhelpful_kb_re = re.compile("|".join(UNHELPFUL_KB_PATTERNS), re.IGNORECASE)
 
-    # ✅ Include previous questions & answers
-    history_text = "\n".join([f"{msg.role}: {msg.text}" for msg in message_history])
+# ⚡ Response Cache (repeated farm questions are replayed instead of re-asked)
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") != "0"
+ERROR_MESSAGE = "An error occurred while processing your request."
 
-    full_query = f"Previous conversation:\n{history_text}\nNew question:\n{prompt}"
+# ⚡ Single-Flight (identical in-flight questions share one upstream stream, see singleflight.py)
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "1") != "0"
+
+# ⚡ Quota-aware scheduling of Bedrock calls (token buckets + throttling backoff, see scheduler.py)
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "1") != "0"
+
+# ⚡ Local Retrieval Tier (in-corpus questions skip the KB hop, see localindex.py)
+LOCAL_INDEX_ENABLED = os.getenv("LOCAL_INDEX_ENABLED", "1") != "0"
+LOCAL_INDEX_TOP_K = int(os.getenv("LOCAL_INDEX_TOP_K", "4"))
+LOCAL_INDEX_MIN_SCORE = float(os.getenv("LOCAL_INDEX_MIN_SCORE", "0.3"))  # ✅ Best cosine score needed to trust local passages
+
+# ⚡ Split Retrieval (KB Retrieve stage + Claude generation stage instead of RetrieveAndGenerate, see retrieval.py)
+# Opt-in: when on it replaces the hedged KB / Claude race and the early-refusal check on the "kb" engine.
+SPLIT_RETRIEVAL_ENABLED = os.getenv("SPLIT_RETRIEVAL_ENABLED", "0") == "1"
+RETRIEVAL_CACHE_ENABLED = os.getenv("RETRIEVAL_CACHE_ENABLED", "1") != "0"
+CONDENSE_MODEL_ID = os.getenv("CONDENSE_MODEL_ID", "")  # ✅ Optional cheap model for rewriting follow-ups, e.g. Claude Haiku
+CONDENSE_MAX_TOKENS = 100
+
+# ⚡ Anthropic Prompt Caching (opt-in; the model / inference profile must support it on Bedrock)
+# Marks the static system prompt and the history up to the previous turn as cacheable.
+# Bedrock only caches prefixes above the model's minimum size (about 1024 tokens for Sonnet).
+PROMPT_CACHING_ENABLED = os.getenv("PROMPT_CACHING_ENABLED", "0") == "1"
+CACHE_CONTROL = {"type": "ephemeral"}
+
+# ⚡ Chat Engine (the backend behind chat_with_model: "kb" = KB + Claude, "model" = Claude only, "agent" = Bedrock Agent)
+CHAT_ENGINE = os.getenv("CHAT_ENGINE", "kb")
+AGENT_ID = os.getenv("BEDROCK_AGENT_ID", "CVH9H4JPAX")
+AGENT_ALIAS_ID = os.getenv("BEDROCK_AGENT_ALIAS_ID", "WTQJJVHLVI")
+_agent_session_re = re.compile(r"^[0-9a-zA-Z._:-]{2,100}$")  # ✅ What InvokeAgent accepts as a sessionId
+
+SYSTEM_PROMPT = "You are a livestock advisory for the Herdwatch livestock management app.\nHere are some relevant sources to check first:\n'https://help.herdwatch.com/en/'\n'https://herdwatch.com/'\n"
+
+# ⚡ AWS Clients (created lazily and shared process-wide, see awsclients.py)
+def __getattr__(name):
+    """Keeps `genailib.bedrock_client` / `genailib.kb_client` working without import-time clients."""
+    if name == "bedrock_client":
+        return awsclients.get_client("bedrock-runtime")
+    if name == "kb_client":
+        return awsclients.get_client("bedrock-agent-runtime")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# ✅ Shared by every Streamlit session in this process (plus SQLite if RESPONSE_CACHE_DB is set)
+response_cache = ResponseCache()
+
+# ✅ Regions / inference profiles per model, ranked by live time-to-first-token and error rate
+endpoint_pools = {model_id: EndpointPool.for_model(model_id)}
+if prometheus_sink is not None:
+    prometheus_sink.gauge("endpoints_healthy", lambda: sum(e["healthy"] for e in endpoint_pools[model_id].stats()))
+
+# ✅ Up-front router (FAQ / KB / direct model), loaded once per process
+query_router = QueryRouter()
+
+# ✅ Retrieved KB passages per standalone query, shared by every session in this process
+retrieval_cache = RetrievalCache()
+
+# ✅ In-flight upstream streams, shared by every session in this process
+inflight = SingleFlight()
+
+# ✅ One scheduler per process, so all sessions share the account quota
+bedrock_scheduler = BedrockScheduler()
+if SCHEDULER_ENABLED:
+    # ✅ The scheduler owns throttle retries: botocore's own would multiply attempts and sleep around the buckets
+    awsclients.retry_in_scheduler("bedrock-runtime", "bedrock-agent-runtime")
+if prometheus_sink is not None:
+    prometheus_sink.gauge("scheduler_queue_depth", lambda: bedrock_scheduler.queue_depth)
+    prometheus_sink.gauge("scheduler_throttled_total", lambda: bedrock_scheduler.throttled)
+    prometheus_sink.gauge("scheduler_queue_timeouts_total", lambda: bedrock_scheduler.timeouts)
+    prometheus_sink.gauge("scheduler_max_wait_seconds", lambda: bedrock_scheduler.max_wait_seconds)
+
+def start_thread(name, fn, *args):
+    """
+    Runs `fn(*args)` on its own daemon thread in the caller's context (scheduler priority
+    included) and returns a Future for its result. A stream holds its thread for the whole
+    answer, so a bounded pool would make chats queue before they even send a request.
+    """
+    future = concurrent.futures.Future()
+    context = contextvars.copy_context()
+
+    def run():
+        try:
+            future.set_result(context.run(fn, *args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name=name, daemon=True).start()
+    return future
+
+def warm_up():
+    """
+    Does the one-time work the first chat would otherwise pay for: imports boto3, builds
+    the AWS clients for every endpoint and loads the local index. Safe to call from a
+    background thread while the UI renders; returns the seconds it took.
+    """
+    started = time.perf_counter()
+    try:
+        awsclients.get_client("bedrock-agent-runtime")
+        for pool in list(endpoint_pools.values()):
+            for endpoint in pool.endpoints:
+                endpoint.client()
+    except Exception as e:
+        logger.warning("⚠️ Could not create the AWS clients up front: %s", e)
+    if LOCAL_INDEX_ENABLED:
+        localindex.get_index()
+    elapsed = time.perf_counter() - started
+    logger.info("🔥 Warmed up in %.2fs", elapsed)
+    return elapsed
+
+def classify_kb_prefix(text, final=False):
+    """
+    Classifies the beginning of a KB answer.
+    Returns "unhelpful" for refusals / no-result answers, "helpful" once enough text
+    has been seen, or None while more text is needed.
+    """
+    if _unhelpful_kb_re.search(text):
+        return "unhelpful"
+    if final or len(text) >= KB_CLASSIFY_CHARS:
+        return "helpful" if text.strip() else "unhelpful"
+    return None
+
+def _scheduled_call(request, estimated_tokens, trace, stage, max_retries=None):
+    """Sends a Bedrock request through the quota scheduler (when enabled)."""
+    if not SCHEDULER_ENABLED:
+        return request()
+    return bedrock_scheduler.call(request, estimated_tokens, trace=trace, stage=stage, max_retries=max_retries)
+
+def _endpoint_pool(model):
+    """The endpoint pool for `model` (BEDROCK_ENDPOINTS applies to the default model_id)."""
+    pool = endpoint_pools.get(model)
+    if pool is None:
+        pool = endpoint_pools.setdefault(model, EndpointPool([Endpoint(awsclients.AWS_REGION, model)]))
+    return pool
+
+def _as_window(message_history):
+    """Accepts a ConversationWindow or a plain list of ChatMessage objects."""
+    if isinstance(message_history, ConversationWindow):
+        return message_history
+    return ConversationWindow.from_messages(message_history)
+
+def _system_prompt_extras(passages=None, summary=""):
+    """The per-request context: rolling summary and retrieved passages (system prompt, or the new turn when caching)."""
+    extras = ""
+    if summary:
+        extras = f"\nSummary of the earlier conversation:\n{summary}\n"
+    if not passages:
+        return extras
+    excerpts = "\n\n".join(
+        f"[{i}] {passage['source']} ({passage['url']})\n{passage['text']}"
+        for i, passage in enumerate(passages, start=1)
+    )
+    return (
+        f"{extras}\nAnswer using these excerpts from official scheme documents where relevant, "
+        f"cite each excerpt you use by its number (e.g. [1]) and mention the source link:\n\n{excerpts}\n"
+    )
+
+def _build_system_prompt(passages=None, summary=""):
+    """Adds the rolling conversation summary and retrieved passages (if any) to the system prompt."""
+    return SYSTEM_PROMPT + _system_prompt_extras(passages, summary)
+
+def _build_cached_system():
+    """The static system prompt as a content block with a cache breakpoint."""
+    return [{"type": "text", "text": SYSTEM_PROMPT, "cache_control": CACHE_CONTROL}]
+
+def _user_turn_with_context(prompt, passages=None, summary=""):
+    """The new question with the per-request summary / passages in front of it (prompt caching layout)."""
+    extras = _system_prompt_extras(passages, summary).strip()
+    return f"{extras}\n\nQuestion: {prompt}" if extras else prompt
 
+def _mark_history_breakpoint(messages):
+    """Makes the history up to the previous turn cacheable (messages[-1] is the new question)."""
+    if len(messages) < 2:
+        return messages
+    previous = messages[-2]
+    previous["content"] = [{"type": "text", "text": previous["content"], "cache_control": CACHE_CONTROL}]
+    return messages
+
+def retrieve_local_passages(prompt):
+    """Searches the local index; returns passages only when the best match is strong enough."""
+    if not LOCAL_INDEX_ENABLED:
+        return []
+    index = localindex.get_index()
+    if index is None:
+        return []
+    passages = index.search(prompt, LOCAL_INDEX_TOP_K)
+    if passages and passages[0]["score"] >= LOCAL_INDEX_MIN_SCORE:
+        return passages
+    return []
+
+def _condense_with_model(prompt, history_text, trace):
+    """Asks CONDENSE_MODEL_ID to rewrite a follow-up as a standalone search query."""
+    body = json.dumps({
+        "anthropic_version": "bedrock-2023-05-31",
+        "system": "Rewrite the user's last question as one standalone search query. Reply with the query only.",
+        "messages": [{"role": "user", "content": f"Conversation:\n{history_text}\n\nLast question:\n{prompt}"}],
+        "max_tokens": CONDENSE_MAX_TOKENS,
+        "temperature": 0,
+    })
+    response = _scheduled_call(
+        lambda: awsclients.get_client("bedrock-runtime").invoke_model(modelId=CONDENSE_MODEL_ID, body=body),
+        estimate_tokens(body) + CONDENSE_MAX_TOKENS,
+        trace,
+        "condense",
+    )
+    content = json.loads(response["body"].read()).get("content", [])
+    return "".join(block.get("text", "") for block in content).strip()
+
+def _condense_query(prompt, window, trace):
+    """Standalone retrieval query for `prompt` (model rewrite when configured, heuristic otherwise)."""
+    if CONDENSE_MODEL_ID and len(window) and is_follow_up(prompt):
+        trace.begin("condense")
+        try:
+            query = _condense_with_model(prompt, window.kb_history_text(), trace)
+            if query:
+                return query
+        except Exception as e:
+            logger.warning("⚠️ Query condensing failed, using heuristic: %s", e)
+        finally:
+            trace.end("condense")
+    return condense_query(prompt, window.recent(2))
+
+def _retrieve_kb(query, trace, span="retrieve"):
+    """Retrieve stage: vector search only (no generation), cached per normalized query."""
+    if RETRIEVAL_CACHE_ENABLED:
+        passages = retrieval_cache.get(query)
+        if passages is not None:
+            trace.add("retrieval_cache_hits")
+            return passages
+
+    trace.begin(span)
+    response = _scheduled_call(
+        lambda: awsclients.get_client("bedrock-agent-runtime").retrieve(
+            knowledgeBaseId=knowledge_base_id,
+            retrievalQuery={"text": query},
+            retrievalConfiguration={"vectorSearchConfiguration": {"numberOfResults": RETRIEVAL_TOP_K}},
+        ),
+        estimate_tokens(query),
+        trace,
+        span,
+    )
+    passages = passages_from_results(response.get("retrievalResults", []))
+    trace.end(span, passages=len(passages))
+    if RETRIEVAL_CACHE_ENABLED:
+        retrieval_cache.put(query, passages)
+    return passages
+
+def retrieve_kb_passages(prompt, message_history, trace=metrics.NULL_TRACE):
+    """
+    Searches the Knowledge Base for the bare question straight away while the history is
+    condensed into a standalone query. Follow-ups also search the condensed query and the
+    two result lists are merged. Raises on API errors.
+    """
+    window = _as_window(message_history)
+    speculative = start_thread("genai-retrieve", _retrieve_kb, prompt, trace)
+    query = _condense_query(prompt, window, trace)
+    if normalize_prompt(query) == normalize_prompt(prompt):
+        return speculative.result()
+
+    passages = _retrieve_kb(query, trace, "retrieve_condensed")
     try:
-        response = kb_client.retrieve_and_generate_stream(
+        return merge_passages(passages, speculative.result())
+    except Exception as e:
+        logger.warning("⚠️ Retrieval for the bare question failed: %s", e)
+        return passages
+
+def retrieve_stage(prompt, message_history, trace):
+    """Runs the retrieve stage and records the route; an empty list means Claude answers unaided."""
+    try:
+        passages = retrieve_kb_passages(prompt, message_history, trace)
+    except Exception as e:
+        logger.warning("⚠️ AWS Knowledge Base retrieval failed: %s", e)
+        trace.set("fallback_reason", "kb_error")
+        passages = []
+    trace.mark("retrieve_total")
+
+    if passages:
+        logger.info("⚡ %d KB passages retrieved, generating with Claude...", len(passages))
+        trace.set("route", "kb")
+    else:
+        logger.info("⚠️ No relevant KB passages, switching to Claude AI Model...")
+        trace.set("route", "model")
+        trace.set("fallback", True)
+        if "fallback_reason" not in trace.values:
+            trace.set("fallback_reason", "kb_empty")
+    return passages
+
+# 🚀 Two-stage Query: cached KB retrieval, then a streaming Claude generation
+def split_query_stream(prompt, message_history, session_id=None, trace=metrics.NULL_TRACE, cancel_event=None):
+    """Retrieves KB passages (cached per standalone query) and streams Claude's answer grounded on them."""
+    history = _as_window(message_history)
+    passages = retrieve_stage(prompt, history, trace)
+    if is_cancelled(cancel_event):
+        return  # ✅ Abandoned during retrieval, don't start the generation
+    yield from run_query_with_ai_model(prompt, history, session_id, passages=passages, trace=trace,
+                                       cancel_event=cancel_event)
+
+# 🚀 Raw Knowledge Base stream (no fallback)
+def stream_knowledge_base(prompt, message_history, cancel_event=None, trace=metrics.NULL_TRACE):
+    """
+    Yields text chunks from the AWS Knowledge Base only. Raises on API errors.
+    The first KB_CLASSIFY_CHARS are held back and classified; refusals close the
+    stream without yielding anything so the caller can fall back to Claude.
+    """
+    # ✅ Include previous questions & answers (token-budgeted window, no full rescan)
+    history_text = _as_window(message_history).kb_history_text()
+
+    full_query = f"Previous conversation:\n{history_text}\nNew question:\n{prompt}"
+
+    if is_cancelled(cancel_event):
+        return
+    trace.begin("kb")
+    response = _scheduled_call(
+        lambda: awsclients.get_client("bedrock-agent-runtime").retrieve_and_generate_stream(
             knowledgeBaseId=knowledge_base_id,
-            retrievalQuery=full_query  # ✅ Use full chat history
-        )
+            retrievalQuery=full_query  # ✅ Use windowed chat history
+        ),
+        estimate_tokens(full_query) + max_tokens_to_sample,
+        trace,
+        "kb",
+    )
+
+    logger.info("🟢 Streaming response from AWS Knowledge Base...")
+    stream = response["body"]
+    abort_id = close_on_cancel(cancel_event, stream)  # ✅ Cancelling closes the socket, even mid-read
+    prefix = []  # ✅ Held back until the classifier has decided
+    held_citations = []  # ✅ Citations seen before the verdict, released with the prefix
+    verdict = None
+    try:
+        for payload in iter_payloads(stream):  # ✅ Split / packed JSON frames are reassembled, not dropped
+            if is_cancelled(cancel_event):
+                logger.info("🛑 Knowledge Base stream cancelled.")
+                verdict = verdict or "cancelled"
+                return
+            if "citation" in payload:
+                # ✅ Parsed in the same pass as the text, no extra Retrieve call
+                citation = parse_citation(payload["citation"])
+                if citation is not None:
+                    if verdict == "helpful":
+                        yield CitationChunk([citation])
+                    else:
+                        held_citations.append(citation)
+
+            text_chunk = payload.get("outputText")
+            if text_chunk is None and "output" in payload:
+                text_chunk = payload["output"].get("text")  # ✅ Native RetrieveAndGenerateStream output event
+            if text_chunk is None:
+                continue
+            trace.mark("kb_ttft")
+            if verdict == "helpful":
+                yield text_chunk  # ✅ Stream from KB
+                continue
+
+            prefix.append(text_chunk)
+            verdict = classify_kb_prefix("".join(prefix))
+            if verdict == "unhelpful":
+                logger.info("🛑 Unhelpful KB answer detected early, closing KB stream.")
+                trace.set("fallback_reason", "kb_refusal")
+                return
+            if verdict == "helpful":
+                yield "".join(prefix)
+                if held_citations:
+                    yield CitationChunk(held_citations)
+
+        # ✅ Short answers never reach KB_CLASSIFY_CHARS, classify what we have
+        if verdict is None:
+            verdict = classify_kb_prefix("".join(prefix), final=True)
+            if verdict == "helpful":
+                yield "".join(prefix)
+                if held_citations:
+                    yield CitationChunk(held_citations)
+            else:
+                trace.set("fallback_reason", "kb_refusal" if prefix else "kb_empty")
+    except Exception:
+        if not is_cancelled(cancel_event):
+            raise
+        logger.info("🛑 Knowledge Base stream aborted (%s).", cancel_event.reason)
+        verdict = "cancelled"  # ✅ The read failed because we closed the stream, not an API error
+    finally:
+        if abort_id is not None:
+            cancel_event.remove_callback(abort_id)
+        stream.close()  # ✅ Release the pooled connection straight away
+        if verdict != "cancelled":
+            trace.mark("kb_total")
+        trace.end("kb", verdict=verdict)
+
+def model_request(prompt, message_history, passages=None):
+    """Claude Messages API request body for `prompt` (also used for Bedrock batch inference records)."""
+    # ✅ Claude's message format, maintained incrementally by the window
+    window = _as_window(message_history)
+    messages = window.claude_messages()
 
-        print("\n🟢 **Streaming response from AWS Knowledge Base...**\n")
-        streamed_response = ""
+    if PROMPT_CACHING_ENABLED:
+        # ✅ System + history stay a byte-identical prefix; summary and passages change per question,
+        # so they ride on the new turn after the history breakpoint
+        system = _build_cached_system()
+        messages.append({"role": "user", "content": _user_turn_with_context(prompt, passages, window.summary)})
+        messages = _mark_history_breakpoint(messages)
+    else:
+        system = _build_system_prompt(passages, window.summary)
+        messages.append({"role": "user", "content": prompt})  # ✅ Include current user input
 
-        for event in response["body"]:
-            if "chunk" in event and "bytes" in event["chunk"]:
-                chunk_data = event["chunk"]["bytes"].decode("utf-8")
+    return {
+        "anthropic_version": "bedrock-2023-05-31",
+        "system": system,
+        "messages": messages,  # ✅ Pass windowed conversation history
+        "max_tokens": max_tokens_to_sample,
+        "temperature": temperature,
+        "top_p": top_p
+    }
 
-                try:
-                    chunk_json = json.loads(chunk_data)
-                    if "outputText" in chunk_json:
-                        text_chunk = chunk_json["outputText"]
-                        streamed_response += text_chunk
-                        yield text_chunk  # ✅ Stream from KB
+# 🚀 Raw Claude stream (fails over between endpoints until the first token, then raises on API errors)
+def stream_ai_model(prompt, message_history, cancel_event=None, passages=None, trace=metrics.NULL_TRACE, model=None):
+    """Yields text chunks from the Bedrock AI Model (`model`, default model_id) only. Raises on API errors."""
+    model = model or model_id
+    body = json.dumps(model_request(prompt, message_history, passages))
+
+    if is_cancelled(cancel_event):
+        return
+    pool = _endpoint_pool(model)
+    candidates = pool.candidates()
+    outcome = {"stop_reason": None}
+    endpoint = None
+    trace.begin("model")
+    try:
+        for attempt, endpoint in enumerate(candidates):
+            last_attempt = attempt == len(candidates) - 1
+            emitted = False
+            stream = None
+            abort_id = None
+            sent = {}
+
+            def invoke():
+                sent["at"] = time.monotonic()  # ✅ Endpoint TTFT excludes local queue wait and throttle backoff
+                return endpoint.client().invoke_model_with_response_stream(modelId=endpoint.model_id, body=body)
+
+            try:
+                response = _scheduled_call(
+                    invoke,
+                    estimate_tokens(body) + max_tokens_to_sample,
+                    trace,
+                    "model",
+                    max_retries=None if last_attempt else 0,  # ✅ Fail over instead of backing off on a throttled endpoint
+                )
+                logger.info("🟢 Streaming response from Claude (%s)...", endpoint.region)
+                stream = response["body"]
+                abort_id = close_on_cancel(cancel_event, stream)  # ✅ Cancelling closes the socket, even mid-read
+                for text_chunk in _read_model_stream(stream, cancel_event, trace, outcome):
+                    if not emitted:
+                        emitted = True
+                        pool.record_success(endpoint, time.monotonic() - sent["at"])
+                    yield text_chunk
+                if not emitted and outcome["stop_reason"] != "cancelled":
+                    pool.record_success(endpoint, time.monotonic() - sent["at"])
+                return
+            except QueueTimeout:
+                raise  # ✅ Our own quota queue timed out: not the endpoint's fault, and every endpoint shares the quota
+            except Exception as e:
+                if is_cancelled(cancel_event):
+                    # ✅ The read failed because we closed the stream: no failover, no endpoint penalty
+                    logger.info("🛑 Claude stream aborted (%s).", cancel_event.reason)
+                    outcome["stop_reason"] = "cancelled"
+                    return
+                pool.record_failure(endpoint, e)
+                if emitted or last_attempt:
+                    raise
+                logger.warning("⚠️ Endpoint %s failed before the first token, failing over: %s", endpoint.name, e)
+                trace.add("model_failovers")
+            finally:
+                if abort_id is not None:
+                    cancel_event.remove_callback(abort_id)
+                if stream is not None:
+                    stream.close()  # ✅ Release the pooled connection straight away
+    finally:
+        if outcome["stop_reason"] != "cancelled":
+            trace.mark("model_total")
+        if endpoint is not None:
+            trace.set("model_region", endpoint.region)
+        trace.end("model", model_id=endpoint.model_id if endpoint else model, stop_reason=outcome["stop_reason"])
+
+def _read_model_stream(stream, cancel_event, trace, outcome):
+    """Parses Claude's event stream into text chunks; the stop reason is written to `outcome`."""
+    for payload in iter_payloads(stream):  # ✅ Split / packed JSON frames are reassembled, not dropped
+        if is_cancelled(cancel_event):
+            logger.info("🛑 Claude stream cancelled.")
+            outcome["stop_reason"] = "cancelled"
+            return
+        event_type = payload.get("type")
+        if event_type == "content_block_delta":
+            trace.mark("model_ttft")
+            yield payload["delta"].get("text", "")  # ✅ Stream dynamically
+        elif event_type == "message_start":
+            usage = payload.get("message", {}).get("usage", {})
+            cache_read = usage.get("cache_read_input_tokens", 0)
+            cache_write = usage.get("cache_creation_input_tokens", 0)
+            if cache_read or cache_write:
+                logger.debug("⚡ Prompt cache: %d tokens read, %d written", cache_read, cache_write)
+                trace.set("cache_read_input_tokens", cache_read)
+                trace.set("cache_write_input_tokens", cache_write)
+        elif event_type == "message_delta":
+            outcome["stop_reason"] = payload.get("delta", {}).get("stop_reason")
+        elif event_type == "message_stop" and trace.enabled:
+            invocation_metrics = payload.get("amazon-bedrock-invocationMetrics", {})
+            trace.set("input_tokens", invocation_metrics.get("inputTokenCount", 0))
+            trace.set("output_tokens", invocation_metrics.get("outputTokenCount", 0))
+            if invocation_metrics.get("cacheReadInputTokenCount") or invocation_metrics.get("cacheWriteInputTokenCount"):
+                trace.set("cache_read_input_tokens", invocation_metrics.get("cacheReadInputTokenCount", 0))
+                trace.set("cache_write_input_tokens", invocation_metrics.get("cacheWriteInputTokenCount", 0))
+
+# 🚀 Streaming Query to AWS Knowledge Base (Primary Source)
+def query_knowledge_base_stream(prompt, message_history, session_id=None, trace=metrics.NULL_TRACE, cancel_event=None):
+    """Queries AWS Knowledge Base using streaming response before calling Claude."""
+    logger.info("🔍 Checking AWS Knowledge Base First...")
+    session_id = session_id or "default-session"
 
-                except json.JSONDecodeError as json_err:
-                    print(f"⚠️ JSON Decode Error from KB: {json_err}")
+    has_answer = False  # ✅ No need to keep a second copy of the text here
+    try:
+        for text_chunk in stream_knowledge_base(prompt, message_history, cancel_event, trace=trace):
+            has_answer = has_answer or bool(text_chunk.strip())
+            yield text_chunk  # ✅ Stream from KB
 
-        if streamed_response.strip():
+        if has_answer:
+            trace.set("route", "kb")
             return  # ✅ Stop here if KB returns a valid response
 
     except Exception as e:
-        print(f"⚠️ AWS Knowledge Base query failed: {str(e)}")
+        logger.warning("⚠️ AWS Knowledge Base query failed: %s", e)
+        trace.set("fallback_reason", "kb_error")
+        if has_answer:
+            trace.set("route", "kb")
+            return  # ✅ Partial KB answer already shown, don't append a second one
+
+    if is_cancelled(cancel_event):
+        return  # ✅ Nobody is waiting for a fallback answer
 
     # 🚀 If KB has no useful response, call Claude **with chat history**
-    print("\n⚠️ No useful response from KB, switching to Claude AI Model...\n")
-    yield from run_query_with_ai_model(prompt, message_history, session_id)
+    logger.info("⚠️ No useful response from KB, switching to Claude AI Model...")
+    trace.set("route", "model")
+    trace.set("fallback", True)
+    yield from run_query_with_ai_model(prompt, message_history, session_id, trace=trace, cancel_event=cancel_event)
 
 # 🚀 Streaming AI Model Query (Fallback to Claude)
-def run_query_with_ai_model(prompt, message_history, session_id=None):
+def run_query_with_ai_model(prompt, message_history, session_id=None, passages=None, trace=metrics.NULL_TRACE, model=None,
+                            cancel_event=None):
     """Queries Amazon Bedrock AI Model using a streaming response with memory."""
-    print("\n🔍 **Calling Bedrock AI Model - Streaming Response...**\n")
+    logger.info("🔍 Calling Bedrock AI Model - Streaming Response...")
     session_id = session_id or "default-session"
 
-    # ✅ Convert chat history to Claude's message format
-    messages = [
-        {"role": msg.role, "content": msg.text}
-        for msg in message_history[-MAX_MESSAGES * 2:] if msg.text.strip()
-    ]
-    messages.append({"role": "user", "content": prompt})  # ✅ Include current user input
+    answer = []
+    try:
+        for text_chunk in stream_ai_model(prompt, message_history, cancel_event, passages=passages, trace=trace, model=model):
+            answer.append(text_chunk)
+            yield text_chunk
+
+        citation = citation_from_passages(passages, "".join(answer)) if passages else None
+        if citation is not None:
+            yield CitationChunk([citation])  # ✅ Links only to the passages the answer used
+
+    except Exception as e:
+        if is_cancelled(cancel_event):
+            return
+        logger.error("❌ Error calling Bedrock AI Model: %s", e)
+        trace.set("error", type(e).__name__)
+        yield ERROR_MESSAGE
 
+def _pump_stream(source, stream_factory, out_queue, cancel_event):
+    """Runs one upstream stream on a worker thread, forwarding chunks as (source, chunk)."""
     try:
-        response = bedrock_client.invoke_model_with_response_stream(
-            modelId=model_id,
-            body=json.dumps({
-                "anthropic_version": "bedrock-2023-05-31",
-                "system": "You are a livestock advisory for the Herdwatch livestock management app.\nHere are some relevant sources to check first:\n'https://help.herdwatch.com/en/'\n'https://herdwatch.com/'\n",
-                "messages": messages,  # ✅ Pass full conversation history
-                "max_tokens": max_tokens_to_sample,
-                "temperature": temperature,
-                "top_p": top_p
-            })
-        )
-
-        print("\n🟢 **Streaming response from Claude...**\n")
-        streamed_response = ""
-
-        for event in response["body"]:
-            if "chunk" in event and "bytes" in event["chunk"]:
-                chunk_data = event["chunk"]["bytes"].decode("utf-8")
-
-                try:
-                    chunk_json = json.loads(chunk_data)
-                    if "content_block_delta" in chunk_json.get("type", ""):
-                        text_chunk = chunk_json["delta"].get("text", "")
-                        streamed_response += text_chunk
-                        yield text_chunk  # ✅ Stream dynamically
-
-                except json.JSONDecodeError as json_err:
-                    print(f"⚠️ JSON Decode Error from Claude: {json_err}")
+        for text_chunk in stream_factory(cancel_event):
+            out_queue.put((source, text_chunk))
+    except Exception as e:
+        logger.warning("⚠️ %s stream failed: %s", source, e)
+    finally:
+        out_queue.put((source, None))  # ✅ End-of-stream marker
+
+class HedgeRace:
+    """
+    Commit / cancel rules of the hedged KB + Claude race, shared by the thread driver
+    (hedged_query_stream) and the asyncio one (asyncchat). Drivers start sources, wait up to
+    wait_timeout() for the next (source, chunk) and pass it to on_chunk(); the race decides.
+    """
+    SOURCES = ("kb", "model")
+
+    def __init__(self, hedge_delay, trace=metrics.NULL_TRACE, cancel_event=None):
+        self.trace = trace
+        self.cancel_event = cancel_event
+        self.cancel_events = {source: CancelToken(parent=cancel_event) for source in self.SOURCES}
+        self.hedge_at = time.monotonic() + hedge_delay
+        self.pending = {source: [] for source in self.SOURCES}  # ✅ Whitespace seen before commit
+        self.started, self.finished = set(), set()
+        self.winner = None
+        self.done = False
+
+    def start(self, source):
+        """Marks `source` as started; returns the CancelToken its stream must use."""
+        self.started.add(source)
+        return self.cancel_events[source]
+
+    def wait_timeout(self):
+        """Seconds until Claude should start speculatively (<= 0: start it now), None once that is moot."""
+        if "model" in self.started or self.winner is not None:
+            return None
+        return self.hedge_at - time.monotonic()
+
+    def on_chunk(self, source, text_chunk):
+        """
+        Handles one chunk (None = `source` ended). Returns (text to yield or None, source to
+        start or None); `done` is set once the answer is complete or nobody is waiting.
+        """
+        if text_chunk is None:
+            self.finished.add(source)
+            if source == self.winner or is_cancelled(self.cancel_event):
+                self.done = True
+            elif self.winner is None and "model" not in self.started:
+                logger.info("⚠️ No useful response from KB, switching to Claude AI Model...")
+                return None, "model"
+            elif self.winner is None and self.finished == self.started:
+                self.trace.set("error", "all_streams_failed")
+                self.done = True
+                return ERROR_MESSAGE, None
+            return None, None
+
+        if self.winner is None:
+            if not text_chunk.strip():
+                self.pending[source].append(text_chunk)
+                return None, None
+            self._commit(source)
+            text_chunk = "".join(self.pending[source]) + text_chunk
+        return (text_chunk if source == self.winner else None), None
+
+    def _commit(self, winner):
+        self.winner = winner
+        for other, source_cancel in self.cancel_events.items():
+            if other != winner:
+                source_cancel.cancel("hedge_lost")  # ✅ Cancel the loser
+        logger.info("🏁 Committed to %s stream.", winner)
+        self.trace.set("route", winner)
+        if winner == "model":
+            self.trace.set("fallback", True)
+            if "fallback_reason" not in self.trace.values:
+                self.trace.set("fallback_reason", "hedge_model_first")
 
+    def close(self):
+        for source_cancel in self.cancel_events.values():
+            source_cancel.cancel(CANCEL_DONE)  # ✅ Consumer went away or we are done, stop everything
+
+def hedge_stream_factories(prompt, history, trace):
+    """`factory(cancel_event)` per hedged source, reading the (already snapshotted) `history`."""
+    return {
+        "kb": lambda cancel_event: stream_knowledge_base(prompt, history, cancel_event, trace=trace),
+        "model": lambda cancel_event: stream_ai_model(prompt, history, cancel_event, trace=trace),
+    }
+
+# 🚀 Hedged Query: race KB against a speculative Claude stream
+def hedged_query_stream(prompt, message_history, session_id=None, hedge_delay=None, trace=metrics.NULL_TRACE,
+                        cancel_event=None):
+    """
+    Starts the Knowledge Base stream and, after `hedge_delay` seconds (or as soon as the
+    KB finishes without an answer), a speculative Claude stream. Commits to whichever
+    source yields useful text first and cancels the other one. Cancelling `cancel_event`
+    cancels both.
+    """
+    hedge_delay = HEDGE_DELAY_SECONDS if hedge_delay is None else hedge_delay
+    logger.info("🔍 Hedged query: KB now, Claude after %.2fs...", hedge_delay)
+
+    history = _as_window(message_history).snapshot()  # ✅ The workers must not see later edits
+    stream_factories = hedge_stream_factories(prompt, history, trace)
+    race = HedgeRace(hedge_delay, trace, cancel_event)
+    chunks = queue.Queue()
+
+    def start(source):
+        start_thread(f"genai-{source}", _pump_stream, source, stream_factories[source], chunks, race.start(source))
+
+    start("kb")
+    try:
+        while not race.done:
+            timeout = race.wait_timeout()
+            if timeout is not None and timeout <= 0:
+                logger.info("⚡ Hedge delay elapsed, starting Claude speculatively...")
+                start("model")
+                continue
+
+            try:
+                source, text_chunk = chunks.get(timeout=timeout)
+            except queue.Empty:
+                continue
+
+            text_chunk, next_source = race.on_chunk(source, text_chunk)
+            if next_source is not None:
+                start(next_source)
+            if text_chunk is not None:
+                yield text_chunk
+    finally:
+        race.close()
+
+def _agent_session_id(session_id):
+    """The Bedrock Agent sessionId for a chat session (stable, so the agent keeps the conversation)."""
+    if not session_id:
+        logger.warning("⚠️ No session id for the Bedrock Agent, this turn starts a new agent session.")
+        return uuid.uuid4().hex
+    if _agent_session_re.match(session_id):
+        return session_id
+    return hashlib.sha256(session_id.encode("utf-8")).hexdigest()[:64]
+
+# 🚀 Raw Bedrock Agent stream (no history sent: the agent keeps the conversation under the session id)
+def stream_agent(prompt, session_id, cancel_event=None, trace=metrics.NULL_TRACE):
+    """Yields text chunks (and CitationChunk markers) from the Bedrock Agent as they arrive. Raises on API errors."""
+    if is_cancelled(cancel_event):
+        return
+    trace.begin("agent")
+    response = _scheduled_call(
+        lambda: awsclients.get_client("bedrock-agent-runtime").invoke_agent(
+            agentId=AGENT_ID,
+            agentAliasId=AGENT_ALIAS_ID,
+            sessionId=_agent_session_id(session_id),  # ✅ Reused every turn, so no history is resent
+            inputText=prompt,
+            enableTrace=False,
+            streamingConfigurations={"streamFinalResponse": True},  # ✅ Tokens as they are generated, not one final chunk
+        ),
+        estimate_tokens(prompt) + max_tokens_to_sample,
+        trace,
+        "agent",
+    )
+
+    logger.info("🟢 Streaming response from Bedrock Agent...")
+    stream = response["completion"]
+    abort_id = close_on_cancel(cancel_event, stream)
+    decoder = codecs.getincrementaldecoder("utf-8")()  # ✅ A character may be split across chunks
+    outcome = None
+    try:
+        for event in stream:
+            if is_cancelled(cancel_event):
+                logger.info("🛑 Bedrock Agent stream cancelled.")
+                outcome = "cancelled"
+                return
+            chunk = event.get("chunk")
+            if chunk is None:
+                continue
+            text_chunk = decoder.decode(chunk.get("bytes", b""))
+            if text_chunk:
+                trace.mark("agent_ttft")
+                yield text_chunk
+            agent_citations = [
+                citation for citation in map(parse_citation, chunk.get("attribution", {}).get("citations", []))
+                if citation is not None
+            ]
+            if agent_citations:
+                yield CitationChunk(agent_citations)
+        outcome = "complete"
+    except Exception:
+        if not is_cancelled(cancel_event):
+            raise
+        logger.info("🛑 Bedrock Agent stream aborted (%s).", cancel_event.reason)
+        outcome = "cancelled"
+    finally:
+        if abort_id is not None:
+            cancel_event.remove_callback(abort_id)
+        stream.close()
+        if outcome != "cancelled":
+            trace.mark("agent_total")
+        trace.end("agent", outcome=outcome)
+
+# 🚀 Streaming Bedrock Agent Query
+def run_query_with_agent(prompt, session_id=None, trace=metrics.NULL_TRACE, cancel_event=None):
+    """Queries the Bedrock Agent with a streaming response; the conversation memory is the agent's."""
+    logger.info("🔍 Calling Bedrock Agent - Streaming Response...")
+    try:
+        yield from stream_agent(prompt, session_id, cancel_event, trace=trace)
     except Exception as e:
-        print(f"❌ Error calling Bedrock AI Model: {str(e)}")
-        yield "An error occurred while processing your request."
+        if is_cancelled(cancel_event):
+            return
+        logger.error("❌ Error calling Bedrock Agent: %s", e)
+        trace.set("error", type(e).__name__)
+        yield ERROR_MESSAGE
+
+# ✅ The upstream streams an engine composes its routes from. Engines only pick among them, so
+# the thread pipeline here and the asyncio one (asyncchat.ASYNC_ROUTE_STREAMS) route identically.
+RouteStreams = namedtuple("RouteStreams", "model split hedged kb agent")
+ROUTE_STREAMS = RouteStreams(
+    model=run_query_with_ai_model,
+    split=split_query_stream,
+    hedged=hedged_query_stream,
+    kb=query_knowledge_base_stream,
+    agent=run_query_with_agent,
+)
+
+# ✅ Turn bookkeeping behind ChatTurn
+def _lookup_cached_response(new_text, window, trace):
+    """
+    Response cache lookup against the conversation *before* this question. Returns
+    (answer or None, cache_context), where cache_context is the (messages, summary) it was keyed on.
+    """
+    if not RESPONSE_CACHE_ENABLED or chat_engine.keeps_history:
+        return None, None
+    cache_context = (window.messages(), window.summary)  # ✅ Everything the payload is built from
+    cached_response = response_cache.get(new_text, *cache_context)
+    trace.set("cache_hit", cached_response is not None)
+    return cached_response, cache_context
+
+# ✅ route: "cache" / "faq" (replay `answer` and `citations`), "local" (`passages`), "direct" (`model`), "upstream" (KB + Claude)
+# or "agent" (Bedrock Agent)
+RoutePlan = namedtuple("RoutePlan", "route passages answer model citations", defaults=((), None, None, None))
+
+class ChatEngine:
+    """
+    Backend behind chat_with_model. plan() picks the route for a question, stream() returns
+    its chunks (text and CitationChunk markers). Every engine records the same trace keys
+    (engine, route, ttft, total), so engines can be compared per deployment.
+    """
+    name = None
+    keeps_history = False  # ✅ The service remembers the conversation: no history sent, no cached answers
+    coalesce = True  # ✅ Identical in-flight questions may share one upstream stream
+
+    def plan(self, new_text, window, cached_response, trace):
+        raise NotImplementedError
+
+    def stream(self, plan, prompt, history, session_id, trace, cancel_event=None, streams=ROUTE_STREAMS):
+        """The route's upstream stream, built from `streams` (ROUTE_STREAMS, or the asyncio set)."""
+        raise NotImplementedError
+
+    @staticmethod
+    def _plan_shortcuts(new_text, window, cached_response, trace):
+        """Response cache, then the router. Returns (a replay plan or None, the router decision or None)."""
+        if cached_response is not None:
+            logger.info("⚡ Response cache hit, replaying answer...")
+            trace.set("route", "cache")
+            return RoutePlan("cache", answer=cached_response.answer, citations=cached_response.citations), None
+        if not ROUTER_ENABLED:
+            return None, None
+        decision = query_router.route(new_text, window.recent(2))
+        trace.set("route_reason", decision.reason)
+        trace.set("router_seconds", decision.seconds)
+        if decision.route == ROUTE_FAQ:
+            trace.set("route", "faq")
+            return RoutePlan("faq", answer=decision.answer), decision
+        return None, decision
+
+class KnowledgeBaseEngine(ChatEngine):
+    """KB + Claude: the router, the local index, then split retrieval, the hedged race or KB with Claude fallback."""
+    name = "kb"
+
+    def plan(self, new_text, window, cached_response, trace):
+        plan, decision = self._plan_shortcuts(new_text, window, cached_response, trace)
+        if plan is not None:
+            return plan
+        if decision is not None and decision.route == ROUTE_DIRECT:
+            trace.set("route", "direct")
+            trace.set("model_id", decision.model_id or model_id)
+            return RoutePlan("direct", model=decision.model_id)
+        local_passages = retrieve_local_passages(new_text)
+        if local_passages:
+            logger.info("⚡ Local index hit (%s), skipping KB...", local_passages[0]["source"])
+            trace.set("route", "local")
+            return RoutePlan("local", passages=local_passages)
+        return RoutePlan("upstream")
+
+    def stream(self, plan, prompt, history, session_id, trace, cancel_event=None, streams=ROUTE_STREAMS):
+        if plan.route == "local":
+            return streams.model(prompt, history, session_id, passages=plan.passages, trace=trace, cancel_event=cancel_event)
+        if plan.route == "direct":
+            return streams.model(prompt, history, session_id, trace=trace, model=plan.model, cancel_event=cancel_event)
+        if SPLIT_RETRIEVAL_ENABLED:
+            return streams.split(prompt, history, session_id, trace=trace, cancel_event=cancel_event)
+        if HEDGE_ENABLED:
+            return streams.hedged(prompt, history, session_id, trace=trace, cancel_event=cancel_event)
+        return streams.kb(prompt, history, session_id, trace=trace, cancel_event=cancel_event)
+
+class ModelEngine(ChatEngine):
+    """Claude only, streamed with the windowed history (FAQ and cached answers still apply)."""
+    name = "model"
+
+    def plan(self, new_text, window, cached_response, trace):
+        plan, decision = self._plan_shortcuts(new_text, window, cached_response, trace)
+        if plan is not None:
+            return plan
+        model = decision.model_id if decision is not None and decision.route == ROUTE_DIRECT else None
+        trace.set("route", "direct")
+        trace.set("model_id", model or model_id)
+        return RoutePlan("direct", model=model)
+
+    def stream(self, plan, prompt, history, session_id, trace, cancel_event=None, streams=ROUTE_STREAMS):
+        return streams.model(prompt, history, session_id, trace=trace, model=plan.model, cancel_event=cancel_event)
+
+class AgentEngine(ChatEngine):
+    """Bedrock Agent, streamed, with the conversation kept by the agent under the chat's session id."""
+    name = "agent"
+    keeps_history = True
+    coalesce = False  # ✅ Each session's agent memory differs, so identical questions can't share a stream
+
+    def plan(self, new_text, window, cached_response, trace):
+        trace.set("route", "agent")
+        return RoutePlan("agent")
+
+    def stream(self, plan, prompt, history, session_id, trace, cancel_event=None, streams=ROUTE_STREAMS):
+        return streams.agent(prompt, session_id, trace=trace, cancel_event=cancel_event)
+
+CHAT_ENGINES = {engine.name: engine for engine in (KnowledgeBaseEngine(), ModelEngine(), AgentEngine())}
+chat_engine = CHAT_ENGINES.get(CHAT_ENGINE)
+if chat_engine is None:
+    logger.warning("⚠️ Unknown CHAT_ENGINE %r, using the KB engine.", CHAT_ENGINE)
+    chat_engine = CHAT_ENGINES["kb"]
+
+def _plan_route(new_text, window, cached_response, trace):
+    """Asks the chat engine for the route (cache / FAQ shortcuts first, where the engine allows them)."""
+    trace.set("engine", chat_engine.name)
+    return chat_engine.plan(new_text, window, cached_response, trace)
+
+def _route_stream_factory(plan, new_text, window, session_id, trace, streams=ROUTE_STREAMS):
+    """`factory(cancel_event)` for a route's upstream stream built from `streams` (the history is snapshotted now)."""
+    history = window.snapshot()
+    engine = chat_engine
+    return lambda cancel_event: engine.stream(plan, new_text, history, session_id, trace, cancel_event, streams)
+
+def _flight_key(route, new_text, window):
+    """
+    Single-flight key: same route, same normalized question and the same conversation context
+    (whole window + summary), so a follower never receives an answer built from someone else's history.
+    """
+    return f"{route}:{cache_key(new_text, window.messages(), window.summary)}"
+
+def _on_flight_join(trace):
+    def on_join(is_leader):
+        if not is_leader:
+            trace.set("coalesced", True)
+            trace.set("route", "coalesced")  # ✅ Upstream metrics belong to the leader's trace
+    return on_join
+
+def _store_turn(window, user_message, assistant_message, cache_context, replayed_answer, complete=True):
+    """
+    Adds the finished turn to the window and caches complete, successful answers that were
+    not replayed (`complete` is False for answers cut short by a cancellation or deadline).
+    """
+    window.append(user_message)
+    window.append(assistant_message)
+    answer = assistant_message.text
+    if RESPONSE_CACHE_ENABLED and cache_context is not None and complete and replayed_answer is None \
+            and answer.strip() and answer != ERROR_MESSAGE:
+        messages, summary = cache_context
+        response_cache.put(user_message.text, messages, answer, summary, assistant_message.citations)
+    logger.debug("🔍 Final Assistant Message: %d chars", len(answer))
+
+async def _areplay_stream(text, citations=None):
+    for chunk in replay_stream(text, citations):
+        yield chunk
+
+class ChatTurn:
+    """
+    One chat turn, shared by chat_with_model and the asyncio engine (asyncchat.py): the
+    response cache lookup, the route plan, the upstream stream (replayed, coalesced through
+    `inflight` or streamed directly) and storing the finished turn in the window and cache.
+    """
+
+    def __init__(self, new_text, window, session_id, trace):
+        self.new_text = new_text
+        self.window = window
+        self.session_id = session_id
+        self.trace = trace
+        self.user_message = ChatMessage("user", new_text)
+        # ✅ Cache lookup uses the conversation *before* this question
+        self.cached_response, self.cache_context = _lookup_cached_response(new_text, window, trace)
+        self.plan = None
+
+    def plan_route(self):
+        """Cache, then the router (FAQ / KB / direct), then local passages or KB + Claude. CPU work (router, local index)."""
+        self.plan = _plan_route(self.new_text, self.window, self.cached_response, self.trace)
+        return self.plan
+
+    def _coalesced(self):
+        return SINGLE_FLIGHT_ENABLED and chat_engine.coalesce
+
+    def stream(self, cancel_event):
+        """The turn's chunks (text and CitationChunk markers) from the blocking ROUTE_STREAMS."""
+        if self.plan.answer is not None:
+            return replay_stream(self.plan.answer, self.plan.citations)
+        stream_factory = _route_stream_factory(self.plan, self.new_text, self.window, self.session_id, self.trace)
+        if self._coalesced():
+            return inflight.stream(_flight_key(self.plan.route, self.new_text, self.window), stream_factory,
+                                   _on_flight_join(self.trace), cancel=cancel_event)
+        return stream_factory(cancel_event)
+
+    def astream(self, cancel_event, streams):
+        """Async counterpart of stream(), built from the asyncio `streams` (coalesced flights run as tasks)."""
+        if self.plan.answer is not None:
+            return _areplay_stream(self.plan.answer, self.plan.citations)
+        stream_factory = _route_stream_factory(self.plan, self.new_text, self.window, self.session_id, self.trace, streams)
+        if self._coalesced():
+            return inflight.astream(_flight_key(self.plan.route, self.new_text, self.window), stream_factory,
+                                    _on_flight_join(self.trace), cancel=cancel_event)
+        return stream_factory(cancel_event)
+
+    def finish(self, assistant_message, complete=True):
+        """Stores the finished turn (answers cut short by a cancellation or deadline are not cached)."""
+        _store_turn(self.window, self.user_message, assistant_message, self.cache_context, self.plan.answer, complete)
 
 # 🚀 Optimized Chat Function with Knowledge Base + Claude AI
-def chat_with_model(message_history, new_text, session_id=None):
-    """Handles AI chat session with memory, streaming, and AWS Knowledge Base check."""
+def chat_with_model(message_history, new_text, session_id=None, window=None, buffer=None, citations=None,
+                    cancel_event=None, deadline_seconds=None):
+    """
+    Handles AI chat session with memory, streaming, and AWS Knowledge Base check.
+    Pass a long-lived ConversationWindow as `window` to avoid rebuilding it from
+    `message_history` on every turn; it is updated with the new turn when streaming ends.
+    Pass a StreamBuffer as `buffer` to share the accumulated answer with the caller,
+    and a CitationCollector as `citations` to receive the answer's source links.
+    The turn is cancelled when `cancel_event` (a CancelToken) is cancelled, when the
+    generator is closed, or after `deadline_seconds` (default REQUEST_DEADLINE_SECONDS).
+    """
+    if buffer is None:
+        buffer = StreamBuffer()
+    if citations is None:
+        citations = CitationCollector()
+    trace = metrics.start_trace("chat", session_id=session_id or "default-session")
+    if window is None:
+        window = ConversationWindow.from_messages(message_history)
 
-    new_text_message = ChatMessage("user", new_text)
-    message_history.append(new_text_message)
+    turn = ChatTurn(new_text, window, session_id, trace)
+    message_history.append(turn.user_message)
 
     # ✅ Trim history to avoid excessive memory usage
     if len(message_history) > MAX_MESSAGES * 2:
@@ -130,14 +1088,37 @@ def chat_with_model(message_history, new_text, session_id=None):
     assistant_message = ChatMessage("assistant", "...")
     message_history.append(assistant_message)
 
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        future_model = executor.submit(query_knowledge_base_stream, new_text, message_history, session_id)
+    # ✅ One token per turn: every upstream stream of this answer is closed when it is cancelled
+    token = CancelToken.with_timeout(REQUEST_DEADLINE_SECONDS if deadline_seconds is None else deadline_seconds,
+                                     parent=cancel_event)
+
+    turn.plan_route()
+    response_stream = turn.stream(token)
 
-        streamed_response = ""
-        for response_chunk in future_model.result():
-            streamed_response += response_chunk
+    try:
+        for response_chunk in response_stream:
+            if isinstance(response_chunk, CitationChunk):
+                citations.add(response_chunk.citations)
+                continue
+            if response_chunk.strip():
+                trace.mark("ttft")
+            buffer.append(response_chunk)
             yield response_chunk  # ✅ Stream dynamically from KB or Claude
+    except GeneratorExit:
+        token.cancel(CANCEL_CONSUMER_CLOSED)  # ✅ New message, Clear History or closed tab
+        raise
+    finally:
+        if hasattr(response_stream, "close"):
+            response_stream.close()
+        cancelled = token.is_set()
+        if cancelled:
+            logger.info("🛑 Chat turn cancelled (%s) after %d chars.", token.reason, len(buffer))
+            trace.set("cancel_reason", token.reason)
+        token.cancel(CANCEL_DONE)  # ✅ Releases the deadline and anything still registered on the token
+        trace.set("output_chars", len(buffer))
+        metrics.finish_trace(trace)
 
-        # ✅ Store full assistant response
-        message_history[-1].text = streamed_response
-        print(f"🔍 Final Assistant Message: {message_history[-1].text}")
+    # ✅ Store full assistant response
+    assistant_message.text = buffer.text()
+    assistant_message.citations = citations.citations or None
+    turn.finish(assistant_message, complete=not cancelled)
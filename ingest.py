@@ -0,0 +1,338 @@
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+import zlib
+from urllib.parse import urlparse
+
+import envfile  # ✅ Loads .env before the config modules below read os.getenv
+import awsclients
+import localindex
+from localindex import CHUNK_OVERLAP_WORDS, CHUNK_WORDS, LOCAL_DOCS_DIR, LOCAL_INDEX_DIR
+from sources import sources
+
+# ⚡ Corpus Ingestion Configuration (sources.py documents -> content-hashed chunks -> KB data source + local index)
+INGEST_DIR = os.getenv("INGEST_DIR", "ingest")  # ✅ Manifest + chunk store
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 2)))
+PAGES_PER_TASK = int(os.getenv("INGEST_PAGES_PER_TASK", "16"))  # ✅ Large PDFs are parsed in page ranges on every core
+KB_DATA_SOURCE_S3 = os.getenv("KB_DATA_SOURCE_S3", "")  # ✅ s3://bucket/prefix/ of the Knowledge Base's S3 data source
+KB_DATA_SOURCE_ID = os.getenv("KB_DATA_SOURCE_ID", "")  # ✅ Starts an (incremental) ingestion job after a sync when set
+KNOWLEDGE_BASE_ID = os.getenv("KNOWLEDGE_BASE_ID", "BKWDTDREEZ")
+
+MANIFEST_FILE = "manifest.json"
+CHUNKS_DIR = "chunks"
+MANIFEST_VERSION = 1
+MIN_CHUNK_WORDS = CHUNK_WORDS // 2
+MAX_CHUNK_WORDS = CHUNK_WORDS * 2
+
+logger = logging.getLogger("ingest")
+
+def content_defined_chunks(text, chunk_words=CHUNK_WORDS, overlap_words=CHUNK_OVERLAP_WORDS,
+                           min_words=MIN_CHUNK_WORDS, max_words=MAX_CHUNK_WORDS):
+    """
+    Splits a document into chunks of about `chunk_words` words. Boundaries are picked by
+    a hash of the words around them rather than by position, so an edit only changes the
+    chunk it falls in (and the next one, through the overlap) instead of every later chunk.
+    """
+    words = text.split()
+    divisor = max(1, chunk_words - min_words)
+    chunks = []
+    start = 0
+    for i in range(len(words)):
+        length = i + 1 - start
+        if length < min_words:
+            continue
+        anchor = f"{words[i - 1] if i else ''} {words[i]}".lower().encode("utf-8")
+        if length >= max_words or zlib.crc32(anchor) % divisor == 0:
+            chunks.append(" ".join(words[max(0, start - overlap_words):i + 1]))
+            start = i + 1
+    if start < len(words):
+        chunks.append(" ".join(words[max(0, start - overlap_words):]))
+    return chunks
+
+def chunk_id(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:20]
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+# ✅ Process pool workers (module-level so they can be pickled)
+def _pdf_page_count(path):
+    from pypdf import PdfReader
+
+    return len(PdfReader(path).pages)
+
+def _extract_pages(path, start, end):
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    return "\n".join(page.extract_text() or "" for page in reader.pages[start:end])
+
+def _read_text(path):
+    with open(path, encoding="utf-8", errors="replace") as f:
+        return f.read()
+
+def parse_documents(paths, workers=INGEST_WORKERS):
+    """Extracts the text of every document in a process pool. PDFs are split into page ranges. Returns {path: text}."""
+    if not paths:
+        return {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max(1, min(workers, os.cpu_count() or 1))) as pool:
+        pdfs = [path for path in paths if path.lower().endswith(".pdf")]
+        page_counts = dict(zip(pdfs, pool.map(_pdf_page_count, pdfs)))
+        parts = {}
+        for path in paths:
+            if path in page_counts:
+                parts[path] = [pool.submit(_extract_pages, path, start, start + PAGES_PER_TASK)
+                               for start in range(0, page_counts[path], PAGES_PER_TASK)]
+            else:
+                parts[path] = [pool.submit(_read_text, path)]
+        return {path: "\n".join(future.result() for future in futures) for path, futures in parts.items()}
+
+class ChunkStore:
+    """Manifest of indexed documents plus the text of every chunk, stored once per content hash."""
+
+    def __init__(self, root=INGEST_DIR):
+        self.root = root
+        self.manifest_path = os.path.join(root, MANIFEST_FILE)
+        self.chunks_dir = os.path.join(root, CHUNKS_DIR)
+        self.documents = {}
+        try:
+            with open(self.manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("version") == MANIFEST_VERSION and manifest.get("chunker") == self.chunker_settings():
+                self.documents = manifest["documents"]
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def chunker_settings():
+        """Changing these re-chunks every document on the next run."""
+        return {"chunk_words": CHUNK_WORDS, "overlap_words": CHUNK_OVERLAP_WORDS}
+
+    def _chunk_path(self, cid):
+        return os.path.join(self.chunks_dir, f"{cid}.txt")
+
+    def has_chunk(self, cid):
+        return os.path.exists(self._chunk_path(cid))
+
+    def put_chunk(self, cid, text):
+        os.makedirs(self.chunks_dir, exist_ok=True)
+        with open(self._chunk_path(cid), "w", encoding="utf-8") as f:
+            f.write(text)
+
+    def get_chunk(self, cid):
+        with open(self._chunk_path(cid), encoding="utf-8") as f:
+            return f.read()
+
+    def drop_unused_chunks(self):
+        used = {cid for document in self.documents.values() for cid in document["chunks"]}
+        if os.path.isdir(self.chunks_dir):
+            for name in os.listdir(self.chunks_dir):
+                if name[:-len(".txt")] not in used:
+                    os.remove(os.path.join(self.chunks_dir, name))
+
+    def save(self):
+        """Writes the manifest atomically, so an interrupted run never leaves a half-written one."""
+        os.makedirs(self.root, exist_ok=True)
+        manifest = {"version": MANIFEST_VERSION, "chunker": self.chunker_settings(), "documents": self.documents}
+        temp_path = self.manifest_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(temp_path, self.manifest_path)
+
+    def all_chunks(self):
+        """Every indexed chunk as {"text", "source", "url"}, in document order."""
+        return [
+            {"text": self.get_chunk(cid), "source": filename, "url": document["url"]}
+            for filename, document in sorted(self.documents.items())
+            for cid in document["chunks"]
+        ]
+
+class DocumentChange:
+    """What one ingestion run changes for one document."""
+    __slots__ = ("filename", "url", "file_sha256", "size", "mtime_ns", "chunks", "added", "removed", "relinked")
+
+    def __init__(self, filename, url, file_sha256="", size=0, mtime_ns=0, chunks=(), added=(), removed=(), relinked=()):
+        self.filename = filename
+        self.url = url
+        self.file_sha256 = file_sha256
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.chunks = list(chunks)  # ✅ (chunk id, text) in document order; empty for a removed document
+        self.added = set(added)
+        self.removed = set(removed)
+        self.relinked = set(relinked)  # ✅ Kept chunks whose metadata (the document's URL) changed
+
+def plan_changes(store, docs_dir=LOCAL_DOCS_DIR, source_map=sources, force=False, workers=INGEST_WORKERS):
+    """
+    Compares the documents in `docs_dir` with the manifest. Unchanged files (same size and
+    mtime, or same content hash) are skipped without parsing; changed and new ones are
+    parsed in parallel and diffed chunk by chunk. A document whose URL changed in sources.py
+    keeps its chunks but has their metadata rewritten. Returns (changes, unchanged filenames).
+    """
+    changes, unchanged, to_parse = [], [], {}
+    for filename, url in source_map.items():
+        path = os.path.join(docs_dir, filename)
+        if not os.path.exists(path):
+            logger.warning("⚠️ Missing source document: %s", path)
+            continue
+        stat = os.stat(path)
+        known = store.documents.get(filename)
+        if not force and known and known["size"] == stat.st_size and known["mtime_ns"] == stat.st_mtime_ns:
+            digest = known["sha256"]
+        else:
+            digest = file_sha256(path)
+        if not force and known and known["sha256"] == digest:
+            known["mtime_ns"] = stat.st_mtime_ns  # ✅ Touched but identical, don't parse it again
+            if known["url"] == url:
+                unchanged.append(filename)
+            else:
+                changes.append(DocumentChange(filename, url, digest, stat.st_size, stat.st_mtime_ns,
+                                              chunks=[(cid, store.get_chunk(cid)) for cid in known["chunks"]],
+                                              relinked=known["chunks"]))
+            continue
+        to_parse[path] = DocumentChange(filename, url, digest, stat.st_size, stat.st_mtime_ns)
+
+    for path, text in parse_documents(list(to_parse), workers).items():
+        change = to_parse[path]
+        change.chunks = [(chunk_id(chunk), chunk) for chunk in content_defined_chunks(text)]
+        known = store.documents.get(change.filename, {})
+        previous = set(known.get("chunks", ()))
+        current = {cid for cid, _ in change.chunks}
+        change.added = current - previous if not force else current
+        change.removed = previous - current
+        if known and known["url"] != change.url:
+            change.relinked = (current & previous) - change.added
+        changes.append(change)
+
+    for filename, known in store.documents.items():
+        if filename not in source_map:
+            changes.append(DocumentChange(filename, known["url"], removed=known["chunks"]))
+    return changes, unchanged
+
+class S3DataSource:
+    """
+    Writes chunks to the Knowledge Base's S3 data source as one object per chunk (plus a
+    metadata sidecar with the source document and its public URL). Unchanged chunks are
+    never re-uploaded, so the KB's own incremental sync only embeds what changed.
+    Configure the data source with the "no chunking" strategy, the chunks are final.
+    """
+
+    def __init__(self, s3_uri=KB_DATA_SOURCE_S3, data_source_id=KB_DATA_SOURCE_ID, knowledge_base_id=KNOWLEDGE_BASE_ID):
+        parsed = urlparse(s3_uri)
+        self.bucket = parsed.netloc
+        self.prefix = parsed.path.lstrip("/")
+        if self.prefix and not self.prefix.endswith("/"):
+            self.prefix += "/"
+        self.data_source_id = data_source_id
+        self.knowledge_base_id = knowledge_base_id
+        self.s3 = awsclients.get_client("s3")
+
+    def _key(self, filename, cid):
+        # ✅ The last path segment keeps the document's name, so citations still resolve through sources.py
+        return f"{self.prefix}{cid}/{os.path.splitext(filename)[0]}.txt"
+
+    def apply(self, change):
+        metadata = json.dumps({"metadataAttributes": {"source": change.filename, "url": change.url}}).encode("utf-8")
+        for cid, text in change.chunks:
+            if cid in change.added or cid in change.relinked:
+                key = self._key(change.filename, cid)
+                if cid in change.added:
+                    self.s3.put_object(Bucket=self.bucket, Key=key, Body=text.encode("utf-8"), ContentType="text/plain")
+                self.s3.put_object(Bucket=self.bucket, Key=f"{key}.metadata.json", Body=metadata)
+        removed = [self._key(change.filename, cid) for cid in change.removed]
+        keys = [{"Key": key} for key in removed] + [{"Key": f"{key}.metadata.json"} for key in removed]
+        for i in range(0, len(keys), 1000):  # ✅ DeleteObjects takes at most 1000 keys
+            self.s3.delete_objects(Bucket=self.bucket, Delete={"Objects": keys[i:i + 1000], "Quiet": True})
+
+    def start_sync(self):
+        """Starts the KB ingestion job for the data source. Returns its id (None without KB_DATA_SOURCE_ID)."""
+        if not self.data_source_id:
+            return None
+        response = awsclients.get_client("bedrock-agent").start_ingestion_job(
+            knowledgeBaseId=self.knowledge_base_id, dataSourceId=self.data_source_id,
+        )
+        return response["ingestionJob"]["ingestionJobId"]
+
+def ingest(docs_dir=LOCAL_DOCS_DIR, store=None, data_source=None, index_dir=LOCAL_INDEX_DIR, source_map=sources,
+           force=False, dry_run=False, workers=INGEST_WORKERS, rebuild_index=False):
+    """
+    One incremental ingestion run. New chunks go to the chunk store and `data_source`,
+    removed ones are deleted, and the manifest is saved after each document, so an
+    interrupted run picks up where it stopped. The local index is rebuilt from the chunk
+    store (no re-parsing) when anything changed. Returns a summary dict.
+    """
+    store = store or ChunkStore()
+    started = time.perf_counter()
+    changes, unchanged = plan_changes(store, docs_dir, source_map, force, workers)
+    summary = {
+        "unchanged": len(unchanged),
+        "changed": len(changes),
+        "chunks_added": sum(len(change.added) for change in changes),
+        "chunks_removed": sum(len(change.removed) for change in changes),
+        "chunks_relinked": sum(len(change.relinked) for change in changes),
+        "ingestion_job": None,
+    }
+    if dry_run:
+        summary["seconds"] = time.perf_counter() - started
+        return summary
+
+    for change in changes:
+        for cid, text in change.chunks:
+            if not store.has_chunk(cid):
+                store.put_chunk(cid, text)
+        if data_source is not None:
+            data_source.apply(change)
+        if change.chunks:
+            store.documents[change.filename] = {
+                "url": change.url, "sha256": change.file_sha256, "size": change.size, "mtime_ns": change.mtime_ns,
+                "chunks": [cid for cid, _ in change.chunks],
+            }
+        else:
+            store.documents.pop(change.filename, None)
+        store.save()
+        logger.info("📄 %s: %d chunks added, %d removed, %d relinked", change.filename, len(change.added),
+                    len(change.removed), len(change.relinked))
+    store.save()  # ✅ Also records mtimes of touched-but-identical files
+    store.drop_unused_chunks()
+
+    if changes and data_source is not None:
+        summary["ingestion_job"] = data_source.start_sync()
+    if (changes or rebuild_index) and index_dir:
+        localindex.build_index(store.all_chunks(), index_dir)  # ✅ Cheap: TF-IDF over stored chunk text
+    summary["seconds"] = time.perf_counter() - started
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Incrementally ingest the sources.py documents into the KB and local index.")
+    parser.add_argument("--docs", default=LOCAL_DOCS_DIR, help="Folder holding the documents listed in sources.py")
+    parser.add_argument("--store", default=INGEST_DIR, help="Manifest and chunk store folder")
+    parser.add_argument("--index", default=LOCAL_INDEX_DIR, help="Local index folder (empty string = don't build it)")
+    parser.add_argument("--s3", default=KB_DATA_SOURCE_S3, help="KB data source s3://bucket/prefix/ (empty = local only)")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS)
+    parser.add_argument("--force", action="store_true", help="Re-parse and re-upload every document")
+    parser.add_argument("--rebuild-index", action="store_true", help="Rebuild the local index even if nothing changed")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would change")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    data_source = S3DataSource(args.s3) if args.s3 and not args.dry_run else None
+    summary = ingest(args.docs, ChunkStore(args.store), data_source, args.index, force=args.force, dry_run=args.dry_run,
+                     workers=args.workers, rebuild_index=args.rebuild_index)
+    print(f"✅ {summary['changed']} documents changed, {summary['unchanged']} unchanged: "
+          f"{summary['chunks_added']} chunks added, {summary['chunks_removed']} removed, "
+          f"{summary['chunks_relinked']} relinked in {summary['seconds']:.2f}s")
+    if summary["ingestion_job"]:
+        print(f"🟢 Knowledge Base ingestion job started: {summary['ingestion_job']}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
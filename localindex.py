@@ -0,0 +1,181 @@
+import argparse
+import json
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+import envfile  # ✅ The CLI reads LOCAL_INDEX_* from .env too
+from sources import sources
+
+# ⚡ Local Retrieval Configuration
+LOCAL_DOCS_DIR = os.getenv("LOCAL_DOCS_DIR", "docs")  # ✅ Folder holding the PDFs listed in sources.py
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", "index")
+CHUNK_WORDS = 180
+CHUNK_OVERLAP_WORDS = 40
+MAX_VOCABULARY = 20000
+DEFAULT_TOP_K = 4
+# ✅ numpy is imported where it is used, so importing genailib does not pay for it before the first search
+
+VECTORS_FILE = "vectors.npy"
+META_FILE = "meta.json"
+
+logger = logging.getLogger("localindex")
+
+_token_re = re.compile(r"[a-z0-9€]+(?:[.'-][a-z0-9]+)*")
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from has have how i if in is it its my of on or "
+    "our should so that the their there they this to was what when where which who will with "
+    "you your".split()
+)
+
+def tokenize(text):
+    """Lower-cases and splits text into index terms."""
+    return [t for t in _token_re.findall(text.lower()) if len(t) > 1 and t not in STOPWORDS]
+
+def chunk_text(text, chunk_words=CHUNK_WORDS, overlap_words=CHUNK_OVERLAP_WORDS):
+    """Splits a document into overlapping word windows."""
+    words = text.split()
+    step = max(1, chunk_words - overlap_words)
+    chunks = []
+    for start in range(0, len(words), step):
+        chunks.append(" ".join(words[start:start + chunk_words]))
+        if start + chunk_words >= len(words):
+            break
+    return chunks
+
+def read_pdf_text(path):
+    """Extracts the plain text of a PDF (pypdf is only needed when building the index)."""
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    return "\n".join(page.extract_text() or "" for page in reader.pages)
+
+def _term_weights(tokens):
+    """Sublinear term frequencies for one chunk or query."""
+    return {term: 1.0 + math.log(count) for term, count in Counter(tokens).items()}
+
+def build_index(chunks, out_dir=LOCAL_INDEX_DIR):
+    """
+    Builds a TF-IDF index from a list of {"text", "source", "url"} chunks and writes it
+    to `out_dir` as an L2-normalized float32 matrix plus a JSON metadata file.
+    """
+    import numpy as np
+
+    tokenized = [tokenize(chunk["text"]) for chunk in chunks]
+
+    document_frequency = Counter()
+    for tokens in tokenized:
+        document_frequency.update(set(tokens))
+
+    vocabulary = [term for term, _ in document_frequency.most_common(MAX_VOCABULARY)]
+    term_ids = {term: i for i, term in enumerate(vocabulary)}
+    n_chunks = len(chunks)
+    idf = np.array(
+        [math.log((1 + n_chunks) / (1 + document_frequency[term])) + 1.0 for term in vocabulary],
+        dtype=np.float32,
+    )
+
+    vectors = np.zeros((n_chunks, len(vocabulary)), dtype=np.float32)
+    for row, tokens in enumerate(tokenized):
+        for term, weight in _term_weights(tokens).items():
+            column = term_ids.get(term)
+            if column is not None:
+                vectors[row, column] = weight * idf[column]
+
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors /= np.where(norms == 0, 1, norms)
+
+    os.makedirs(out_dir, exist_ok=True)
+    np.save(os.path.join(out_dir, VECTORS_FILE), vectors)
+    with open(os.path.join(out_dir, META_FILE), "w", encoding="utf-8") as f:
+        json.dump({"vocabulary": vocabulary, "idf": idf.tolist(), "chunks": chunks}, f)
+
+    logger.info("✅ Indexed %d chunks (%d terms) into %s", n_chunks, len(vocabulary), out_dir)
+
+def build_from_sources(docs_dir=LOCAL_DOCS_DIR, out_dir=LOCAL_INDEX_DIR):
+    """Chunks every PDF from sources.py found in `docs_dir` and builds the index."""
+    chunks = []
+    for filename, url in sources.items():
+        path = os.path.join(docs_dir, filename)
+        if not os.path.exists(path):
+            logger.warning("⚠️ Missing source document: %s", path)
+            continue
+        for text in chunk_text(read_pdf_text(path)):
+            chunks.append({"text": text, "source": filename, "url": url})
+    build_index(chunks, out_dir)
+
+class LocalIndex:
+    """Read-only TF-IDF index; the vector matrix is memory-mapped so loading is near-instant."""
+
+    def __init__(self, index_dir=LOCAL_INDEX_DIR):
+        import numpy as np
+
+        with open(os.path.join(index_dir, META_FILE), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.chunks = meta["chunks"]
+        self.term_ids = {term: i for i, term in enumerate(meta["vocabulary"])}
+        self.idf = np.asarray(meta["idf"], dtype=np.float32)
+        self.vectors = np.load(os.path.join(index_dir, VECTORS_FILE), mmap_mode="r")
+
+    def search(self, query, top_k=DEFAULT_TOP_K):
+        """Returns up to `top_k` chunks as dicts with an added cosine "score", best first."""
+        import numpy as np
+
+        weights = {
+            self.term_ids[term]: weight
+            for term, weight in _term_weights(tokenize(query)).items()
+            if term in self.term_ids
+        }
+        if not weights or not self.chunks:
+            return []
+
+        columns = np.fromiter(weights.keys(), dtype=np.int64)
+        query_vector = np.fromiter(weights.values(), dtype=np.float32) * self.idf[columns]
+        query_vector /= np.linalg.norm(query_vector)
+
+        # ✅ Only the query's columns take part in the dot product
+        scores = self.vectors[:, columns] @ query_vector
+        top_k = min(top_k, len(scores))
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+        return [dict(self.chunks[i], score=float(scores[i])) for i in best if scores[i] > 0]
+
+_index = None
+_index_loaded = False
+_index_lock = threading.Lock()
+
+def get_index(index_dir=LOCAL_INDEX_DIR):
+    """Loads the local index once per process. Returns None when no index has been built."""
+    global _index, _index_loaded
+    if not _index_loaded:
+        with _index_lock:
+            if not _index_loaded:
+                try:
+                    _index = LocalIndex(index_dir)
+                except FileNotFoundError:
+                    logger.warning("⚠️ No local index found in %s, local retrieval disabled", index_dir)
+                    _index = None
+                _index_loaded = True
+    return _index
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or query the local index over the sources.py documents.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build")
+    build_parser.add_argument("--docs", default=LOCAL_DOCS_DIR)
+    build_parser.add_argument("--out", default=LOCAL_INDEX_DIR)
+    query_parser = subparsers.add_parser("query")
+    query_parser.add_argument("text")
+    query_parser.add_argument("--index", default=LOCAL_INDEX_DIR)
+    query_parser.add_argument("-k", type=int, default=DEFAULT_TOP_K)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if args.command == "build":
+        build_from_sources(args.docs, args.out)
+    else:
+        for hit in LocalIndex(args.index).search(args.text, args.k):
+            print(f"{hit['score']:.3f}  {hit['source']}  {hit['text'][:100]}...")
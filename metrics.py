@@ -0,0 +1,282 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+# ⚡ Request Instrumentation
+# Sinks are callables that receive every finished RequestTrace. With no sinks registered
+# start_trace() hands out NULL_TRACE, whose methods do nothing, so the hot path pays
+# only for a few no-op calls.
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0)
+STAGE_TIMINGS = ("ttft", "total", "kb_ttft", "kb_total", "model_ttft", "model_total", "kb_queue_wait", "model_queue_wait",
+                 "retrieve_total", "agent_ttft", "agent_total", "agent_queue_wait")
+
+logger = logging.getLogger("metrics")
+
+_sinks = []
+_sinks_lock = threading.Lock()
+
+class RequestTrace:
+    """Per-request stage timings (seconds since start), counters and spans."""
+    enabled = True
+
+    def __init__(self, name="chat", **attributes):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.attributes = attributes
+        self.values = {}
+        self.spans = []
+        self.start_time = time.time()
+        self.end_time = None
+        self._start = time.perf_counter()
+        self._open_spans = {}
+
+    def elapsed(self):
+        return time.perf_counter() - self._start
+
+    def mark(self, key):
+        """Records the elapsed time under `key` the first time it is called."""
+        if key not in self.values:
+            self.values[key] = self.elapsed()
+
+    def set(self, key, value):
+        self.values[key] = value
+
+    def add(self, key, amount=1):
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def begin(self, span_name):
+        self._open_spans[span_name] = self.elapsed()
+
+    def end(self, span_name, **attributes):
+        """Closes a span opened with begin(); unknown names are ignored."""
+        started = self._open_spans.pop(span_name, None)
+        if started is not None:
+            self.spans.append({"name": span_name, "start": started, "end": self.elapsed(), "attributes": attributes})
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "attributes": self.attributes,
+            "values": self.values,
+            "spans": self.spans,
+        }
+
+class _NullTrace:
+    """Stand-in used while instrumentation is disabled."""
+    enabled = False
+    values = {}
+
+    def elapsed(self):
+        return 0.0
+
+    def mark(self, key):
+        pass
+
+    def set(self, key, value):
+        pass
+
+    def add(self, key, amount=1):
+        pass
+
+    def begin(self, span_name):
+        pass
+
+    def end(self, span_name, **attributes):
+        pass
+
+NULL_TRACE = _NullTrace()
+
+def add_sink(sink):
+    with _sinks_lock:
+        _sinks.append(sink)
+    return sink
+
+def remove_sink(sink):
+    with _sinks_lock:
+        if sink in _sinks:
+            _sinks.remove(sink)
+
+def enabled():
+    return bool(_sinks)
+
+def start_trace(name="chat", **attributes):
+    """Starts a trace, or returns NULL_TRACE when no sink is registered."""
+    if not _sinks:
+        return NULL_TRACE
+    return RequestTrace(name, **attributes)
+
+def finish_trace(trace):
+    """Stamps the end time, derives tokens/sec and hands the trace to every sink."""
+    if not trace.enabled:
+        return
+    trace.end_time = time.time()
+    trace.mark("total")
+    values = trace.values
+    if "model_ttft" in values and "model_total" in values and values.get("output_tokens"):
+        generation_time = values["model_total"] - values["model_ttft"]
+        if generation_time > 0:
+            values["tokens_per_second"] = values["output_tokens"] / generation_time
+    for sink in list(_sinks):
+        try:
+            sink(trace)
+        except Exception as e:
+            logger.warning("⚠️ Metrics sink failed: %s", e)
+
+class PrometheusSink:
+    """Aggregates traces into counters and latency histograms, rendered in Prometheus text format."""
+
+    def __init__(self, prefix="herdbot", buckets=LATENCY_BUCKETS):
+        self.prefix = prefix
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+
+    def gauge(self, name, read_value):
+        """Registers a gauge whose value is read from `read_value()` at render time."""
+        self._gauges[name] = read_value
+
+    def _inc(self, name, labels=(), amount=1):
+        key = (name, labels)
+        self._counters[key] = self._counters.get(key, 0) + amount
+
+    def _observe(self, name, labels, value):
+        key = (name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = [[0] * len(self.buckets), 0, 0.0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                histogram[0][i] += 1
+        histogram[1] += 1
+        histogram[2] += value
+
+    def __call__(self, trace):
+        values = trace.values
+        route = str(values.get("route", "unknown"))
+        with self._lock:
+            self._inc("requests_total", (("name", trace.name), ("route", route)))
+            if values.get("cache_hit"):
+                self._inc("cache_hits_total", (("name", trace.name),))
+            if values.get("fallback"):
+                self._inc("fallbacks_total", (("reason", str(values.get("fallback_reason", "unknown"))),))
+            for key in ("input_tokens", "output_tokens", "cache_read_input_tokens", "cache_write_input_tokens",
+                        "kb_throttle_retries", "model_throttle_retries", "retrieval_cache_hits"):
+                if values.get(key):
+                    self._inc(f"{key}_total", (("name", trace.name),), values[key])
+            if "cancel_reason" in values:
+                self._inc("cancellations_total", (("reason", str(values["cancel_reason"])),))
+            if "route_reason" in values:
+                self._inc("route_decisions_total", (("route", route), ("reason", str(values["route_reason"]))))
+            if "ttft" in values:
+                self._observe("route_ttft_seconds", (("route", route),), values["ttft"])
+            if "engine" in values:
+                # ✅ Same end-to-end measures for every chat engine (kb / model / agent)
+                engine = (("engine", str(values["engine"])),)
+                if "ttft" in values:
+                    self._observe("engine_ttft_seconds", engine, values["ttft"])
+                if "total" in values:
+                    self._observe("engine_total_seconds", engine, values["total"])
+            for stage in STAGE_TIMINGS:
+                if stage in values:
+                    self._observe("stage_seconds", (("stage", stage),), values[stage])
+            if "tokens_per_second" in values:
+                self._observe("tokens_per_second", (), values["tokens_per_second"])
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                lines.append(f"{self.prefix}_{name}{self._labels(labels)} {value}")
+            for (name, labels), (counts, count, total) in sorted(self._histograms.items()):
+                metric = f"{self.prefix}_{name}"
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f"{metric}_bucket{self._labels(labels, [('le', bound)])} {bucket_count}")
+                lines.append(f"{metric}_bucket{self._labels(labels, [('le', '+Inf')])} {count}")
+                lines.append(f"{metric}_count{self._labels(labels)} {count}")
+                lines.append(f"{metric}_sum{self._labels(labels)} {total}")
+        for name, read_value in sorted(self._gauges.items()):
+            lines.append(f"{self.prefix}_{name} {read_value()}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port):
+        """Serves /metrics on `port` from a daemon thread."""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = sink.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True, name="metrics-http").start()
+        return server
+
+class SpanFileSink:
+    """Appends each trace as OpenTelemetry-style spans (one JSON object per line)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, trace):
+        start_ns = int(trace.start_time * 1e9)
+        root_span_id = uuid.uuid4().hex[:16]
+        spans = [{
+            "traceId": trace.trace_id,
+            "spanId": root_span_id,
+            "name": trace.name,
+            "startTimeUnixNano": start_ns,
+            "endTimeUnixNano": int(trace.end_time * 1e9),
+            "attributes": dict(trace.attributes, **trace.values),
+        }]
+        for span in trace.spans:
+            spans.append({
+                "traceId": trace.trace_id,
+                "spanId": uuid.uuid4().hex[:16],
+                "parentSpanId": root_span_id,
+                "name": span["name"],
+                "startTimeUnixNano": start_ns + int(span["start"] * 1e9),
+                "endTimeUnixNano": start_ns + int(span["end"] * 1e9),
+                "attributes": span["attributes"],
+            })
+        records = "".join(json.dumps(span, default=str) + "\n" for span in spans)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(records)
+
+def configure_from_env():
+    """Registers sinks from METRICS_PORT (Prometheus endpoint) and METRICS_SPANS_FILE. Returns the Prometheus sink, if any."""
+    prometheus = None
+    port = os.getenv("METRICS_PORT")
+    if port:
+        prometheus = add_sink(PrometheusSink())
+        prometheus.serve(int(port))
+    spans_file = os.getenv("METRICS_SPANS_FILE")
+    if spans_file:
+        add_sink(SpanFileSink(spans_file))
+    return prometheus
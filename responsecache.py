@@ -0,0 +1,182 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from citations import CitationChunk
+
+# ⚡ Response Cache Configuration
+CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "512"))
+CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", str(24 * 60 * 60)))
+CACHE_DB_PATH = os.getenv("RESPONSE_CACHE_DB", "")  # ✅ Optional SQLite file shared across sessions / processes
+REPLAY_CHUNK_WORDS = 3
+
+# ✅ A cached answer and the citations that were shown with it (None if it had none)
+CachedAnswer = namedtuple("CachedAnswer", "answer citations")
+
+_punctuation_re = re.compile(r"[^\w\s€£%.-]+")
+_whitespace_re = re.compile(r"\s+")
+
+def normalize_prompt(prompt):
+    """Lower-cases a prompt and strips punctuation / extra whitespace so trivial variants share a key."""
+    text = _punctuation_re.sub(" ", prompt.lower())
+    return _whitespace_re.sub(" ", text).strip(" .-")
+
+def context_fingerprint(message_history, summary=""):
+    """
+    Hashes the whole conversation context an answer is generated from: every message sent
+    upstream, verbatim, plus the rolling summary. Two sessions only share a key (and an
+    answer) when the model would have seen exactly the same conversation.
+    """
+    context = [summary] + [[msg.role, msg.text] for msg in message_history]
+    return hashlib.sha256(json.dumps(context, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def cache_key(prompt, message_history, summary=""):
+    """Builds the cache key from the normalized prompt plus the conversation context hash."""
+    raw = f"{normalize_prompt(prompt)}\n{context_fingerprint(message_history, summary)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def replay_stream(text, citations=None, chunk_words=REPLAY_CHUNK_WORDS):
+    """Replays a cached answer as a stream of small chunks, like a live model response, then its citations."""
+    words = re.split(r"(\s+)", text)
+    step = chunk_words * 2  # ✅ re.split keeps the separators
+    for i in range(0, len(words), step):
+        yield "".join(words[i:i + step])
+    if citations:
+        yield CitationChunk(citations)
+
+def _encode(answer, citations):
+    return json.dumps({"answer": answer, "citations": citations}, ensure_ascii=False)
+
+def _decode(value):
+    """CachedAnswer from a stored value (plain-text values from older caches have no citations)."""
+    try:
+        entry = json.loads(value)
+    except ValueError:
+        entry = None
+    if not isinstance(entry, dict):
+        return CachedAnswer(value, None)
+    return CachedAnswer(entry.get("answer", ""), entry.get("citations") or None)
+
+class LRUCache:
+    """Thread-safe in-memory LRU cache with TTL eviction."""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl_seconds=CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+class SQLiteCache:
+    """On-disk LRU/TTL cache, shared by every Streamlit session and process using the same file."""
+
+    def __init__(self, path, max_entries=CACHE_MAX_ENTRIES, ttl_seconds=CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")  # ✅ Readers don't block the writer
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self._conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            return row[0]
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, expires_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, value, now + self.ttl_seconds, now),
+            )
+            self._conn.execute("DELETE FROM responses WHERE expires_at < ?", (now,))
+            self._conn.execute(
+                "DELETE FROM responses WHERE key NOT IN "
+                "(SELECT key FROM responses ORDER BY last_used DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+class ResponseCache:
+    """
+    Two-tier answer cache in front of chat_with_model: a per-process LRU in memory,
+    backed by an optional SQLite file.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl_seconds=CACHE_TTL_SECONDS, db_path=CACHE_DB_PATH):
+        self.memory = LRUCache(max_entries, ttl_seconds)
+        self.disk = SQLiteCache(db_path, max_entries, ttl_seconds) if db_path else None
+
+    def get(self, prompt, message_history, summary=""):
+        """The CachedAnswer for `prompt` in this conversation context, or None."""
+        key = cache_key(prompt, message_history, summary)
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.set(key, value)  # ✅ Promote disk hits to memory
+        return _decode(value) if value is not None else None
+
+    def put(self, prompt, message_history, answer, summary="", citations=None):
+        key = cache_key(prompt, message_history, summary)
+        value = _encode(answer, citations)
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
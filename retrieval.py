@@ -0,0 +1,93 @@
+import os
+import re
+
+from citations import reference_uri, resolve_link
+from responsecache import LRUCache, normalize_prompt
+
+# ⚡ Retrieval Stage Configuration (KB vector search, separate from generation)
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "5"))
+RETRIEVAL_MIN_SCORE = float(os.getenv("RETRIEVAL_MIN_SCORE", "0.4"))  # ✅ KB relevance score needed to keep a passage
+RETRIEVAL_CACHE_MAX_ENTRIES = int(os.getenv("RETRIEVAL_CACHE_MAX_ENTRIES", "1024"))
+RETRIEVAL_CACHE_TTL_SECONDS = float(os.getenv("RETRIEVAL_CACHE_TTL_SECONDS", str(6 * 60 * 60)))
+FOLLOW_UP_MAX_WORDS = 5  # ✅ Questions this short are assumed to lean on the previous one
+
+_follow_up_re = re.compile(
+    r"^(and|also|what about|how about|why|ok|okay)\b|\b(it|its|that|this|those|these|they|them|their|same|else)\b",
+    re.IGNORECASE,
+)
+
+def refers_back(prompt):
+    """True when a question explicitly points at the previous turn ("and ...", "it", "that", ...)."""
+    return bool(_follow_up_re.search(prompt))
+
+def is_follow_up(prompt):
+    """True when a question probably needs the previous turn to make sense on its own."""
+    return len(prompt.split()) <= FOLLOW_UP_MAX_WORDS or refers_back(prompt)
+
+def previous_question(message_history):
+    """The last user question in the history ("" if none)."""
+    for message in reversed(message_history):
+        if message.role == "user" and message.text.strip():
+            return message.text.strip()
+    return ""
+
+def condense_query(prompt, message_history):
+    """
+    Turns the question into a standalone retrieval query without a model call:
+    follow-ups get the previous user question prepended, standalone questions are used as-is.
+    """
+    prompt = prompt.strip()
+    if not is_follow_up(prompt):
+        return prompt
+    previous = previous_question(message_history)
+    return f"{previous}\n{prompt}" if previous else prompt
+
+def _result_location(result):
+    """(source filename, link) for one KB retrieval result; links resolve through sources.py."""
+    metadata = result.get("metadata") or {}
+    if metadata.get("source") and metadata.get("url"):
+        return metadata["source"], metadata["url"]  # ✅ Chunks written by ingest.py carry their document
+    uri = reference_uri(result)
+    link = resolve_link(uri)
+    return uri.rstrip("/").rsplit("/", 1)[-1], link[1] if link else uri
+
+def passages_from_results(results, min_score=RETRIEVAL_MIN_SCORE):
+    """Maps Retrieve API `retrievalResults` to passages ({"text", "source", "url", "score"}), best first."""
+    passages = []
+    for result in results:
+        text = result.get("content", {}).get("text", "").strip()
+        score = float(result.get("score", 0.0))
+        if not text or score < min_score:
+            continue
+        source, url = _result_location(result)
+        passages.append({"text": text, "source": source, "url": url, "score": score})
+    passages.sort(key=lambda passage: -passage["score"])
+    return passages
+
+def merge_passages(*passage_lists, top_k=RETRIEVAL_TOP_K):
+    """Merges passage lists, dropping duplicates (best score wins) and keeping the `top_k` best."""
+    best = {}
+    for passages in passage_lists:
+        for passage in passages:
+            key = (passage["source"], passage["text"])
+            if key not in best or passage["score"] > best[key]["score"]:
+                best[key] = passage
+    return sorted(best.values(), key=lambda passage: -passage["score"])[:top_k]
+
+class RetrievalCache:
+    """LRU/TTL cache of retrieved passages, keyed on the normalized standalone query."""
+
+    def __init__(self, max_entries=RETRIEVAL_CACHE_MAX_ENTRIES, ttl_seconds=RETRIEVAL_CACHE_TTL_SECONDS):
+        self.memory = LRUCache(max_entries, ttl_seconds)
+
+    def get(self, query):
+        return self.memory.get(normalize_prompt(query))
+
+    def put(self, query, passages):
+        self.memory.set(normalize_prompt(query), passages)
+
+    def clear(self):
+        self.memory.clear()
+
+    def __len__(self):
+        return len(self.memory)
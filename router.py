@@ -0,0 +1,132 @@
+import json
+import logging
+import os
+import re
+import time
+
+from responsecache import normalize_prompt
+from retrieval import previous_question, refers_back
+from sources import sources
+
+# ⚡ Query Router Configuration (local, no model call: FAQ answer vs. KB-grounded vs. direct model)
+ROUTER_ENABLED = os.getenv("ROUTER_ENABLED", "1") != "0"
+FAQ_FILE = os.getenv("FAQ_FILE", "faq.json")  # ✅ [{"question": "...", "answer": "..."}], optional
+FAQ_MIN_SIMILARITY = float(os.getenv("FAQ_MIN_SIMILARITY", "0.8"))  # ✅ Word-set overlap needed for a fuzzy FAQ hit
+FAST_MODEL_ID = os.getenv("FAST_MODEL_ID", "")  # ✅ Smaller model for short direct turns, e.g. Claude 3 Haiku
+FAST_MODEL_MAX_WORDS = int(os.getenv("FAST_MODEL_MAX_WORDS", "8"))
+
+ROUTE_FAQ = "faq"
+ROUTE_KB = "kb"
+ROUTE_DIRECT = "direct"
+
+# ✅ Scheme / policy vocabulary; the sources.py filenames add the corpus' own terms
+POLICY_TERMS = frozenset(
+    "scheme schemes payment payments grant grants eligibility eligible deadline deadlines terms conditions "
+    "application apply applying claim claims entitlement entitlements subsidy subsidies department dafm "
+    "agfood tams bps bissy cis crs ecoscheme eco acres scep csp nitrates derogation inspection inspections "
+    "penalty penalties compliance herdwatch".split()
+)
+# ✅ Husbandry words that also appear in document names but don't make a question a scheme question
+GENERAL_TERMS = frozenset("beef dairy welfare cattle cows herd".split())
+_word_re = re.compile(r"[a-z0-9]+")
+
+logger = logging.getLogger("router")
+
+def _words(text):
+    return set(_word_re.findall(text.lower()))
+
+def corpus_terms(source_map=sources):
+    """Words from the sources.py document names, e.g. "beef_finisher_payment.pdf" -> beef, finisher, payment."""
+    terms = set()
+    for filename in source_map:
+        terms.update(word for word in _words(os.path.splitext(filename)[0]) if len(word) > 2)
+    return frozenset(terms - GENERAL_TERMS)
+
+class RouteDecision:
+    """Which route a question takes, why, and (for direct turns) which model answers it."""
+    __slots__ = ("route", "reason", "model_id", "answer", "seconds")
+
+    def __init__(self, route, reason, model_id=None, answer=None, seconds=0.0):
+        self.route = route
+        self.reason = reason
+        self.model_id = model_id
+        self.answer = answer
+        self.seconds = seconds
+
+class FAQ:
+    """Curated answers matched on the normalized question, exactly or by word overlap."""
+
+    def __init__(self, entries=(), min_similarity=FAQ_MIN_SIMILARITY):
+        self.min_similarity = min_similarity
+        self._answers = {}
+        self._words = []  # ✅ (word set, answer) for the fuzzy pass
+        for entry in entries:
+            question = normalize_prompt(entry["question"])
+            self._answers[question] = entry["answer"]
+            self._words.append((_words(question), entry["answer"]))
+
+    @classmethod
+    def load(cls, path=FAQ_FILE, **kwargs):
+        """Reads the FAQ file; a missing file gives an empty FAQ."""
+        try:
+            with open(path, encoding="utf-8") as f:
+                return cls(json.load(f), **kwargs)
+        except FileNotFoundError:
+            return cls(**kwargs)
+
+    def match(self, prompt):
+        """The FAQ answer for `prompt`, or None."""
+        normalized = normalize_prompt(prompt)
+        answer = self._answers.get(normalized)
+        if answer is not None or not self._words:
+            return answer
+        words = _words(normalized)
+        if not words:
+            return None
+        best, best_score = None, 0.0
+        for faq_words, faq_answer in self._words:
+            score = len(words & faq_words) / len(words | faq_words)
+            if score > best_score:
+                best, best_score = faq_answer, score
+        return best if best_score >= self.min_similarity else None
+
+    def __len__(self):
+        return len(self._answers)
+
+class QueryRouter:
+    """
+    Picks a route before any Bedrock call: a curated FAQ answer, a KB-grounded answer for
+    scheme / policy questions, or a direct model call. Short, simple direct turns can go to
+    FAST_MODEL_ID.
+    """
+
+    def __init__(self, faq=None, kb_terms=None, fast_model_id=FAST_MODEL_ID, fast_model_max_words=FAST_MODEL_MAX_WORDS):
+        self.faq = faq if faq is not None else FAQ.load()
+        self.kb_terms = kb_terms if kb_terms is not None else POLICY_TERMS | corpus_terms()
+        self.fast_model_id = fast_model_id
+        self.fast_model_max_words = fast_model_max_words
+
+    def route(self, prompt, message_history=()):
+        started = time.perf_counter()
+        decision = self._decide(prompt, message_history)
+        decision.seconds = time.perf_counter() - started
+        logger.info("🧭 Routed to %s (%s, model=%s) in %.2fms", decision.route, decision.reason,
+                    decision.model_id or "default", decision.seconds * 1000)
+        return decision
+
+    def _decide(self, prompt, message_history):
+        answer = self.faq.match(prompt)
+        if answer is not None:
+            return RouteDecision(ROUTE_FAQ, "faq_match", answer=answer)
+
+        # ✅ Explicit follow-ups inherit the previous question's topic, so "is it paid yearly?" stays on the KB
+        follows_up = refers_back(prompt) and previous_question(message_history)
+        query = f"{previous_question(message_history)}\n{prompt}" if follows_up else prompt
+        matched = _words(query) & self.kb_terms
+        if matched:
+            logger.debug("🧭 KB terms matched: %s", ", ".join(sorted(matched)))
+            return RouteDecision(ROUTE_KB, "kb_terms")
+
+        if self.fast_model_id and not follows_up and len(prompt.split()) <= self.fast_model_max_words:
+            return RouteDecision(ROUTE_DIRECT, "short_turn", model_id=self.fast_model_id)
+        return RouteDecision(ROUTE_DIRECT, "general")
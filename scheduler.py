@@ -0,0 +1,186 @@
+import contextlib
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+
+# ⚡ Bedrock Quota Scheduler Configuration (size these to the account's Bedrock quotas)
+BEDROCK_REQUESTS_PER_MINUTE = float(os.getenv("BEDROCK_REQUESTS_PER_MINUTE", "100"))
+BEDROCK_TOKENS_PER_MINUTE = float(os.getenv("BEDROCK_TOKENS_PER_MINUTE", "200000"))
+BURST_SECONDS = float(os.getenv("BEDROCK_BURST_SECONDS", "10"))  # ✅ Bucket capacity = this many seconds of quota
+MAX_QUEUE_WAIT_SECONDS = float(os.getenv("BEDROCK_MAX_QUEUE_WAIT", "30"))
+MAX_THROTTLE_RETRIES = int(os.getenv("BEDROCK_MAX_THROTTLE_RETRIES", "4"))
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 8.0
+
+PRIORITY_INTERACTIVE = 0  # ✅ Lower number = served first
+PRIORITY_BATCH = 10
+
+THROTTLING_ERROR_CODES = frozenset({"ThrottlingException", "TooManyRequestsException", "ServiceQuotaExceededException"})
+
+logger = logging.getLogger("scheduler")
+
+_priority = contextvars.ContextVar("bedrock_priority", default=PRIORITY_INTERACTIVE)
+
+class QueueTimeout(Exception):
+    """Raised when a request waited longer than its queue timeout for quota."""
+
+def current_priority():
+    return _priority.get()
+
+@contextlib.contextmanager
+def priority(value):
+    """Runs the enclosed Bedrock calls at `value` priority (e.g. PRIORITY_BATCH for batch jobs)."""
+    token = _priority.set(value)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+def is_throttling_error(error):
+    """True for a botocore ClientError with a throttling code (duck-typed, so importing this module skips botocore)."""
+    response = getattr(error, "response", None)
+    return isinstance(response, dict) and response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+
+def backoff_delay(attempt, base=BACKOFF_BASE_SECONDS, cap=BACKOFF_MAX_SECONDS):
+    """Full-jitter exponential backoff for retry `attempt` (0-based)."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+class TokenBucket:
+    """Refills continuously at `rate` units per second up to `capacity`. Not thread-safe on its own."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount):
+        """Seconds until `amount` units are available (0 if they are available now)."""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount):
+        self.tokens -= min(amount, self.capacity)
+
+    def drain(self, seconds):
+        """Empties the bucket for `seconds` after a throttle so everyone backs off together (does not stack)."""
+        self._refill()
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+class BedrockScheduler:
+    """
+    Admits Bedrock calls against request and token buckets sized to the account quotas.
+    Waiting callers are served by priority, then FIFO. Throttled calls are retried with
+    jittered exponential backoff.
+    """
+
+    def __init__(self, requests_per_minute=BEDROCK_REQUESTS_PER_MINUTE, tokens_per_minute=BEDROCK_TOKENS_PER_MINUTE,
+                 burst_seconds=BURST_SECONDS, max_queue_wait=MAX_QUEUE_WAIT_SECONDS, max_retries=MAX_THROTTLE_RETRIES):
+        self.requests = TokenBucket(requests_per_minute / 60.0, max(1.0, requests_per_minute / 60.0 * burst_seconds))
+        self.tokens = TokenBucket(tokens_per_minute / 60.0, tokens_per_minute / 60.0 * burst_seconds)
+        self.max_queue_wait = max_queue_wait
+        self.max_retries = max_retries
+        self._cond = threading.Condition()
+        self._queue = []  # ✅ heap of (priority, sequence)
+        self._sequence = itertools.count()
+        # ✅ Counters for metrics
+        self.admitted = 0
+        self.throttled = 0
+        self.timeouts = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    @property
+    def queue_depth(self):
+        return len(self._queue)
+
+    def acquire(self, estimated_tokens, priority=None, timeout=None):
+        """Blocks until the call may be sent. Returns the seconds spent waiting."""
+        priority = current_priority() if priority is None else priority
+        timeout = self.max_queue_wait if timeout is None else timeout
+        started = time.monotonic()
+        ticket = (priority, next(self._sequence))
+        with self._cond:
+            heapq.heappush(self._queue, ticket)
+            try:
+                while True:
+                    remaining = started + timeout - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise QueueTimeout(f"waited {timeout:.1f}s for Bedrock quota")
+                    if self._queue[0] == ticket:
+                        wait = max(self.requests.wait_time(1), self.tokens.wait_time(estimated_tokens))
+                        if wait == 0:
+                            self.requests.take(1)
+                            self.tokens.take(estimated_tokens)
+                            break
+                        self._cond.wait(min(wait, remaining))
+                    else:
+                        self._cond.wait(remaining)
+            finally:
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+                self._cond.notify_all()  # ✅ Next in line re-checks the buckets
+
+            waited = time.monotonic() - started
+            self.admitted += 1
+            self.total_wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        return waited
+
+    def _on_throttled(self, attempt):
+        with self._cond:
+            self.throttled += 1
+            self.requests.drain(backoff_delay(attempt))
+            self._cond.notify_all()
+
+    def call(self, fn, estimated_tokens, priority=None, trace=None, stage="bedrock", max_retries=None):
+        """
+        Runs `fn()` once quota is available, retrying ThrottlingException with jittered
+        exponential backoff. Queue wait and retries are recorded on `trace` when given.
+        Pass `max_retries=0` when the caller has somewhere else to send the request.
+        """
+        max_retries = self.max_retries if max_retries is None else max_retries
+        waited_total = 0.0
+        for attempt in range(max_retries + 1):
+            waited_total += self.acquire(estimated_tokens, priority)
+            try:
+                result = fn()
+            except Exception as e:
+                if not is_throttling_error(e) or attempt == max_retries:
+                    raise
+                delay = backoff_delay(attempt)
+                logger.warning("⚠️ %s throttled, retrying in %.2fs (attempt %d)", stage, delay, attempt + 1)
+                self._on_throttled(attempt)
+                if trace is not None:
+                    trace.add(f"{stage}_throttle_retries")
+                time.sleep(delay)
+                waited_total += delay
+                continue
+            if trace is not None:
+                trace.set(f"{stage}_queue_wait", waited_total)
+            return result
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queue_depth": len(self._queue),
+                "admitted": self.admitted,
+                "throttled": self.throttled,
+                "timeouts": self.timeouts,
+                "average_wait_seconds": self.total_wait_seconds / self.admitted if self.admitted else 0.0,
+                "max_wait_seconds": self.max_wait_seconds,
+            }
@@ -0,0 +1,133 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import uuid
+
+import genailib
+from asyncchat import AsyncChatEngine
+from citations import CitationCollector
+
+# ⚡ Headless HTTP / Server-Sent Events API for the mobile app
+#   POST /chat    {"session_id": "...", "message": "..."}  ->  text/event-stream
+#   POST /reset   {"session_id": "..."}                     ->  204
+#   GET  /healthz                                           ->  200 {"active_chats": n}
+SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "8080"))
+MAX_BODY_BYTES = 64 * 1024
+HEADER_TIMEOUT_SECONDS = 10
+
+logger = logging.getLogger("server")
+
+_REASONS = {200: "OK", 204: "No Content", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large"}
+
+async def _read_request(reader):
+    """Parses the request line, headers and body. Returns (method, path, headers, body)."""
+    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), HEADER_TIMEOUT_SECONDS)
+    lines = head.decode("latin-1").split("\r\n")
+    method, path, _ = lines[0].split(" ", 2)
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", "0"))
+    if length > MAX_BODY_BYTES:
+        raise ValueError("body too large")
+    body = await reader.readexactly(length) if length else b""
+    return method, path.split("?", 1)[0], headers, body
+
+def _response_head(status, content_type, extra_headers=()):
+    lines = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}", f"Content-Type: {content_type}", "Connection: close"]
+    lines.extend(extra_headers)
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("utf-8")
+
+async def _send_json(writer, status, payload):
+    body = json.dumps(payload).encode("utf-8")
+    writer.write(_response_head(status, "application/json", [f"Content-Length: {len(body)}"]) + body)
+    await writer.drain()
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+
+class ChatServer:
+    """Minimal asyncio HTTP server streaming chat answers as Server-Sent Events."""
+
+    def __init__(self, engine=None):
+        self.engine = engine or AsyncChatEngine()
+
+    async def handle(self, reader, writer):
+        try:
+            try:
+                method, path, headers, body = await _read_request(reader)
+                payload = json.loads(body or b"{}")
+                if not isinstance(payload, dict):
+                    raise ValueError("request body must be a JSON object")
+            except ValueError as e:
+                await _send_json(writer, 400, {"error": str(e)})
+                return
+
+            if method == "GET" and path == "/healthz":
+                await _send_json(writer, 200, {"active_chats": self.engine.active_chats})
+            elif method == "POST" and path == "/chat":
+                await self._chat(writer, payload)
+            elif method == "POST" and path == "/reset":
+                self.engine.reset(str(payload.get("session_id", "")))
+                writer.write(_response_head(204, "text/plain", ["Content-Length: 0"]))
+                await writer.drain()
+            else:
+                await _send_json(writer, 404, {"error": "not found"})
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass  # ✅ Client went away, the chat stream has already been closed
+        except Exception:
+            logger.exception("❌ Request failed")
+        finally:
+            writer.close()
+            with contextlib.suppress(Exception):
+                await writer.wait_closed()
+
+    async def _chat(self, writer, payload):
+        message = str(payload.get("message", "")).strip()
+        if not message:
+            await _send_json(writer, 400, {"error": "message is required"})
+            return
+        session_id = str(payload.get("session_id") or uuid.uuid4())
+
+        writer.write(_response_head(200, "text/event-stream", ["Cache-Control: no-cache", "X-Accel-Buffering: no"]))
+        writer.write(_sse("session", {"session_id": session_id}))
+        await writer.drain()
+
+        # ✅ aclosing() makes a disconnect (drain raising) cancel the upstream streams immediately
+        citations = CitationCollector()
+        async with contextlib.aclosing(self.engine.chat(session_id, message, citations)) as chunks:
+            async for text_chunk in chunks:
+                writer.write(_sse("token", {"text": text_chunk}))
+                await writer.drain()
+        if citations:
+            writer.write(_sse("citations", {"citations": citations.citations}))
+        writer.write(_sse("done", {}))
+        await writer.drain()
+
+    async def serve(self, host=SERVER_HOST, port=SERVER_PORT):
+        # ✅ Clients and index are ready before the port opens, so the first chat is not the slow one
+        await asyncio.to_thread(genailib.warm_up)
+        server = await asyncio.start_server(self.handle, host, port, limit=MAX_BODY_BYTES)
+        logger.info("🟢 Herdbot API listening on %s:%s", host, port)
+        async with server:
+            await server.serve_forever()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless Herdbot chat API (HTTP + Server-Sent Events).")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--max-concurrent-chats", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    engine = AsyncChatEngine(args.max_concurrent_chats) if args.max_concurrent_chats else AsyncChatEngine()
+    asyncio.run(ChatServer(engine).serve(args.host, args.port))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+import contextvars
+import logging
+import threading
+
+from cancellation import CANCEL_DONE, CancelToken
+
+logger = logging.getLogger("singleflight")
+
+class _Flight:
+    """One upstream stream plus everything it has produced so far."""
+
+    def __init__(self, key):
+        self.key = key
+        self.chunks = []
+        self.done = False
+        self.subscribers = 0
+        self.cancel_event = CancelToken.with_timeout()  # ✅ Backstop deadline, subscribers have their own
+        self.cond = threading.Condition()
+        self.task = None  # ✅ Async producer task (astream), kept referenced while it runs
+        self._async_waiters = []  # ✅ (loop, asyncio.Event) of async subscribers waiting for data
+
+    def publish(self, chunk=None, done=False):
+        with self.cond:
+            if chunk is not None:
+                self.chunks.append(chunk)
+            self.done = self.done or done
+            self.cond.notify_all()
+            waiters, self._async_waiters = self._async_waiters, []
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+class SingleFlight:
+    """
+    Coalesces identical in-flight streams: the first caller for a key starts the upstream
+    stream (on its own thread for stream(), as a task on the event loop for astream()),
+    every concurrent caller with the same key subscribes to it.
+    Late joiners get the buffered prefix replayed, then continue live. The upstream is
+    cancelled once every subscriber has gone away.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key, start):
+        """Returns (flight, is_leader); the leader starts the upstream with `start(flight)`."""
+        with self._lock:
+            flight = self._flights.get(key)
+            is_leader = flight is None
+            if is_leader:
+                flight = self._flights[key] = _Flight(key)
+            flight.subscribers += 1
+        if is_leader:
+            start(flight)
+        else:
+            logger.info("⚡ Joined in-flight stream %s (%d subscribers)", key[:12], flight.subscribers)
+        return flight, is_leader
+
+    def _start_thread(self, stream_factory):
+        """One dedicated thread per flight: a bounded pool would queue new chats behind long answers."""
+        def start(flight):
+            context = contextvars.copy_context()
+            threading.Thread(
+                target=context.run, args=(self._produce, flight, stream_factory),
+                name=f"single-flight-{flight.key[:12]}", daemon=True
+            ).start()
+        return start
+
+    def _produce(self, flight, stream_factory):
+        stream = None
+        try:
+            stream = stream_factory(flight.cancel_event)
+            for chunk in stream:
+                if flight.cancel_event.is_set():
+                    break
+                flight.publish(chunk)
+        except Exception as e:
+            logger.warning("⚠️ In-flight stream %s failed: %s", flight.key[:12], e)
+        finally:
+            if stream is not None and hasattr(stream, "close"):
+                stream.close()  # ✅ Runs the upstream generator's cleanup (closes the EventStream)
+            self._finish(flight)
+
+    async def _aproduce(self, flight, stream_factory):
+        stream = None
+        try:
+            stream = stream_factory(flight.cancel_event)
+            async for chunk in stream:
+                if flight.cancel_event.is_set():
+                    break
+                flight.publish(chunk)
+        except Exception as e:
+            logger.warning("⚠️ In-flight stream %s failed: %s", flight.key[:12], e)
+        finally:
+            if stream is not None:
+                await stream.aclose()
+            self._finish(flight)
+
+    def _finish(self, flight):
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+        flight.publish(done=True)
+        flight.cancel_event.cancel(CANCEL_DONE)
+
+    def _leave(self, flight):
+        with self._lock:
+            flight.subscribers -= 1
+            abandoned = flight.subscribers == 0 and not flight.done
+            if abandoned and self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]  # ✅ New callers must not join a cancelled flight
+        if abandoned:
+            flight.cancel_event.cancel("abandoned")  # ✅ Closes the upstream EventStream(s) right away
+
+    def stream(self, key, stream_factory, on_join=None, cancel=None):
+        """
+        Yields the chunks of `stream_factory(cancel_event)` for `key`, sharing one upstream run
+        between concurrent callers. `on_join(is_leader)` is called once the caller has subscribed.
+        Cancelling `cancel` (a CancelToken) unsubscribes this caller; the upstream is cancelled
+        once no subscriber is left.
+        """
+        flight, is_leader = self._join(key, self._start_thread(stream_factory))
+        if on_join is not None:
+            on_join(is_leader)
+        wake_id = _wake_on_cancel(cancel, flight)
+        index = 0
+        try:
+            while True:
+                with flight.cond:
+                    while index >= len(flight.chunks) and not flight.done and not _cancelled(cancel):
+                        flight.cond.wait()
+                    if _cancelled(cancel):
+                        return
+                    new_chunks = flight.chunks[index:]
+                    done = flight.done
+                index += len(new_chunks)
+                for chunk in new_chunks:
+                    yield chunk
+                if done and index >= len(flight.chunks):
+                    return
+        finally:
+            if wake_id is not None:
+                cancel.remove_callback(wake_id)
+            self._leave(flight)
+
+    async def astream(self, key, stream_factory, on_join=None, cancel=None):
+        """
+        Async counterpart of stream(): `stream_factory(cancel_event)` returns an async iterator,
+        which the leader runs as a task on this event loop, so coalescing takes no worker thread.
+        """
+        import asyncio  # ✅ Only async callers pay for it
+
+        loop = asyncio.get_running_loop()
+
+        def start(flight):
+            flight.task = loop.create_task(self._aproduce(flight, stream_factory))
+
+        flight, is_leader = self._join(key, start)
+        if on_join is not None:
+            on_join(is_leader)
+        wake_id = _wake_on_cancel(cancel, flight)
+        index = 0
+        try:
+            while True:
+                event = None
+                if _cancelled(cancel):
+                    return
+                with flight.cond:
+                    new_chunks = flight.chunks[index:]
+                    done = flight.done
+                    if not new_chunks and not done:
+                        event = asyncio.Event()
+                        flight._async_waiters.append((loop, event))
+                if event is not None:
+                    await event.wait()
+                    continue
+                index += len(new_chunks)
+                for chunk in new_chunks:
+                    yield chunk
+                if done and index >= len(flight.chunks):
+                    return
+        finally:
+            if wake_id is not None:
+                cancel.remove_callback(wake_id)
+            self._leave(flight)
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._flights)
+
+def _cancelled(cancel):
+    return cancel is not None and cancel.is_set()
+
+def _wake_on_cancel(cancel, flight):
+    """Wakes the subscriber waiting on `flight` when its own token is cancelled."""
+    if cancel is None:
+        return None
+    return cancel.on_cancel(lambda reason: flight.publish())
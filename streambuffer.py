@@ -0,0 +1,53 @@
+import os
+import time
+
+# ⚡ Streaming Render Configuration
+RENDER_INTERVAL_SECONDS = float(os.getenv("RENDER_INTERVAL_SECONDS", "0.05"))
+RENDER_MIN_CHARS = int(os.getenv("RENDER_MIN_CHARS", "400"))  # ✅ Flush early when this much new text is waiting
+
+class StreamBuffer:
+    """
+    List-backed text buffer shared along the streaming pipeline.
+    Chunks are appended in O(1); text() joins only what arrived since the last call.
+    """
+    __slots__ = ("_chunks", "_length")
+
+    def __init__(self):
+        self._chunks = []
+        self._length = 0
+
+    def append(self, chunk):
+        if chunk:
+            self._chunks.append(chunk)
+            self._length += len(chunk)
+
+    def text(self):
+        if len(self._chunks) > 1:
+            self._chunks[:] = ["".join(self._chunks)]  # ✅ Collapse so the next join is cheap
+        return self._chunks[0] if self._chunks else ""
+
+    def __len__(self):
+        return self._length
+
+    def __bool__(self):
+        return self._length > 0
+
+def render_stream(chunks, buffer, render, interval=RENDER_INTERVAL_SECONDS, min_chars=RENDER_MIN_CHARS):
+    """
+    Drains `chunks` (whose producer fills `buffer`) and calls `render(text)` at most once
+    per `interval` seconds, or sooner once `min_chars` new characters are waiting.
+    Always renders the final text. Returns the full text.
+    """
+    last_render = time.monotonic()
+    rendered_length = 0
+    for _ in chunks:
+        now = time.monotonic()
+        if now - last_render >= interval or len(buffer) - rendered_length >= min_chars:
+            render(buffer.text())
+            last_render = now
+            rendered_length = len(buffer)
+
+    text = buffer.text()
+    if len(buffer) != rendered_length or not rendered_length:
+        render(text)
+    return text
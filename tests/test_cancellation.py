@@ -0,0 +1,92 @@
+import time
+
+from cancellation import CANCEL_DEADLINE, CancelToken, close_on_cancel, is_cancelled
+
+class FakeStream:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+def test_cancel_runs_callbacks_once_with_the_reason():
+    token = CancelToken()
+    reasons = []
+    token.on_cancel(reasons.append)
+    assert token.cancel("hedge_lost")
+    assert not token.cancel("done")
+    assert reasons == ["hedge_lost"]
+    assert token.reason == "hedge_lost"
+    assert token.is_set()
+
+def test_callback_registered_after_cancel_runs_at_once():
+    token = CancelToken()
+    token.cancel("done")
+    reasons = []
+    assert token.on_cancel(reasons.append) is None
+    assert reasons == ["done"]
+
+def test_removed_callback_is_not_called():
+    token = CancelToken()
+    reasons = []
+    callback_id = token.on_cancel(reasons.append)
+    token.remove_callback(callback_id)
+    token.cancel()
+    assert reasons == []
+
+def test_failing_callback_does_not_stop_the_others():
+    token = CancelToken()
+    reasons = []
+    token.on_cancel(lambda reason: 1 / 0)
+    token.on_cancel(reasons.append)
+    token.cancel("done")
+    assert reasons == ["done"]
+
+def test_children_are_cancelled_with_their_parent():
+    parent = CancelToken()
+    child = parent.child()
+    grandchild = CancelToken(parent=child)
+    parent.cancel("consumer_closed")
+    assert child.reason == "consumer_closed"
+    assert grandchild.reason == "consumer_closed"
+
+def test_cancelling_a_child_leaves_the_parent_alone():
+    parent = CancelToken()
+    child = parent.child()
+    child.cancel("hedge_lost")
+    assert not parent.is_set()
+
+def test_child_inherits_the_earlier_deadline():
+    parent = CancelToken.with_timeout(60)
+    assert CancelToken.with_timeout(600, parent=parent).deadline == parent.deadline
+    assert CancelToken.with_timeout(1, parent=parent).deadline < parent.deadline
+    parent.cancel()
+
+def test_deadline_cancels_the_token():
+    token = CancelToken.with_timeout(0.05)
+    assert token.wait(2)
+    assert token.reason == CANCEL_DEADLINE
+    assert token.remaining() == 0.0
+
+def test_no_deadline():
+    token = CancelToken.with_timeout(0)
+    assert token.deadline is None
+    assert token.remaining() is None
+    time.sleep(0.01)
+    assert not token.is_set()
+
+def test_close_on_cancel_closes_the_stream():
+    token = CancelToken()
+    stream = FakeStream()
+    close_on_cancel(token, stream)
+    assert not stream.closed
+    token.cancel()
+    assert stream.closed
+
+def test_event_compatibility():
+    assert not is_cancelled(None)
+    token = CancelToken()
+    assert not is_cancelled(token)
+    token.set()
+    assert is_cancelled(token)
+    assert token.reason == "cancelled"
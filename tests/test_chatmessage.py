@@ -0,0 +1,49 @@
+import os
+
+from chatmessage import ChatLog, ChatMessage
+
+def _texts(messages):
+    return [message.text for message in messages]
+
+def test_append_and_load_recent_in_order(tmp_path):
+    log = ChatLog("session-1", str(tmp_path))
+    log.append(ChatMessage("user", "Hello"))
+    log.append([ChatMessage("assistant", "Hi there", [{"text": "", "links": []}]), ChatMessage("user", "Bye")])
+    messages = log.load_recent()
+    assert _texts(messages) == ["Hello", "Hi there", "Bye"]
+    assert messages[1].citations == [{"text": "", "links": []}]
+    assert _texts(log.load_recent(2)) == ["Hi there", "Bye"]
+    assert log.load_recent(0) == []
+
+def test_missing_log_loads_nothing(tmp_path):
+    log = ChatLog("new", str(tmp_path))
+    assert not log.exists()
+    assert log.load_recent() == []
+
+def test_tail_is_read_across_many_blocks(tmp_path):
+    log = ChatLog("long", str(tmp_path))
+    log.append([ChatMessage("user", f"message {i} " + "x" * 200) for i in range(2000)])
+    messages = log.load_recent(50)
+    assert len(messages) == 50
+    assert messages[0].text.startswith("message 1950 ")
+    assert messages[-1].text.startswith("message 1999 ")
+
+def test_truncated_last_line_is_skipped_and_not_glued_onto(tmp_path):
+    log = ChatLog("crashed", str(tmp_path))
+    log.append([ChatMessage("user", "Question"), ChatMessage("assistant", "Answer")])
+    with open(log.path, "ab") as f:
+        f.write(b'{"role":"user","text":"cut o')  # ✅ Crash mid-write
+    assert _texts(log.load_recent()) == ["Question", "Answer"]
+    log.append(ChatMessage("user", "After the crash"))
+    assert _texts(log.load_recent()) == ["Question", "Answer", "After the crash"]
+
+def test_session_id_cannot_escape_the_log_dir(tmp_path):
+    log = ChatLog("../../etc/passwd", str(tmp_path))
+    assert os.path.dirname(log.path) == str(tmp_path)
+
+def test_clear_deletes_the_log(tmp_path):
+    log = ChatLog("session", str(tmp_path))
+    log.append(ChatMessage("user", "Hello"))
+    log.clear()
+    assert not log.exists()
+    log.clear()  # ✅ Clearing twice is fine
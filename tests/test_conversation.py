@@ -0,0 +1,61 @@
+from chatmessage import ChatMessage
+from conversation import ConversationWindow, estimate_tokens
+
+def _turns(count, words=20):
+    messages = []
+    for i in range(count):
+        messages.append(ChatMessage("user", f"Question {i}. " + "word " * words))
+        messages.append(ChatMessage("assistant", f"Answer {i}. " + "word " * words))
+    return messages
+
+def test_window_stays_under_the_token_budget():
+    window = ConversationWindow.from_messages(_turns(50), token_budget=200)
+    assert window.token_count <= 200
+    assert window.token_count == sum(estimate_tokens(message.text) for message in window.messages())
+    assert window.messages()[-1].text.startswith("Answer 49.")
+
+def test_newest_turn_is_kept_even_over_budget():
+    window = ConversationWindow(token_budget=5)
+    window.append(ChatMessage("user", "word " * 100))
+    assert len(window) == 1
+
+def test_window_never_starts_on_an_assistant_turn():
+    window = ConversationWindow.from_messages(_turns(20), token_budget=150)
+    assert window.messages()[0].role == "user"
+    window.append(ChatMessage("assistant", "An answer with no question left in the window. " + "word " * 200))
+    assert len(window) == 1
+
+def test_blank_messages_are_ignored():
+    window = ConversationWindow()
+    window.append(ChatMessage("user", "   "))
+    window.append(ChatMessage("assistant", ""))
+    assert len(window) == 0
+
+def test_evicted_turns_are_folded_into_the_summary():
+    window = ConversationWindow.from_messages(_turns(10), token_budget=100)
+    summary_lines = window.summary.splitlines()
+    assert summary_lines[0] == "user: Question 0."  # ✅ First sentence only
+    assert "assistant: Answer 0." in summary_lines
+
+def test_summary_is_trimmed_to_its_budget():
+    window = ConversationWindow.from_messages(_turns(200), token_budget=100, summary_token_budget=30)
+    assert 0 < sum(estimate_tokens(line) for line in window.summary.splitlines()) <= 30
+    assert "Question 0." not in window.summary
+
+def test_no_summary_when_summarizing_is_off():
+    window = ConversationWindow.from_messages(_turns(10), token_budget=100, summarize=False)
+    assert window.summary == ""
+
+def test_snapshot_does_not_see_later_turns():
+    window = ConversationWindow.from_messages(_turns(2))
+    snapshot = window.snapshot()
+    window.append(ChatMessage("user", "A later question"))
+    assert len(snapshot) == 4
+    assert len(window) == 5
+
+def test_payload_formats():
+    window = ConversationWindow.from_messages(_turns(10, words=0), token_budget=20)
+    assert window.claude_messages()[-1] == {"role": "assistant", "content": "Answer 9. "}
+    assert window.kb_history_text().startswith("Summary of earlier conversation:\n")
+    assert window.recent(2) == window.messages()[-2:]
+    assert window.recent(0) == []
@@ -0,0 +1,83 @@
+import json
+
+import pytest
+
+import fakebedrock
+from eventstream import JSONStreamDecoder, iter_payloads
+
+def _frame(payload):
+    return json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+def test_one_object_per_chunk_uses_the_fast_path():
+    decoder = JSONStreamDecoder()
+    assert decoder.feed(_frame({"a": 1})) == [{"a": 1}]
+    assert decoder.feed(_frame({"b": 2})) == [{"b": 2}]
+    assert decoder.dropped == 0
+
+def test_object_split_across_chunks():
+    decoder = JSONStreamDecoder()
+    data = _frame({"type": "content_block_delta", "delta": {"text": "hello"}})
+    assert decoder.feed(data[:10]) == []
+    assert decoder.feed(data[10:25]) == []
+    assert decoder.feed(data[25:]) == [{"type": "content_block_delta", "delta": {"text": "hello"}}]
+
+def test_several_objects_packed_into_one_chunk():
+    decoder = JSONStreamDecoder()
+    data = _frame({"a": 1}) + _frame({"b": [1, 2]}) + _frame({"c": {}})[:4]
+    assert decoder.feed(data) == [{"a": 1}, {"b": [1, 2]}]
+    assert decoder.feed(_frame({"c": {}})[4:]) == [{"c": {}}]
+
+def test_braces_and_escapes_inside_strings():
+    payload = {"text": 'a "quoted" {brace} [bracket] back\\slash'}
+    data = _frame(payload)
+    for i in range(len(data)):  # ✅ Every split point, including one right after a backslash
+        decoder = JSONStreamDecoder()
+        objects = decoder.feed(data[:i]) + decoder.feed(data[i:])
+        assert objects == [payload], i
+    assert decoder.dropped == 0
+
+def test_multibyte_utf8_split_across_chunks():
+    data = _frame({"text": "€ café 🐄"})
+    euro = data.index("€".encode("utf-8"))
+    decoder = JSONStreamDecoder()
+    assert decoder.feed(data[:euro + 1]) == []
+    assert decoder.feed(data[euro + 1:]) == [{"text": "€ café 🐄"}]
+
+def test_garbage_between_frames_is_dropped_and_counted():
+    decoder = JSONStreamDecoder()
+    assert decoder.feed(b'{"a": 1') == []
+    assert decoder.feed(b'} junk {"b": 2}') == [{"a": 1}, {"b": 2}]
+    assert decoder.dropped == 1
+
+def test_non_object_values_are_not_returned():
+    decoder = JSONStreamDecoder()
+    assert decoder.feed(b"[1, 2]") == []
+
+def test_frame_that_never_completes_is_dropped():
+    decoder = JSONStreamDecoder(max_pending_chars=32)
+    assert decoder.feed(b'{"text": "' + b"x" * 64) == []
+    assert decoder.dropped == 1
+    assert decoder.feed(_frame({"a": 1})) == [{"a": 1}]
+
+def test_close_reports_a_trailing_incomplete_frame():
+    decoder = JSONStreamDecoder()
+    decoder.feed(b'{"a": ')
+    decoder.close()
+    assert decoder.dropped == 1
+    assert decoder.feed(_frame({"b": 2})) == [{"b": 2}]
+
+def test_iter_payloads_passes_structured_events_through():
+    events = [
+        {"chunk": {"bytes": _frame({"outputText": "hi"})}},
+        {"citation": {"retrievedReferences": []}},
+        {},
+    ]
+    assert list(iter_payloads(events)) == [{"outputText": "hi"}, {"citation": {"retrievedReferences": []}}]
+
+@pytest.mark.parametrize("frame_bytes", [1, 2, 3, 7, 16, 64, 1000])
+def test_rechunked_stream_decodes_to_the_same_payloads(frame_bytes):
+    payloads = [{"type": "content_block_delta", "delta": {"text": f"token {i} \"€\" "}} for i in range(20)]
+    events = [{"chunk": {"bytes": _frame(payload)}} for payload in payloads]
+    decoder = JSONStreamDecoder()
+    assert list(iter_payloads(fakebedrock.rechunk(events, frame_bytes), decoder)) == payloads
+    assert decoder.dropped == 0
@@ -0,0 +1,71 @@
+from chatmessage import ChatMessage
+from citations import CitationChunk
+from responsecache import LRUCache, ResponseCache, SQLiteCache, _decode, cache_key, normalize_prompt, replay_stream
+
+HISTORY = [ChatMessage("user", "What is SCEP?"), ChatMessage("assistant", "The Suckler Carbon Efficiency Programme.")]
+CITATIONS = [{"text": "", "links": [{"text": "Scep terms", "url": "https://example.com/scep"}]}]
+
+def test_trivial_prompt_variants_share_a_key():
+    assert normalize_prompt("  When is the SCEP deadline?! ") == "when is the scep deadline"
+    assert cache_key("When is the SCEP deadline?", HISTORY) == cache_key("when is the scep deadline", HISTORY)
+
+def test_key_covers_the_whole_conversation_context():
+    other_session = [ChatMessage("user", "Something else entirely")] + HISTORY
+    assert cache_key("And the deadline?", HISTORY) != cache_key("And the deadline?", other_session)
+    assert cache_key("And the deadline?", HISTORY) != cache_key("And the deadline?", HISTORY, summary="user: earlier")
+    assert cache_key("And the deadline?", HISTORY) == cache_key("And the deadline?", list(HISTORY))
+
+def test_lru_evicts_the_least_recently_used_entry():
+    cache = LRUCache(max_entries=2, ttl_seconds=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # ✅ "a" is now the most recently used
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert len(cache) == 2
+
+def test_lru_entries_expire():
+    cache = LRUCache(max_entries=2, ttl_seconds=-1)
+    cache.set("a", 1)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+def test_sqlite_cache_evicts_and_expires(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "cache.db"), max_entries=2, ttl_seconds=60)
+    for key in ("a", "b", "c"):
+        cache.set(key, key.upper())
+    assert cache.get("a") is None
+    assert cache.get("c") == "C"
+    expired = SQLiteCache(str(tmp_path / "expired.db"), ttl_seconds=-1)
+    expired.set("a", "A")
+    assert expired.get("a") is None
+
+def test_answers_keep_their_citations():
+    cache = ResponseCache(max_entries=4, ttl_seconds=60, db_path="")
+    cache.put("What is SCEP?", HISTORY, "An answer.", citations=CITATIONS)
+    cached = cache.get("what is scep", HISTORY)
+    assert cached.answer == "An answer."
+    assert cached.citations == CITATIONS
+    assert cache.get("What is SCEP?", HISTORY[:1]) is None
+
+def test_disk_hits_are_promoted_to_memory(tmp_path):
+    path = str(tmp_path / "responses.db")
+    ResponseCache(db_path=path).put("What is SCEP?", HISTORY, "From disk.")
+    cache = ResponseCache(db_path=path)
+    assert len(cache.memory) == 0
+    assert cache.get("What is SCEP?", HISTORY).answer == "From disk."
+    assert len(cache.memory) == 1
+
+def test_plain_text_values_from_older_caches_still_load():
+    assert _decode("An old answer.") == ("An old answer.", None)
+    assert _decode('"a json string"') == ('"a json string"', None)
+
+def test_replay_stream_rebuilds_the_answer_then_sends_citations():
+    text = "Keep your herd register up to date and record every movement."
+    chunks = list(replay_stream(text, CITATIONS))
+    assert "".join(chunks) == text
+    assert len(chunks) > 2
+    assert isinstance(chunks[-1], CitationChunk)
+    assert chunks[-1].citations == CITATIONS
+    assert not any(isinstance(chunk, CitationChunk) for chunk in replay_stream(text))
@@ -0,0 +1,51 @@
+import json
+
+from chatmessage import ChatMessage
+from router import FAQ, ROUTE_DIRECT, ROUTE_FAQ, ROUTE_KB, QueryRouter, corpus_terms
+
+FAQ_ENTRIES = [{"question": "How do I register a calf?", "answer": "Use the Calf Registration screen."}]
+
+def _router(**kwargs):
+    return QueryRouter(faq=FAQ(FAQ_ENTRIES), **kwargs)
+
+def test_faq_matches_exactly_and_by_word_overlap():
+    faq = FAQ(FAQ_ENTRIES, min_similarity=0.8)
+    assert faq.match("how do I register a calf") == "Use the Calf Registration screen."
+    assert faq.match("How do I register a calf please?") == "Use the Calf Registration screen."
+    assert faq.match("How do I sell a calf?") is None
+    assert faq.match("?!") is None
+
+def test_faq_file_is_optional(tmp_path):
+    assert len(FAQ.load(str(tmp_path / "missing.json"))) == 0
+    path = tmp_path / "faq.json"
+    path.write_text(json.dumps(FAQ_ENTRIES), encoding="utf-8")
+    assert len(FAQ.load(str(path))) == 1
+
+def test_faq_route_carries_the_answer():
+    decision = _router().route("How do I register a calf?")
+    assert decision.route == ROUTE_FAQ
+    assert decision.answer == "Use the Calf Registration screen."
+
+def test_policy_questions_go_to_the_kb():
+    assert _router().route("What is the deadline for the ACRES payment?").route == ROUTE_KB
+
+def test_document_names_add_kb_terms_but_not_general_words():
+    terms = corpus_terms({"beef_finisher_payment.pdf": "https://example.com"})
+    assert "finisher" in terms
+    assert "beef" not in terms
+    assert _router(kb_terms=terms).route("When is the finisher paid?").route == ROUTE_KB
+    assert _router(kb_terms=terms).route("How much do beef cattle eat?").route == ROUTE_DIRECT
+
+def test_general_questions_go_direct_and_short_ones_to_the_fast_model():
+    router = _router(fast_model_id="fast-model", fast_model_max_words=5)
+    long_question = router.route("How should I prepare the shed before the calving season starts this year?")
+    assert (long_question.route, long_question.reason, long_question.model_id) == (ROUTE_DIRECT, "general", None)
+    short_question = router.route("Best grass for cows?")
+    assert (short_question.route, short_question.model_id) == (ROUTE_DIRECT, "fast-model")
+
+def test_follow_ups_inherit_the_previous_question_topic():
+    history = [ChatMessage("user", "What are the TAMS grant rates?"), ChatMessage("assistant", "They are ...")]
+    router = _router(fast_model_id="fast-model")
+    decision = router.route("Is it paid yearly?", history)
+    assert decision.route == ROUTE_KB
+    assert router.route("Is it paid yearly?").route == ROUTE_DIRECT
@@ -0,0 +1,131 @@
+import threading
+import time
+
+import pytest
+
+import scheduler
+from scheduler import (PRIORITY_BATCH, PRIORITY_INTERACTIVE, BedrockScheduler, QueueTimeout, TokenBucket, backoff_delay,
+                       is_throttling_error, priority)
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class ClientError(Exception):
+    def __init__(self, code):
+        super().__init__(code)
+        self.response = {"Error": {"Code": code}}
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(scheduler.time, "monotonic", clock)
+    return clock
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(scheduler, "backoff_delay", lambda attempt, **kwargs: 0.0)
+
+def test_token_bucket_starts_full_and_refills(clock):
+    bucket = TokenBucket(rate=2.0, capacity=4.0)
+    assert bucket.wait_time(4) == 0.0
+    bucket.take(4)
+    assert bucket.wait_time(1) == pytest.approx(0.5)
+    clock.now += 1.0
+    assert bucket.wait_time(2) == 0.0
+    clock.now += 100.0
+    bucket.wait_time(0)
+    assert bucket.tokens == 4.0  # ✅ Never above capacity
+
+def test_token_bucket_clamps_requests_larger_than_capacity(clock):
+    bucket = TokenBucket(rate=1.0, capacity=10.0)
+    assert bucket.wait_time(50) == 0.0  # ✅ An oversized request waits for a full bucket, not forever
+    bucket.take(50)
+    assert bucket.tokens == 0.0
+
+def test_token_bucket_drain_makes_everyone_wait(clock):
+    bucket = TokenBucket(rate=1.0, capacity=10.0)
+    bucket.drain(3.0)
+    assert bucket.wait_time(1) == pytest.approx(4.0)
+    bucket.drain(1.0)  # ✅ Does not stack with the previous drain
+    assert bucket.wait_time(1) == pytest.approx(4.0)
+
+def test_backoff_delay_is_full_jitter_under_the_cap():
+    for attempt in range(10):
+        for _ in range(50):
+            delay = backoff_delay(attempt, base=0.5, cap=8.0)
+            assert 0.0 <= delay <= min(8.0, 0.5 * 2 ** attempt)
+
+def test_is_throttling_error():
+    assert is_throttling_error(ClientError("ThrottlingException"))
+    assert is_throttling_error(ClientError("ServiceQuotaExceededException"))
+    assert not is_throttling_error(ClientError("ValidationException"))
+    assert not is_throttling_error(ValueError("no response"))
+
+def test_call_retries_throttling_then_succeeds(no_backoff):
+    bedrock = BedrockScheduler(1e6, 1e12)
+    attempts = []
+
+    def request():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ClientError("ThrottlingException")
+        return "ok"
+
+    assert bedrock.call(request, 10) == "ok"
+    assert len(attempts) == 3
+    assert bedrock.throttled == 2
+
+def test_call_with_max_retries_zero_fails_over_at_once(no_backoff):
+    bedrock = BedrockScheduler(1e6, 1e12)
+    attempts = []
+
+    def request():
+        attempts.append(1)
+        raise ClientError("ThrottlingException")
+
+    with pytest.raises(ClientError):
+        bedrock.call(request, 10, max_retries=0)
+    assert len(attempts) == 1
+
+def test_call_does_not_retry_other_errors(no_backoff):
+    bedrock = BedrockScheduler(1e6, 1e12)
+    attempts = []
+
+    def request():
+        attempts.append(1)
+        raise ClientError("ValidationException")
+
+    with pytest.raises(ClientError):
+        bedrock.call(request, 10)
+    assert len(attempts) == 1
+
+def test_acquire_times_out_when_the_quota_is_used_up():
+    bedrock = BedrockScheduler(requests_per_minute=1, tokens_per_minute=1e9)
+    bedrock.acquire(1)
+    with pytest.raises(QueueTimeout):
+        bedrock.acquire(1, timeout=0.05)
+    assert bedrock.timeouts == 1
+    assert bedrock.queue_depth == 0
+
+def test_waiting_interactive_calls_go_before_batch_calls():
+    bedrock = BedrockScheduler(requests_per_minute=120, tokens_per_minute=1e9, burst_seconds=0.5)  # ✅ One request per 0.5 s
+    bedrock.acquire(1)
+    order = []
+
+    def wait(level):
+        with priority(level):
+            bedrock.acquire(1, timeout=5)
+        order.append(level)
+
+    batch = threading.Thread(target=wait, args=(PRIORITY_BATCH,))
+    batch.start()
+    time.sleep(0.05)
+    interactive = threading.Thread(target=wait, args=(PRIORITY_INTERACTIVE,))
+    interactive.start()
+    batch.join()
+    interactive.join()
+    assert order == [PRIORITY_INTERACTIVE, PRIORITY_BATCH]
@@ -0,0 +1,143 @@
+import asyncio
+import threading
+import time
+
+from cancellation import CancelToken
+from singleflight import SingleFlight
+
+class Upstream:
+    """Stream factory that emits `chunks` once released, and records every start and cancellation."""
+
+    def __init__(self, chunks=("a", "b", "c")):
+        self.chunks = chunks
+        self.calls = 0
+        self.release = threading.Event()
+        self.cancel_events = []
+
+    def __call__(self, cancel_event):
+        self.calls += 1
+        self.cancel_events.append(cancel_event)
+
+        def generate():
+            self.release.wait(5)
+            for chunk in self.chunks:
+                if cancel_event.is_set():
+                    return
+                yield chunk
+
+        return generate()
+
+def _collect(flight, key, upstream, results, joined, **kwargs):
+    def on_join(is_leader):
+        joined.append(is_leader)
+
+    results.append("".join(flight.stream(key, upstream, on_join, **kwargs)))
+
+def test_concurrent_callers_share_one_upstream():
+    flight, upstream = SingleFlight(), Upstream()
+    results, joined = [], []
+    threads = [threading.Thread(target=_collect, args=(flight, "k", upstream, results, joined)) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    while len(joined) < 5:
+        time.sleep(0.01)
+    upstream.release.set()
+    for thread in threads:
+        thread.join(5)
+    assert upstream.calls == 1
+    assert results == ["abc"] * 5
+    assert sorted(joined) == [False, False, False, False, True]
+    assert flight.in_flight() == 0
+
+def test_different_keys_do_not_coalesce():
+    flight, upstream = SingleFlight(), Upstream()
+    upstream.release.set()
+    assert "".join(flight.stream("k1", upstream)) == "abc"
+    assert "".join(flight.stream("k2", upstream)) == "abc"
+    assert upstream.calls == 2
+
+def test_late_joiner_gets_the_buffered_prefix():
+    flight = SingleFlight()
+    gate = threading.Event()
+
+    def upstream(cancel_event):
+        yield "first "
+        gate.wait(5)
+        yield "second"
+
+    leader = flight.stream("k", upstream)
+    assert next(leader) == "first "
+    follower = flight.stream("k", upstream)
+    assert next(follower) == "first "  # ✅ Replayed from the buffer
+    gate.set()
+    assert "".join(leader) == "second"
+    assert "".join(follower) == "second"
+
+def test_upstream_is_cancelled_once_every_subscriber_leaves():
+    flight, cancel_events = SingleFlight(), []
+    gate = threading.Event()
+
+    def upstream(cancel_event):
+        cancel_events.append(cancel_event)
+        yield "a"
+        gate.wait(5)
+        yield "b"
+
+    first = flight.stream("k", upstream)
+    second = flight.stream("k", upstream)
+    next(first)
+    next(second)
+    first.close()
+    assert not cancel_events[0].is_set()
+    second.close()
+    assert cancel_events[0].reason == "abandoned"
+    assert flight.in_flight() == 0
+    gate.set()
+
+def test_own_cancel_token_unsubscribes_the_caller():
+    flight, upstream = SingleFlight(), Upstream()
+    token = CancelToken()
+    results, joined = [], []
+    thread = threading.Thread(target=_collect, args=(flight, "k", upstream, results, joined), kwargs={"cancel": token})
+    thread.start()
+    while not joined:
+        time.sleep(0.01)
+    token.cancel("deadline")
+    thread.join(5)
+    assert results == [""]
+    assert upstream.cancel_events[0].is_set()  # ✅ It was the only subscriber
+    upstream.release.set()
+
+def test_failing_upstream_ends_every_subscriber():
+    flight = SingleFlight()
+
+    def upstream(cancel_event):
+        yield "partial"
+        raise RuntimeError("stream broke")
+
+    assert "".join(flight.stream("k", upstream)) == "partial"
+    assert flight.in_flight() == 0
+
+def test_astream_coalesces_on_the_event_loop():
+    flight = SingleFlight()
+    calls = []
+
+    def upstream(cancel_event):
+        calls.append(cancel_event)
+
+        async def generate():
+            await asyncio.sleep(0.05)
+            for chunk in ("x", "y"):
+                yield chunk
+
+        return generate()
+
+    async def consume():
+        return "".join([chunk async for chunk in flight.astream("k", upstream)])
+
+    async def main():
+        return await asyncio.gather(*[consume() for _ in range(10)])
+
+    assert asyncio.run(main()) == ["xy"] * 10
+    assert len(calls) == 1
+    assert flight.in_flight() == 0
@@ -0,0 +1,92 @@
+import time
+
+import pytest
+
+import awsclients
+import fakebedrock
+import genailib
+from chatmessage import ChatMessage
+from citations import CitationChunk
+from scheduler import BedrockScheduler
+
+ANSWER_TOKENS = 30
+ANSWER = "".join(fakebedrock._answer_tokens(ANSWER_TOKENS))
+
+class RecordingRuntime(fakebedrock.FakeBedrockRuntime):
+    """FakeBedrockRuntime that keeps every response body it hands out."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.bodies = []
+
+    def invoke_model_with_response_stream(self, modelId, body, **kwargs):
+        response = super().invoke_model_with_response_stream(modelId, body, **kwargs)
+        self.bodies.append(response["body"])
+        return response
+
+@pytest.fixture(autouse=True)
+def offline(monkeypatch):
+    """Routes genailib to fakebedrock with no quota, caches, local index or router in the way."""
+    monkeypatch.setattr(genailib, "bedrock_scheduler", BedrockScheduler(1e6, 1e12))
+    monkeypatch.setattr(genailib, "RESPONSE_CACHE_ENABLED", False)
+    monkeypatch.setattr(genailib, "RETRIEVAL_CACHE_ENABLED", False)
+    monkeypatch.setattr(genailib, "LOCAL_INDEX_ENABLED", False)
+    monkeypatch.setattr(genailib, "ROUTER_ENABLED", False)
+    monkeypatch.setattr(genailib, "SPLIT_RETRIEVAL_ENABLED", False)
+    yield
+    awsclients.reset_clients()
+
+def _install(runtime=None, agent_runtime=None):
+    return fakebedrock.install(
+        runtime or fakebedrock.FakeBedrockRuntime(0, 0, ANSWER_TOKENS),
+        agent_runtime or fakebedrock.FakeAgentRuntime(0, 0, ANSWER_TOKENS, miss_rate=0, retrieve_delay=0),
+    )
+
+@pytest.mark.parametrize("frame_bytes", [0, 1, 5, 64])
+def test_model_stream_survives_any_frame_size(frame_bytes):
+    _install(fakebedrock.FakeBedrockRuntime(0, 0, ANSWER_TOKENS, frame_bytes=frame_bytes))
+    assert "".join(genailib.stream_ai_model("What is SCEP?", [])) == ANSWER
+
+def test_model_engine_chat_turn(monkeypatch):
+    runtime, _ = _install()
+    monkeypatch.setattr(genailib, "chat_engine", genailib.CHAT_ENGINES["model"])
+    history = []
+    answer = "".join(genailib.chat_with_model(history, "What is SCEP?", session_id="s1"))
+    assert answer == ANSWER
+    assert [message.role for message in history] == ["user", "assistant"]
+    assert history[1].text == ANSWER
+    assert runtime.calls == 1
+
+def test_kb_answer_streams_with_citations(monkeypatch):
+    _, agent_runtime = _install()
+    monkeypatch.setattr(genailib, "chat_engine", genailib.CHAT_ENGINES["kb"])
+    monkeypatch.setattr(genailib, "HEDGE_ENABLED", False)
+    chunks = list(genailib.query_knowledge_base_stream("What is SCEP?", []))
+    assert "".join(chunk for chunk in chunks if not isinstance(chunk, CitationChunk)) == ANSWER
+    assert any(isinstance(chunk, CitationChunk) for chunk in chunks)
+    assert agent_runtime.calls == 1
+
+@pytest.mark.parametrize("refusal_rate", [0.0, 1.0])
+def test_kb_miss_falls_back_to_claude(monkeypatch, refusal_rate):
+    runtime, agent_runtime = _install(
+        agent_runtime=fakebedrock.FakeAgentRuntime(0, 0, ANSWER_TOKENS, miss_rate=1, refusal_rate=refusal_rate, retrieve_delay=0),
+    )
+    monkeypatch.setattr(genailib, "chat_engine", genailib.CHAT_ENGINES["kb"])
+    monkeypatch.setattr(genailib, "HEDGE_ENABLED", False)
+    history = [ChatMessage("user", "Hello"), ChatMessage("assistant", "Hi, how can I help?")]
+    answer = "".join(genailib.chat_with_model(history, "What is SCEP?"))
+    assert answer == ANSWER
+    assert fakebedrock.KB_REFUSAL not in answer
+    assert (agent_runtime.calls, runtime.calls) == (1, 1)
+
+def test_closing_the_chat_closes_the_upstream_stream(monkeypatch):
+    runtime, _ = _install(RecordingRuntime(tokens_per_second=50, first_token_delay=0, answer_tokens=500))
+    monkeypatch.setattr(genailib, "chat_engine", genailib.CHAT_ENGINES["model"])
+    chat = genailib.chat_with_model([], "What is SCEP?")
+    next(chat)
+    chat.close()
+    deadline = time.monotonic() + 2
+    while not runtime.bodies[0].closed and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert runtime.bodies[0].closed
+    assert genailib.inflight.in_flight() == 0